@@ -0,0 +1,14 @@
+"""Background jobs of the arbeitsplan app, see svpb.jobs."""
+
+from django.utils.module_loading import import_string
+
+
+def notifications(job, workdir):
+    """Queue the mails of a FilteredEmailCreateView for the selected ids."""
+    view = import_string(job.arguments["view"])()
+    view.send(
+        job,
+        job.arguments["ids"],
+        job.arguments["anmerkungen"],
+        job.arguments["ergaenzung"],
+    )
@@ -1,60 +1,158 @@
-"""Check consistency of Meldungen.
+"""Check consistency of Meldungen, Zuteilungen and Bookings.
 
-There should be at most one Meldung per Aufgabe, per User.
+There should be at most one Meldung and one Zuteilung per Aufgabe, per User.
+StundenZuteilungen should only exist for hours of the Stundenplan, and active
+bookings of a boat should not overlap. Zuteilungen without a Meldung are
+listed as well, but they are no error: the Schnellzuweisung and the manual
+assignment create them on purpose.
 """
 
 import datetime
+import json
 
 from django.conf import settings
 from django.core.management import call_command
 from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Exists, OuterRef
 from django.utils import translation
 from post_office import mail
 
 import arbeitsplan.models as models
+from boote.models import Booking
+
+
+def doppelte_meldungen():
+    return (
+        models.Meldung.objects
+        .values("aufgabe", "aufgabe__aufgabe", "melder", "melder__username")
+        .annotate(anzahl=Count("id"))
+        .filter(anzahl__gt=1)
+        .order_by("aufgabe", "melder")
+    )
+
+
+def doppelte_zuteilungen():
+    return (
+        models.Zuteilung.objects
+        .values("aufgabe", "aufgabe__aufgabe", "ausfuehrer", "ausfuehrer__username")
+        .annotate(anzahl=Count("id"))
+        .filter(anzahl__gt=1)
+        .order_by("aufgabe", "ausfuehrer")
+    )
+
+
+def stunden_ausserhalb_stundenplan():
+    stundenplan = models.Stundenplan.objects.filter(
+        aufgabe=OuterRef("zuteilung__aufgabe"), uhrzeit=OuterRef("uhrzeit"),
+        anzahl__gt=0,
+    )
+    return (
+        models.StundenZuteilung.objects.filter(~Exists(stundenplan))
+        .values("id", "zuteilung", "zuteilung__aufgabe__aufgabe",
+                "zuteilung__ausfuehrer__username", "uhrzeit")
+        .order_by("zuteilung", "uhrzeit")
+    )
+
+
+def zuteilungen_ohne_meldung():
+    meldung = models.Meldung.objects.filter(
+        aufgabe=OuterRef("aufgabe"), melder=OuterRef("ausfuehrer")
+    )
+    return (
+        models.Zuteilung.objects.filter(~Exists(meldung))
+        .values("id", "aufgabe", "aufgabe__aufgabe", "ausfuehrer",
+                "ausfuehrer__username")
+        .order_by("aufgabe", "ausfuehrer")
+    )
+
+
+def ueberlappende_buchungen():
+    """Active bookings from today on, overlapping another one of the same boat."""
+    andere = Booking.objects.overlapping(
+        OuterRef("boat"), OuterRef("date"), OuterRef("time_from"), OuterRef("time_to")
+    ).exclude(pk=OuterRef("pk"))
+    return (
+        Booking.objects.filter(status=1, date__gte=datetime.date.today())
+        .filter(Exists(andere))
+        .values("id", "boat", "boat__name", "date", "time_from", "time_to",
+                "user__username")
+        .order_by("boat", "date", "time_from")
+    )
+
+
+# key: (description, scan returning one query of dicts, findings are mailed)
+SCANS = {
+    "doppelte_meldungen": (
+        "Folgende Meldungen liegen mehrfach vor", doppelte_meldungen, True),
+    "doppelte_zuteilungen": (
+        "Folgende Zuteilungen liegen mehrfach vor", doppelte_zuteilungen, True),
+    "stunden_ausserhalb_stundenplan": (
+        "Folgende Stundenzuteilungen liegen außerhalb des Stundenplans",
+        stunden_ausserhalb_stundenplan, True),
+    "zuteilungen_ohne_meldung": (
+        "Folgende Zuteilungen haben keine Meldung", zuteilungen_ohne_meldung,
+        False),
+    "ueberlappende_buchungen": (
+        "Folgende Buchungen überlappen sich", ueberlappende_buchungen, True),
+}
+
+
+def format_befunde(report, keys):
+    """Text listing the findings of the scans in keys, one line per finding."""
+    message = ""
+    for key in keys:
+        eintraege = report[key]
+        if not eintraege:
+            continue
+        message += f"{SCANS[key][0]}:\r\n"
+        message += ", ".join(eintraege[0]) + "\r\n"
+        for eintrag in eintraege:
+            message += ", ".join(str(v) for v in eintrag.values()) + "\r\n"
+        message += "\r\n"
+    return message
 
 
 class Command(BaseCommand):
-    """Check consistency of Meldungen.
+    """Check consistency of Meldungen, Zuteilungen and Bookings.
 
-    Go through all Users and Aufgaben. Check whether at most one Meldung exist.
+    Each scan in SCANS is a single query. Findings are printed, either as text
+    or as JSON (--json), and those of the scans marked in SCANS are sent to
+    the ADMINS.
     """
 
     help = "Check Meldung consistency, send out warning emails"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--json", action="store_true", help="Print the report as JSON"
+        )
+
     def handle(self, *args, **options):
         # Set the locale right, to get the dates represented correctly
         translation.activate(settings.LANGUAGE_CODE)
 
-        self.stdout.write(
-            "check_meldung_consistency: Checking on " + str(datetime.date.today())
+        heute = datetime.date.today()
+        report = {key: list(scan()) for key, (_, scan, _) in SCANS.items()}
+
+        if options["json"]:
+            self.stdout.write(json.dumps(
+                {"datum": heute, "befunde": report}, cls=DjangoJSONEncoder, indent=2
+            ))
+        else:
+            self.stdout.write("check_meldung_consistency: Checking on " + str(heute))
+            for key, eintraege in report.items():
+                self.stdout.write(f"check_meldung_consistency: {key}: {len(eintraege)}")
+            self.stdout.write(format_befunde(report, SCANS))
+
+        message = format_befunde(
+            report, [key for key, (_, _, alarm) in SCANS.items() if alarm]
         )
-
-        inconsistent_meldungen = []
-
-        for u in models.User.objects.all():
-            for a in models.Aufgabe.objects.all():
-                mqs = models.Meldung.objects.filter(melder=u, aufgabe=a)
-                c = mqs.count()
-                if c > 1:
-                    inconsistent_meldungen.append(mqs)
-
-        if inconsistent_meldungen:
-            message = "Folgende Meldungen liegen mehrfach vor:\r\n"
-            message += "primary keys, Melder, Aufgabe\r\n"
-            for entry in inconsistent_meldungen:
-                message += (
-                    f"{[meldung.pk for meldung in entry]}, {entry[0].melder}, "
-                    f"{entry[0].aufgabe}\r\n"
-                )
-            print(message)
-
-            subject = "[SVPB] Meldungen inkonsistent"
-
+        if message:
             mail.send(
                 recipients=[mail for _, mail in settings.ADMINS],
                 sender=settings.DEFAULT_FROM_EMAIL,
-                subject=subject,
+                subject="[SVPB] Daten inkonsistent",
                 message=message,
             )
 
@@ -1,5 +1,6 @@
 """Create xlsx document with info and working hours of members."""
 
+import hashlib
 import os
 
 from django.core.management.base import BaseCommand
@@ -11,77 +12,96 @@ from xlsxcursor import XlsxCursor
 import arbeitsplan.models as ap_models
 
 
-def get_attribute(instance, name):
-    """helper function: getattr does not follow foreign keys;
-    this version here does.
-    """
-
-    if hasattr(instance, name):
-        return getattr(instance, name)
-
-    names = name.split("__")
-    name = names.pop(0)
-    if len(names) == 0:
-        return ""
-
-    if hasattr(instance, name):
-        value = getattr(instance, name)
-        return get_attribute(value, "__".join(names))
-
-    return ""
-
-
 class Command(BaseCommand):
     """Produce an Excel file of all the Mitglieder.
 
-    Different filters are applied and output on separate sheets.
+    Different filters are applied and output on separate sheets. The file is
+    written to --output, by default SENDFILE_ROOT/FILENAME_MEMBER_EXCEL. A
+    checksum of the data is kept next to it, so an unchanged file is not
+    written again.
     """
 
     help = "Produce excel file of all Mitglieder"
 
-    def ExcelExport(self, qs, cursor, mod=None):
-        """Turn a query set into an Excel sheet.
-
-        Args:
-            - qs: Query set
-            - cursor: XlsxCursor object
-            - mod: Model with attribute excelFields defining properties to include in
-                    Excel sheet (defaults to model of query set)
-        """
-
-        if not mod:
-            mod = qs.model
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Write the file even if the data did not change",
+        )
+        parser.add_argument(
+            "--output",
+            help="Path of the Excel file (default: FILENAME_MEMBER_EXCEL "
+            "in SENDFILE_ROOT)",
+        )
 
-        for fieldname, fieldkey in mod.excelFields:
-            cursor(fieldname)
+    def get_rows(self):
+        """Fetch all Mitglieder with their balances as flat rows, in one query.
 
-        cursor("Noch zu leistende Stunden")
-        cursor.cr()
+        Each row is a tuple of the values of Mitglied.excelFields, followed by
+        the active flag of the user.
+        """
+        keys = [key for _, key in ap_models.Mitglied.excelFields]
+        return list(
+            ap_models.Mitglied.objects.with_balances()
+            .order_by("pk")
+            .values_list(*keys, "user__is_active")
+        )
 
-        row = 2
-        for r in qs:
-            for fieldname, fieldkey in mod.excelFields:
-                a = get_attribute(r, fieldkey)
-                if hasattr(a, "__call__"):
-                    a = a()
-                cursor(a)
-            cursor("=MAX(0,J{}-R{})".format(row, row))
-            cursor.cr()
-            row += 1
+    def get_sheets(self, rows):
+        """Distribute the rows onto the sheets, as (name, rows) pairs."""
+        keys = [key for _, key in ap_models.Mitglied.excelFields]
+        arbeitslast = keys.index("arbeitslast")
+        akzeptiert = keys.index("akzeptierte_stunden")
+        zugeteilt = keys.index("zugeteilte_stunden")
+        begin_coded = settings.BEGIN_CODED_HOURS_PER_YEAR
+
+        aktiv = [r for r in rows if r[-1]]
+        erfasst = [r for r in aktiv if r[arbeitslast] < begin_coded]
+        return [
+            ("Alle Mitglieder", aktiv),
+            ("Ehemalige Mitglieder", [r for r in rows if not r[-1]]),
+            (
+                "Keine Arbeitsdienst-Erfassung",
+                [r for r in aktiv if r[arbeitslast] >= begin_coded],
+            ),
+            (
+                "Zuteilungen unzureichend",
+                [
+                    r
+                    for r in erfasst
+                    if r[akzeptiert] < r[arbeitslast] and r[zugeteilt] < r[arbeitslast]
+                ],
+            ),
+            (
+                "Leistungen unzureichend",
+                [r for r in erfasst if r[akzeptiert] < r[arbeitslast]],
+            ),
+        ]
 
-    def createSheet(self, workbook, name, qs, mod=None):
+    def createSheet(self, workbook, name, rows):
         """Create sheet with info on Mitglieder.
 
         Args:
             - workbook: xlsxwriter Workbook object
             - name: Name of sheet
-            - qs: Query set
-            - mod: Model which contains fields to export in attribute excelFields
+            - rows: Rows as returned by get_rows
         """
         sheet = workbook.add_worksheet(name)
         sheet.set_column(0, 20, 15)
         cursor = XlsxCursor(workbook, sheet)
-        self.ExcelExport(qs, cursor, mod)
+
+        for fieldname, _ in ap_models.Mitglied.excelFields:
+            cursor(fieldname)
+        cursor("Noch zu leistende Stunden")
+        cursor.cr()
+
+        # rows are written strictly in order, as required by constant_memory
+        for row, r in enumerate(rows, start=2):
+            for value in r[:-1]:
+                cursor(value)
+            cursor("=MAX(0,J{}-R{})".format(row, row))
+            cursor.cr()
 
     def uebersichtsblatt(self, workbook):
         """Create overview sheet with info on following sheets.
@@ -143,64 +163,39 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         # set the locale right, to get the dates represented correctly
         translation.activate(settings.LANGUAGE_CODE)
-
-        # Create new file
-        workbook = xlsxwriter.Workbook(
-            os.path.join(settings.SENDFILE_ROOT, settings.FILENAME_MEMBER_EXCEL)
-        )
-        # Add overview sheet
-        self.uebersichtsblatt(workbook)
-
-        # Add sheets with actual content
-        self.createSheet(
-            workbook,
-            "Alle Mitglieder",
-            ap_models.Mitglied.objects.filter(user__is_active=True),
-        )
-
-        self.createSheet(
-            workbook,
-            "Ehemalige Mitglieder",
-            ap_models.Mitglied.objects.filter(user__is_active=False),
-        )
-
-        self.createSheet(
-            workbook,
-            "Keine Arbeitsdienst-Erfassung",
-            ap_models.Mitglied.objects.filter(
-                user__is_active=True,
-                arbeitslast__gte=settings.BEGIN_CODED_HOURS_PER_YEAR,
-            ),
-        )
-
-        self.createSheet(
-            workbook,
-            "Zuteilungen unzureichend",
-            [
-                m
-                for m in ap_models.Mitglied.objects.filter(
-                    user__is_active=True
-                ).exclude(arbeitslast__gte=settings.BEGIN_CODED_HOURS_PER_YEAR)
-                if (
-                    m.arbeitslast > m.akzeptierteStunden()
-                    and m.arbeitslast > m.zugeteilteStunden()
-                )
-            ],
-            ap_models.Mitglied,
-        )
-
-        self.createSheet(
-            workbook,
-            "Leistungen unzureichend",
-            [
-                m
-                for m in ap_models.Mitglied.objects.filter(
-                    user__is_active=True
-                ).exclude(arbeitslast__gte=settings.BEGIN_CODED_HOURS_PER_YEAR)
-                if (m.arbeitslast > m.akzeptierteStunden())
-            ],
-            ap_models.Mitglied,
-        )
-
-        workbook.close()
-        translation.deactivate()
+        try:
+            rows = self.get_rows()
+            path = options["output"] or os.path.join(
+                settings.SENDFILE_ROOT, settings.FILENAME_MEMBER_EXCEL
+            )
+
+            # The file is only written again if the data changed since the last run
+            checksum = hashlib.sha256(repr(rows).encode()).hexdigest()
+            checksum_path = path + ".sha256"
+            if not options["force"] and os.path.exists(path):
+                try:
+                    with open(checksum_path) as f:
+                        if f.read() == checksum:
+                            self.stdout.write("Excel file is up to date.")
+                            return
+                except FileNotFoundError:
+                    pass
+
+            # Write to a new file and replace the old one afterwards, so concurrent
+            # downloads never get a partial file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            workbook = xlsxwriter.Workbook(tmp_path, {"constant_memory": True})
+            # Add overview sheet
+            self.uebersichtsblatt(workbook)
+
+            # Add sheets with actual content
+            for name, sheet_rows in self.get_sheets(rows):
+                self.createSheet(workbook, name, sheet_rows)
+
+            workbook.close()
+            os.replace(tmp_path, path)
+            with open(checksum_path, "w") as f:
+                f.write(checksum)
+            self.stdout.write(f"Excel file written with {len(rows)} Mitglieder.")
+        finally:
+            translation.deactivate()
@@ -1,12 +1,14 @@
 """Notify members about assignments to tasks."""
 
-from datetime import datetime, timezone
+import time
 
 from django.core.management import call_command
 from django.core.management.base import BaseCommand
-from django.utils import translation
+from django.db.models import Prefetch, Q
+from django.utils import timezone, translation
 from django.conf import settings
 from post_office import mail
+from post_office.models import EmailTemplate
 
 from arbeitsplan.models import Mitglied, Zuteilung
 
@@ -22,30 +24,99 @@ class Command(BaseCommand):
           assignments and timetable assignments are created successively
     Individual changes are not stored in the database, so this command always
     sends a summary of all existing assignments.
+
+    All flagged members are loaded with their assignments in three queries, the
+    mails are queued with one bulk insert and the flags are cleared with one
+    UPDATE. Members whose assignments changed while the command was running keep
+    their flag (see Mitglied.zuteilungGeaendert) and are notified next time.
     """
 
     help = "Notify members about assignments to tasks."
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only list the members to notify, do not queue mails or clear flags",
+        )
+
     def handle(self, *args, **options):
         # Set the locale right, to get the dates represented correctly
         translation.activate(settings.LANGUAGE_CODE)
+        start = timezone.now()
+        t0 = time.perf_counter()
+
+        # Get members with pending notification, with all data used in the mail
+        members = list(
+            Mitglied.objects.filter(zuteilungBenachrichtigungNoetig=True)
+            .select_related("user")
+            .prefetch_related(
+                Prefetch(
+                    "user__zuteilung_set",
+                    queryset=Zuteilung.objects.select_related(
+                        "aufgabe__verantwortlich"
+                    )
+                    .prefetch_related("stundenzuteilung_set")
+                    .order_by("pk"),
+                    to_attr="zuteilungen",
+                )
+            )
+        )
+        t1 = time.perf_counter()
 
-        # Get members with pending notification
-        for member in Mitglied.objects.filter(zuteilungBenachrichtigungNoetig=True):
+        template = EmailTemplate.objects.get(name="zuteilungEmail")
+        kwargs_list = []
+        without_email = []
+        for member in members:
+            if not member.user.email:
+                without_email.append(member)
+                continue
             # Prepare mail context
-            context = {
-                "first_name": member.user.first_name,
-                "last_name": member.user.last_name,
-                "u": member.user,
-                "zuteilungen": Zuteilung.objects.filter(ausfuehrer=member.user),
-            }
-            # Add mail to queue
-            mail.send([member.user.email], template="zuteilungEmail", context=context)
-
-            # Clear pending notification
-            member.zuteilungsbenachrichtigung = datetime.now(timezone.utc)
-            member.zuteilungBenachrichtigungNoetig = False
-            member.save()
+            kwargs_list.append({
+                "recipients": [member.user.email],
+                "template": template,
+                "context": {
+                    "first_name": member.user.first_name,
+                    "last_name": member.user.last_name,
+                    "u": member.user,
+                    "zuteilungen": member.user.zuteilungen,
+                },
+            })
+
+        for member in without_email:
+            self.stdout.write(
+                f"No email address: {member.user.first_name} {member.user.last_name} "
+                f"({member.mitgliedsnummer})"
+            )
+        if options["dry_run"]:
+            for kwargs in kwargs_list:
+                self.stdout.write(
+                    f"Would notify {kwargs['recipients'][0]} about "
+                    f"{len(kwargs['context']['zuteilungen'])} assignments"
+                )
+            self.stdout.write(
+                f"Dry run: {len(kwargs_list)} mails, loaded in {t1 - t0:.2f} s"
+            )
+            translation.deactivate()
+            return
+
+        # Add mails to queue, rendered here
+        mail.send_many(kwargs_list)
+        t2 = time.perf_counter()
+
+        # Clear pending notifications, unless assignments changed in the meantime
+        cleared = (
+            Mitglied.objects.filter(pk__in=[member.pk for member in members])
+            .filter(Q(zuteilungGeaendert__isnull=True) | Q(zuteilungGeaendert__lte=start))
+            .update(zuteilungBenachrichtigungNoetig=False, zuteilungsbenachrichtigung=start)
+        )
+        t3 = time.perf_counter()
+        self.stdout.write(
+            f"Queued {len(kwargs_list)} mails for {len(members)} members "
+            f"({len(members) - cleared} changed meanwhile) in {t3 - t0:.2f} s: "
+            f"loading {t1 - t0:.2f} s, rendering {t2 - t1:.2f} s, "
+            f"clearing flags {t3 - t2:.2f} s"
+        )
 
         # Actually send mails
         call_command("send_queued_mail")
@@ -1,6 +1,7 @@
 """Send email reminders to everybody who has a job coming up in the following days."""
 
 import datetime
+import time
 from collections import defaultdict
 
 from django.conf import settings
@@ -8,6 +9,7 @@ from django.core.management import call_command
 from django.core.management.base import BaseCommand
 from django.utils import translation
 from post_office import mail
+from post_office.models import EmailTemplate
 
 import arbeitsplan.models as models
 
@@ -15,43 +17,59 @@ import arbeitsplan.models as models
 class Command(BaseCommand):
     """Notify about upcoming jobs in leaddays days.
 
-    Grab all users which have a job starting in leaddays days.
-    Send out emails to them.
-    Store all those data in a list, to be sent to the corresponding
-    responsible person as well.
+    Grab all users which have a job starting in one of the given leaddays
+    (e.g. 2 and 5 days) and send out emails to them. For each day, the
+    responsible person of the tasks gets one digest listing the reminders of
+    his/her tasks.
+
+    All assignments are loaded in two queries (assignments with task, member and
+    responsible, and their hours) and all mails are queued with one bulk insert.
     """
 
     help = "Send emails for upcoming jobs with given leaddays"
 
     def add_arguments(self, parser):
         parser.add_argument(
-            "leaddays", type=int, help="days to look in the future for jobs"
+            "leaddays", type=int, nargs="+",
+            help="days to look in the future for jobs, e.g. 2 5",
         )
 
     def handle(self, *args, **options):
         # Set the locale right, to get the dates represented correctly
         translation.activate(settings.LANGUAGE_CODE)
+        t0 = time.perf_counter()
 
-        self.stdout.write("upcomingJob: Checking on " + str(datetime.date.today()))
+        today = datetime.date.today()
+        self.stdout.write("upcomingJob: Checking on " + str(today))
 
-        # Find out the target date to be used in zuteilung filter
-        target_date = datetime.date.today() + datetime.timedelta(
-            days=options["leaddays"]
+        # Find out the target dates to be used in zuteilung filter
+        target_dates = sorted(
+            {today + datetime.timedelta(days=d) for d in options["leaddays"]}
         )
 
-        zuteilung_target_date = models.Zuteilung.objects.filter(
-            aufgabe__datum=target_date
+        zuteilungen = (
+            models.Zuteilung.objects.filter(aufgabe__datum__in=target_dates)
+            .select_related(
+                "aufgabe__verantwortlich__mitglied", "ausfuehrer__mitglied"
+            )
+            .prefetch_related("stundenzuteilung_set")
+            .order_by("aufgabe__datum", "aufgabe__aufgabe", "pk")
         )
 
-        self.stdout.write(
-            f"upcomingJob: Found {zuteilung_target_date.count()} Zuteilungen "
-            f"for {target_date}"
-        )
+        templates = {
+            t.name: t for t in EmailTemplate.objects.filter(
+                name__in=["upcomingJob", "upcomingJob-Kontakt"],
+                default_template__isnull=True,
+            )
+        }
 
-        kontaktKontext = defaultdict(list)
+        # per day: number of reminders, and the reminders per responsible person
+        erinnerungen = defaultdict(int)
+        kontaktKontext = defaultdict(lambda: defaultdict(list))
+        kwargs_list = []
 
-        # Send mails to assigned members
-        for z in zuteilung_target_date:
+        # Mails to assigned members
+        for z in zuteilungen:
             kontakt = z.aufgabe.verantwortlich
             context = {
                 "datum": z.aufgabe.datum,
@@ -62,35 +80,46 @@ class Command(BaseCommand):
                 "verantwortlich": kontakt,
             }
 
-            kontaktKontext[kontakt].append(context)
+            kontaktKontext[z.aufgabe.datum][kontakt].append(context)
 
             if z.ausfuehrer.email:
-                mail.send(
-                    [z.ausfuehrer.email],
-                    template="upcomingJob",
-                    context=context,
-                )
+                erinnerungen[z.aufgabe.datum] += 1
+                kwargs_list.append({
+                    "recipients": [z.ausfuehrer.email],
+                    "template": templates["upcomingJob"],
+                    "context": context,
+                })
 
         # For each verantwortlicher with a task someone has been reminded about, send
         # him/her an email reminding about the reminding
-        for kontakt, liste in kontaktKontext.items():
-            if kontakt.email:
-                mail.send(
-                    [kontakt.email],
-                    template="upcomingJob-Kontakt",
-                    context={
+        digests = defaultdict(int)
+        for datum, kontakte in kontaktKontext.items():
+            for kontakt, liste in kontakte.items():
+                if not kontakt.email:
+                    continue
+                digests[datum] += 1
+                kwargs_list.append({
+                    "recipients": [kontakt.email],
+                    "template": templates["upcomingJob-Kontakt"],
+                    "context": {
                         "liste": liste,
                         "verantwortlich": kontakt,
-                        "aufgabe": z.aufgabe,
-                    },
-                    headers={
-                        "Reply-to": (
-                            z.aufgabe.verantwortlich.email
-                            if z.aufgabe.verantwortlich.email
-                            else settings.DEFAULT_FROM_EMAIL
-                        ),
+                        "aufgabe": liste[0]["aufgabe"],
                     },
-                )
+                    "headers": {"Reply-to": kontakt.email},
+                })
+
+        mail.send_many(kwargs_list)
+
+        for datum in target_dates:
+            self.stdout.write(
+                f"upcomingJob: {datum}: {erinnerungen[datum]} reminders, "
+                f"{digests[datum]} digests"
+            )
+        self.stdout.write(
+            f"upcomingJob: Queued {len(kwargs_list)} mails "
+            f"in {time.perf_counter() - t0:.2f} s"
+        )
 
         # And finally send out all queued mails
         call_command("send_queued_mail")
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.14 on 2026-10-18 15:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('arbeitsplan', '0027_alter_leistung_wann'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mitglied',
+            name='zuteilungGeaendert',
+            field=models.DateTimeField(blank=True, help_text='Wann wurde die Benachrichtigung zu Zuteilungen zuletzt nötig?', null=True, verbose_name='Zuteilungen geändert'),
+        ),
+    ]
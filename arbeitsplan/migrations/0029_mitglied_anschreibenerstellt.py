@@ -0,0 +1,18 @@
+# Generated by Django 5.2.14 on 2026-10-18 16:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('arbeitsplan', '0028_mitglied_zuteilunggeaendert'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mitglied',
+            name='anschreibenErstellt',
+            field=models.DateTimeField(blank=True, help_text='Wann wurde das letzte Anschreiben mit Passwort erstellt?', null=True, verbose_name='Anschreiben erstellt'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations
+
+# notifyVorstand passes the names of all changed Aufgaben as aufgaben
+ALT = "{{ meldung.aufgabe }}"
+NEU = "{{ aufgaben }}"
+
+
+def ersetzen(apps, alt, neu):
+    EmailTemplate = apps.get_model("post_office", "EmailTemplate")
+    for template in EmailTemplate.objects.filter(name="meldungNotify"):
+        for field in ("subject", "content", "html_content"):
+            setattr(template, field, getattr(template, field).replace(alt, neu))
+        template.save()
+
+
+def vorwaerts(apps, schema_editor):
+    ersetzen(apps, ALT, NEU)
+
+
+def rueckwaerts(apps, schema_editor):
+    ersetzen(apps, NEU, ALT)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('arbeitsplan', '0029_mitglied_anschreibenerstellt'),
+        ('post_office', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(vorwaerts, rueckwaerts),
+    ]
@@ -18,9 +18,23 @@ Main classes:
 """
 import datetime
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import (
+    Case,
+    Count,
+    Exists,
+    F,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
 
 
@@ -32,6 +46,158 @@ User.__str__ = lambda s: "%s %s (Nr.: %s)" % (
 )
 
 
+def _summe(qs, group, expression, output_field):
+    """Turn a per-user queryset into a scalar subquery summing expression.
+
+    qs has to be filtered down to a single user via OuterRef already; group is the
+    name of the foreign key to that user, which yields exactly one group.
+    """
+    return Coalesce(
+        Subquery(
+            qs.order_by().values(group).annotate(summe=expression).values("summe"),
+            output_field=output_field,
+        ),
+        Value(0),
+        output_field=output_field,
+    )
+
+
+def balance_annotations():
+    """Build the annotations used by :meth:`MitgliedQuerySet.with_balances`.
+
+    Every figure is a correlated subquery, so annotating a whole page of
+    Mitglieder costs a single query, independent of the number of members.
+    """
+    today = datetime.date.today()
+    stunden = models.IntegerField()
+    zeit = models.DecimalField(max_digits=8, decimal_places=1)
+
+    meldungen = Meldung.objects.filter(melder=OuterRef("user")).exclude(
+        prefMitglied=Meldung.Preferences.NO
+    )
+    zuteilungen = Zuteilung.objects.with_stunden().filter(
+        ausfuehrer=OuterRef("user")
+    )
+    leistungen = Leistung.objects.filter(melder=OuterRef("user"))
+
+    return {
+        "gemeldete_anzahl": _summe(meldungen, "melder", Count("pk"), stunden),
+        "gemeldete_stunden": _summe(
+            meldungen, "melder", Sum("aufgabe__stunden"), stunden
+        ),
+        "zugeteilte_anzahl": _summe(zuteilungen, "ausfuehrer", Count("pk"), stunden),
+        "zugeteilte_stunden": _summe(
+            zuteilungen, "ausfuehrer", Sum("stunden_zuteilung"), stunden
+        ),
+        "zugeteilte_stunden_vergangen": _summe(
+            zuteilungen.filter(aufgabe__datum__lte=today),
+            "ausfuehrer",
+            Sum("stunden_zuteilung"),
+            stunden,
+        ),
+        "zugeteilte_stunden_zukuenftig": _summe(
+            zuteilungen.filter(aufgabe__datum__gt=today),
+            "ausfuehrer",
+            Sum("stunden_zuteilung"),
+            stunden,
+        ),
+        "zugeteilte_stunden_ohne_datum": _summe(
+            zuteilungen.filter(aufgabe__datum__isnull=True),
+            "ausfuehrer",
+            Sum("stunden_zuteilung"),
+            stunden,
+        ),
+        "behauptete_stunden": _summe(leistungen, "melder", Sum("zeit"), zeit),
+        "akzeptierte_stunden": _summe(
+            leistungen.filter(status=Leistung.Status.ACCEPTED),
+            "melder",
+            Sum("zeit"),
+            zeit,
+        ),
+        "offene_stunden": _summe(
+            leistungen.filter(status=Leistung.Status.OPEN), "melder", Sum("zeit"), zeit
+        ),
+        "abgelehnte_stunden": _summe(
+            leistungen.filter(status=Leistung.Status.REJECTED),
+            "melder",
+            Sum("zeit"),
+            zeit,
+        ),
+    }
+
+
+class MitgliedQuerySet(models.QuerySet):
+    def with_balances(self, *names):
+        """Annotate every Mitglied with its hour totals.
+
+        Adds gemeldete_anzahl, gemeldete_stunden, zugeteilte_anzahl,
+        zugeteilte_stunden (also split into _vergangen, _zukuenftig and
+        _ohne_datum), behauptete_stunden, akzeptierte_stunden, offene_stunden and
+        abgelehnte_stunden. The corresponding methods of :class:`Mitglied` use these
+        values if present. The annotations can be used in filter() as well.
+
+        Pass names to restrict the annotations to the given figures.
+        """
+        annotations = balance_annotations()
+        if names:
+            annotations = {name: annotations[name] for name in names}
+        return self.annotate(**annotations)
+
+    def saldenstatus(self, status):
+        """Restrict to Mitglieder with the given Saldenstatus, in the database.
+
+        - OK: accepted Leistungen reach the arbeitslast
+        - CH: not OK yet, but accepted and open Leistungen plus the Zuteilungen
+          in the future or without date reach the arbeitslast
+        - PR: even that is not enough
+        """
+        qs = self.with_balances(
+            "akzeptierte_stunden",
+            "offene_stunden",
+            "zugeteilte_stunden_zukuenftig",
+            "zugeteilte_stunden_ohne_datum",
+        ).alias(
+            erreichbare_stunden=models.ExpressionWrapper(
+                F("akzeptierte_stunden")
+                + F("offene_stunden")
+                + F("zugeteilte_stunden_zukuenftig")
+                + F("zugeteilte_stunden_ohne_datum"),
+                output_field=models.DecimalField(max_digits=8, decimal_places=1),
+            )
+        )
+        return {
+            "OK": lambda: qs.filter(akzeptierte_stunden__gte=F("arbeitslast")),
+            "CH": lambda: qs.filter(
+                akzeptierte_stunden__lt=F("arbeitslast"),
+                erreichbare_stunden__gte=F("arbeitslast"),
+            ),
+            "PR": lambda: qs.filter(erreichbare_stunden__lt=F("arbeitslast")),
+        }[status]()
+
+    def benachrichtigung_noetig(self):
+        """Flag Zuteilung notifications with one UPDATE of only the flag and its
+        timestamp."""
+        return self.update(
+            zuteilungBenachrichtigungNoetig=True, zuteilungGeaendert=timezone.now()
+        )
+
+
+def benachrichtigung_vormerken(users):
+    """Flag the Mitglieder of users (User objects or ids) for a Zuteilung notification.
+
+    The users are flagged with a single UPDATE ... WHERE user_id IN (...) once
+    the current transaction commits (immediately outside of a transaction), so
+    a bulk operation passing all its users writes once instead of saving every
+    Mitglied. If the transaction or savepoint is rolled back, nothing is flagged.
+    """
+    users = set(getattr(u, "pk", u) for u in users)
+    if not users:
+        return
+    transaction.on_commit(
+        lambda: Mitglied.objects.filter(user__in=users).benachrichtigung_noetig()
+    )
+
+
 class Mitglied(models.Model):
     """Provide additional information on a User by a 1:1 relationship:
     ID, dates of messages
@@ -74,15 +240,17 @@ class Mitglied(models.Model):
         ("Ort", "ort"),
         ("Status", "status"),
         ("Arbeitslast", "arbeitslast"),
-        ("# Meldungen", "gemeldeteAnzahlAufgaben"),
-        ("Stunden Meldungen ", "gemeldeteStunden"),
-        ("# Zuteilungen", "zugeteilteAufgaben"),
-        ("Stunden Zuteilungen", "zugeteilteStunden"),
-        ("Behauptete Leistungen (h) insges.", "behaupteteStunden"),
-        ("Unbearbeitete Leistungen (h)", "offeneStunden"),
-        ("Abgelehnte Leistungen (h)", "abgelehnteStunden"),
-        ("Akzeptierte Leistungen (h)", "akzeptierteStunden"),
+        ("# Meldungen", "gemeldete_anzahl"),
+        ("Stunden Meldungen ", "gemeldete_stunden"),
+        ("# Zuteilungen", "zugeteilte_anzahl"),
+        ("Stunden Zuteilungen", "zugeteilte_stunden"),
+        ("Behauptete Leistungen (h) insges.", "behauptete_stunden"),
+        ("Unbearbeitete Leistungen (h)", "offene_stunden"),
+        ("Abgelehnte Leistungen (h)", "abgelehnte_stunden"),
+        ("Akzeptierte Leistungen (h)", "akzeptierte_stunden"),
     ]
+    """Columns of the member Excel file: title and field or
+    :meth:`MitgliedQuerySet.with_balances` annotation, usable in values()."""
 
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     """Couple Mitglied to User via 1:1 field."""
@@ -107,6 +275,24 @@ class Mitglied(models.Model):
     )
     """Does Mitglied need a message?"""
 
+    zuteilungGeaendert = models.DateTimeField(
+        help_text="Wann wurde die Benachrichtigung zu Zuteilungen zuletzt nötig?",
+        null=True,
+        blank=True,
+        verbose_name="Zuteilungen geändert",
+    )
+    """Date and time zuteilungBenachrichtigungNoetig was last set, see
+    :func:`benachrichtigung_vormerken`"""
+
+    anschreibenErstellt = models.DateTimeField(
+        help_text="Wann wurde das letzte Anschreiben mit Passwort erstellt?",
+        null=True,
+        blank=True,
+        verbose_name="Anschreiben erstellt",
+    )
+    """Date and time of the most recent password letter, see
+    :func:`mitglieder.views.preparePassword`"""
+
     geburtsdatum = models.DateField(
         default=datetime.date(1900, 1, 1),
         verbose_name="Geburtsdatum",
@@ -145,24 +331,35 @@ class Mitglied(models.Model):
         default=12,
     )
 
+    objects = MitgliedQuerySet.as_manager()
+
     def __str__(self):
         return self.user.__str__()
 
+    def _balance(self, name):
+        """Return a balance figure, preferably from with_balances() annotations.
+
+        Instances not fetched via :meth:`MitgliedQuerySet.with_balances` compute
+        the single figure with one query.
+        """
+        if hasattr(self, name):
+            return getattr(self, name)
+        return (
+            Mitglied.objects.filter(pk=self.pk)
+            .annotate(**{name: balance_annotations()[name]})
+            .values_list(name, flat=True)
+            .get()
+        )
+
     def gemeldeteAnzahlAufgaben(self):
-        return self.user.meldung_set.exclude(
-            prefMitglied=Meldung.Preferences.NO
-        ).count()
+        return self._balance("gemeldete_anzahl")
 
     def gemeldeteStunden(self):
         """Compute hours for which the Mitglied has entered a Meldung."""
-        echteMeldungen = self.user.meldung_set.exclude(
-            prefMitglied=Meldung.Preferences.NO
-        )
-        return sum([m.aufgabe.stunden for m in echteMeldungen])
+        return self._balance("gemeldete_stunden")
 
     def zugeteilteAufgaben(self):
-        z = self.user.zuteilung_set.all()
-        return z.count()
+        return self._balance("zugeteilte_anzahl")
 
     def zugeteilteStunden(self, time=None):
         """Compute hours already assigned to this user.
@@ -178,33 +375,26 @@ class Mitglied(models.Model):
         :returns: Hours assigned to user, for the desired time frame.
         :rtype: int
         """
-        qs = self.user.zuteilung_set.all()
-
-        if time == -1:
-            qs = qs.filter(aufgabe__datum__lte=datetime.date.today())
-        if time == +1:
-            qs = qs.filter(aufgabe__datum__gt=datetime.date.today())
-        if time == 0:
-            qs = qs.filter(aufgabe__datum__isnull=True)
-
-        stundenlist = [z.stunden() for z in qs]
-        return sum(stundenlist)
+        return self._balance(
+            {
+                None: "zugeteilte_stunden",
+                -1: "zugeteilte_stunden_vergangen",
+                +1: "zugeteilte_stunden_zukuenftig",
+                0: "zugeteilte_stunden_ohne_datum",
+            }[time]
+        )
 
     def behaupteteStunden(self):
-        leistungen = self.user.leistung_set.all()
-        return sum([leistung.zeit for leistung in leistungen])
+        return self._balance("behauptete_stunden")
 
     def akzeptierteStunden(self):
-        leistungen = self.user.leistung_set.filter(status=Leistung.Status.ACCEPTED)
-        return sum([leistung.zeit for leistung in leistungen])
+        return self._balance("akzeptierte_stunden")
 
     def offeneStunden(self):
-        leistungen = self.user.leistung_set.filter(status=Leistung.Status.OPEN)
-        return sum([leistung.zeit for leistung in leistungen])
+        return self._balance("offene_stunden")
 
     def abgelehnteStunden(self):
-        leistungen = self.user.leistung_set.filter(status=Leistung.Status.REJECTED)
-        return sum([leistung.zeit for leistung in leistungen])
+        return self._balance("abgelehnte_stunden")
 
     def profileIncomplete(self):
         r = []
@@ -261,6 +451,48 @@ def validate_notDot(value):
         )
 
 
+class AufgabeQuerySet(models.QuerySet):
+    def with_summary(self):
+        """Annotate the figures shown in Zuteilung tables and overviews.
+
+        Adds anzahl_meldungen (without vetos), anzahl_zuteilungen, hat_stundenplan
+        and stundenplan_vollstaendig. The corresponding methods of :class:`Aufgabe`
+        use these values if present.
+        """
+        anzahl = models.IntegerField()
+        stundenplan = Stundenplan.objects.filter(aufgabe=OuterRef("pk"), anzahl__gt=0)
+        # people assigned to a single hour; Zuteilung.zusatzhelfer counts extra
+        besetzt = _summe(
+            StundenZuteilung.objects.filter(
+                zuteilung__aufgabe=OuterRef("aufgabe"), uhrzeit=OuterRef("uhrzeit")
+            ),
+            "uhrzeit",
+            Sum(F("zuteilung__zusatzhelfer") + 1),
+            anzahl,
+        )
+
+        return self.annotate(
+            anzahl_meldungen=_summe(
+                Meldung.objects.filter(aufgabe=OuterRef("pk")).exclude(
+                    prefMitglied=Meldung.Preferences.NO
+                ),
+                "aufgabe",
+                Count("pk"),
+                anzahl,
+            ),
+            anzahl_zuteilungen=_summe(
+                Zuteilung.objects.filter(aufgabe=OuterRef("pk")),
+                "aufgabe",
+                Count("pk"),
+                anzahl,
+            ),
+            hat_stundenplan=Exists(stundenplan),
+            stundenplan_vollstaendig=~Exists(
+                stundenplan.annotate(besetzt=besetzt).filter(anzahl__gt=F("besetzt"))
+            ),
+        )
+
+
 class Aufgabe(models.Model):
     aufgabe = models.CharField(max_length=50, validators=[validate_notDot], unique=True)
     verantwortlich = models.ForeignKey(
@@ -291,19 +523,34 @@ class Aufgabe(models.Model):
 
     bemerkung = models.TextField(blank=True)
 
+    objects = AufgabeQuerySet.as_manager()
+
     def numMeldungen(self):
         """How many Meldungen of status better than NO
         exist for this Aufgabe?
         """
+        if hasattr(self, "anzahl_meldungen"):
+            return self.anzahl_meldungen
         return self.meldung_set.exclude(prefMitglied=Meldung.Preferences.NO).count()
 
+    def numZuteilungen(self):
+        """How many Zuteilungen exist for this Aufgabe?"""
+        if hasattr(self, "anzahl_zuteilungen"):
+            return self.anzahl_zuteilungen
+        return self.zuteilung_set.count()
+
     def has_Stundenplan(self):
         """Is there a Stundenplan for this Aufgabe?"""
+        if hasattr(self, "hat_stundenplan"):
+            return self.hat_stundenplan
 
         return self.stundenplan_set.filter(anzahl__gt=0).count() > 0
 
     def stundenplan_complete(self):
         """Is there enough manpower for every hour in the Stundenplan?"""
+        if hasattr(self, "stundenplan_vollstaendig"):
+            return self.stundenplan_vollstaendig
+
         stundenplan = self.stundenplan_set.filter(anzahl__gt=0)
         if stundenplan.count() > 0:
             for s in stundenplan:
@@ -318,7 +565,7 @@ class Aufgabe(models.Model):
 
     def is_open(self):
         """Do enough Zuteilungen already exist for this Aufgabe?"""
-        return self.zuteilung_set.count() < self.anzahl
+        return self.numZuteilungen() < self.anzahl
 
     def __str__(self):
         return "{} ({})".format(self.aufgabe, self.id)
@@ -407,6 +654,63 @@ class Meldung(models.Model):
         verbose_name = "Meldung"
 
 
+class ZuteilungQuerySet(models.QuerySet):
+    def with_stunden(self):
+        """Annotate the hours of each Zuteilung as stunden_zuteilung.
+
+        Same rule as :meth:`Zuteilung.stunden`: if StundenZuteilungen exist, their
+        number replaces aufgabe.stunden.
+        """
+        return self.annotate(
+            anzahl_stundenzuteilungen=Coalesce(
+                Subquery(
+                    StundenZuteilung.objects.filter(zuteilung=OuterRef("pk"))
+                    .order_by()
+                    .values("zuteilung")
+                    .annotate(anzahl=Count("pk"))
+                    .values("anzahl"),
+                    output_field=models.IntegerField(),
+                ),
+                Value(0),
+            ),
+            stunden_zuteilung=Case(
+                When(
+                    anzahl_stundenzuteilungen__gt=0,
+                    then="anzahl_stundenzuteilungen",
+                ),
+                default="aufgabe__stunden",
+                output_field=models.IntegerField(),
+            ),
+        )
+
+    def stunden_nach_datum(self):
+        """Hours per ausfuehrer, split by the date of the Aufgabe.
+
+        One GROUP BY query yielding dicts with ausfuehrer, gesamt, vergangen
+        (datum until today), zukuenftig and ohne_datum; the buckets match
+        :meth:`Mitglied.zugeteilteStunden`.
+        """
+        today = datetime.date.today()
+
+        def summe(**bedingung):
+            return Coalesce(
+                Sum("stunden_zuteilung", filter=Q(**bedingung) if bedingung else None),
+                Value(0),
+            )
+
+        return (
+            self.with_stunden()
+            .order_by()
+            .values("ausfuehrer")
+            .annotate(
+                gesamt=summe(),
+                vergangen=summe(aufgabe__datum__lte=today),
+                zukuenftig=summe(aufgabe__datum__gt=today),
+                ohne_datum=summe(aufgabe__datum__isnull=True),
+            )
+        )
+
+
 class Zuteilung(models.Model):
     aufgabe = models.ForeignKey(Aufgabe, on_delete=models.PROTECT)
     ausfuehrer = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -414,6 +718,8 @@ class Zuteilung(models.Model):
     automatisch = models.BooleanField(default=False)
     zusatzhelfer = models.IntegerField(default=0)
 
+    objects = ZuteilungQuerySet.as_manager()
+
     def __str__(self):
         return (
             self.aufgabe.__str__()
@@ -424,13 +730,11 @@ class Zuteilung(models.Model):
 
     def save(self, *args, **kwargs):
         super(Zuteilung, self).save(*args, **kwargs)
-        self.ausfuehrer.mitglied.zuteilungBenachrichtigungNoetig = True
-        self.ausfuehrer.mitglied.save()
+        benachrichtigung_vormerken([self.ausfuehrer_id])
 
     def delete(self, *args, **kwargs):
-        self.ausfuehrer.mitglied.zuteilungBenachrichtigungNoetig = True
-        self.ausfuehrer.mitglied.save()
-        super(Zuteilung, self).delete(*args, **kwargs)
+        benachrichtigung_vormerken([self.ausfuehrer_id])
+        return super(Zuteilung, self).delete(*args, **kwargs)
 
     def stunden(self):
         """Compute the hours allocated to this zuteilung.
@@ -439,6 +743,9 @@ class Zuteilung(models.Model):
         If a Stundenplan exists for this job, but is not allocated yet, the planned job
         time is reported.
         """
+        if hasattr(self, "stunden_zuteilung"):
+            return self.stunden_zuteilung
+
         tmp = self.stundenzuteilung_set.count()
         if tmp > 0:
             return tmp
@@ -496,13 +803,11 @@ class StundenZuteilung(models.Model):
 
     def save(self, *args, **kwargs):
         super(StundenZuteilung, self).save(*args, **kwargs)
-        self.zuteilung.ausfuehrer.mitglied.zuteilungBenachrichtigungNoetig = True
-        self.zuteilung.ausfuehrer.mitglied.save()
+        benachrichtigung_vormerken([self.zuteilung.ausfuehrer_id])
 
     def delete(self, *args, **kwargs):
-        self.zuteilung.ausfuehrer.mitglied.zuteilungBenachrichtigungNoetig = True
-        self.zuteilung.ausfuehrer.mitglied.save()
-        super(StundenZuteilung, self).delete(*args, **kwargs)
+        benachrichtigung_vormerken([self.zuteilung.ausfuehrer_id])
+        return super(StundenZuteilung, self).delete(*args, **kwargs)
 
     class Meta:
         constraints = [
@@ -520,6 +825,30 @@ class StundenZuteilung(models.Model):
         return str(self.uhrzeit)
 
 
+class LeistungQuerySet(models.QuerySet):
+    def zeit_nach_status(self):
+        """Sum of zeit per melder as a pivot with one column per status.
+
+        One GROUP BY query with conditional aggregation, yielding dicts like
+        {"melder": 1, "OF": 2.0, "AK": 10.5, "RU": 0, "NE": 0}.
+        """
+        zeit = models.DecimalField(max_digits=8, decimal_places=1)
+        return (
+            self.order_by()
+            .values("melder")
+            .annotate(
+                **{
+                    s.value: Coalesce(
+                        Sum("zeit", filter=Q(status=s.value)),
+                        Value(0),
+                        output_field=zeit,
+                    )
+                    for s in Leistung.Status
+                }
+            )
+        )
+
+
 class Leistung(models.Model):
     class Status(models.TextChoices):
         OPEN = "OF", "Offen"
@@ -553,6 +882,8 @@ class Leistung(models.Model):
     bemerkung = models.TextField(blank=True)
     bemerkungVorstand = models.TextField(blank=True, verbose_name="Bemerkung Vorstand")
 
+    objects = LeistungQuerySet.as_manager()
+
     class Meta:
         verbose_name_plural = "Leistungen"
         verbose_name = "Leistung"
@@ -336,10 +336,14 @@ def StundenplanTableFactory(l, showStunden=True):
     return t
 
 
-def StundenplanEditFactory(l, aufgabe):
+def StundenplanEditFactory(l, benoetigt, zugewiesen):
     """
     Produce a table with persons as row, uhrzeiten as columns.
     Checkboxes in the uhrzeit columns.
+
+    benoetigt maps uhrzeit to the number of needed persons (Stundenplan),
+    zugewiesen maps uhrzeit to the number of assigned persons,
+    including zusatzhelfer. Both are computed by views/StundenplaeneEdit.
     """
 
     newattrs = {}
@@ -351,23 +355,15 @@ def StundenplanEditFactory(l, aufgabe):
     
     for i in range(models.Stundenplan.startZeit,
                    models.Stundenplan.stopZeit+1):
-        try: 
-            benoetigt = aufgabe.stundenplan_set.filter(uhrzeit__exact=i)[0].anzahl
-            # benoetigt = aufgabe.benoetigte_Anzahl(i)
-        except Exception as e:
-            print("eX: ", e)  # TODO: Log exception
-            benoetigt = 0
-
-        zugewiesen = sum([z.zusatzhelfer + 1
-                          for z in aufgabe.zuteilung_set.filter(stundenzuteilung__uhrzeit=i)])
-
         newattrs['u'+str(i)] = ValuedCheckBoxColumn(accessor='u'+str(i),
                                                     # verbose_name=str(i)+'-'+str(i+1),
                                                     verbose_name=mark_safe('{} - {}'
                                                     '<span style="font-weight:normal">'
                                                     '<br> ({} / {})'
                                                     '</span>'.format(
-                                                        i, i+1, benoetigt, zugewiesen),
+                                                        i, i+1,
+                                                        benoetigt.get(i, 0),
+                                                        zugewiesen.get(i, 0)),
                                                     ))
 
     return NameTableFactory("StundenplanEdit",
@@ -409,7 +405,7 @@ class AufgabenTable (django_tables2.Table):
         return record.numMeldungen()
 
     def render_zuteilungen(self, record):
-        return record.zuteilung_set.count()
+        return record.numZuteilungen()
 
     def render_quickmeldung(self, record):
         user = self.context["request"].user
@@ -471,10 +467,10 @@ class AufgabenTableVorstand(django_tables2.Table):
         return record.numMeldungen()
 
     def render_zuteilungen(self, record):
-        return record.zuteilung_set.count()
+        return record.numZuteilungen()
 
     def render_fehlende_zuteilungen(self, record):
-        return record.anzahl - record.zuteilung_set.count()
+        return record.anzahl - record.numZuteilungen()
 
     class Meta:
         model = models.Aufgabe
@@ -799,6 +795,11 @@ def SaldenTableFactory (l):
 
 
 def ZuteilungsTableFactory (tuple):
+    """Table with one checkbox column per Aufgabe.
+
+    The column headers read the figures of Aufgabe.objects.with_summary(),
+    so pass an annotated aufgabenQs to avoid queries per column.
+    """
     l, aufgabenQs = tuple
 
     attrs = {}
@@ -829,7 +830,7 @@ def ZuteilungsTableFactory (tuple):
                                             a.stunden,
                                             a.gruppe,
                                             a.anzahl,
-                                            a.zuteilung_set.count(),
+                                            a.numZuteilungen(),
                                             # the following expression is the same as appears in
                                             # the ZuteilungUebersichtView
                                             # TODO: perhaps move that to class aufgabe, to produce an edit link
@@ -0,0 +1,259 @@
+"""Tests of arbeitsplan management commands."""
+
+import json
+from datetime import time, timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from arbeitsplan.models import Aufgabe, Meldung, Mitglied, StundenZuteilung, Zuteilung
+from boote.models import Boat, Booking
+
+
+class NotifyAboutAssignmentsTests(TestCase):
+    fixtures = [
+        "arbeitsplan/fixtures/members.json",
+        "arbeitsplan/fixtures/taskgroups.json",
+        "arbeitsplan/fixtures/tasks.json",
+        "arbeitsplan/fixtures/timetables.json",
+        "mitglieder/fixtures/groups.json",
+        "mitglieder/fixtures/po.json",
+        "mitglieder/fixtures/user.json",
+    ]
+
+    def setUp(self):
+        self.task = Aufgabe.objects.get(aufgabe="Adventskaffee")
+        Mitglied.objects.update(zuteilungBenachrichtigungNoetig=False)
+
+    def assign(self, *usernames):
+        with self.captureOnCommitCallbacks(execute=True):
+            for user in User.objects.filter(username__in=usernames):
+                zuteilung = Zuteilung.objects.create(aufgabe=self.task, ausfuehrer=user)
+                StundenZuteilung.objects.create(zuteilung=zuteilung, uhrzeit=14)
+
+    def notify(self, *args):
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command("notify_about_assignments", *args, stdout=out)
+        # queries of the command itself, without sending the queued mails
+        queries = [q for q in queries if "post_office" not in q["sql"]]
+        return out.getvalue(), len(queries)
+
+    def flagged(self):
+        return set(
+            Mitglied.objects.filter(zuteilungBenachrichtigungNoetig=True)
+            .values_list("user__username", flat=True)
+        )
+
+    def test_notify(self):
+        """Test that all flagged members get one mail and lose their flag."""
+        self.assign("Mitglied")
+        out, queries = self.notify()
+        self.assertIn("Queued 1 mails for 1 members", out)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn("Adventskaffee", mail.outbox[0].body)
+        self.assertIn("14 Uhr - 15 Uhr", mail.outbox[0].body)
+        self.assertEqual(self.flagged(), set())
+        self.assertGreater(
+            Mitglied.objects.get(user__username="Mitglied").zuteilungsbenachrichtigung,
+            timezone.now() - timedelta(minutes=1),
+        )
+
+        # the number of queries does not depend on the number of members
+        self.assign("Vorstand", "Auch-Mitglied", "Superuser")
+        out, more_queries = self.notify()
+        self.assertIn("Queued 3 mails for 3 members", out)
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(queries, more_queries)
+
+    def test_changed_meanwhile(self):
+        """Test that a change during the run keeps the flag."""
+        self.assign("Mitglied", "Auch-Mitglied")
+        Mitglied.objects.filter(user__username="Mitglied").update(
+            zuteilungGeaendert=timezone.now() + timedelta(minutes=1)
+        )
+        out, _ = self.notify()
+        self.assertIn("(1 changed meanwhile)", out)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(self.flagged(), {"Mitglied"})
+
+    def test_dry_run(self):
+        """Test that a dry run neither queues mails nor clears flags."""
+        self.assign("Mitglied")
+        out, _ = self.notify("--dry-run")
+        self.assertIn("Would notify", out)
+        self.assertIn("Dry run: 1 mails", out)
+        call_command("send_queued_mail")
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(self.flagged(), {"Mitglied"})
+
+
+class NotifyAboutUpcomingJobsTests(TestCase):
+    fixtures = NotifyAboutAssignmentsTests.fixtures
+
+    def setUp(self):
+        today = timezone.localdate()
+        self.advent = Aufgabe.objects.get(aufgabe="Adventskaffee")
+        self.advent.datum = today + timedelta(days=2)
+        self.advent.save()
+        self.bugfix = Aufgabe.objects.get(aufgabe="Feuchtfröhliche Bugfixsuche")
+        self.bugfix.datum = today + timedelta(days=5)
+        self.bugfix.verantwortlich = User.objects.get(username="Superuser")
+        self.bugfix.save()
+
+    def assign(self, aufgabe, *usernames):
+        for user in User.objects.filter(username__in=usernames):
+            zuteilung = Zuteilung.objects.create(aufgabe=aufgabe, ausfuehrer=user)
+            StundenZuteilung.objects.create(zuteilung=zuteilung, uhrzeit=14)
+
+    def notify(self, *args):
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command("notify_about_upcoming_jobs", *args, stdout=out)
+        queries = [q for q in queries if "post_office" not in q["sql"]]
+        return out.getvalue(), len(queries)
+
+    def test_notify(self):
+        """Test reminders and digests for several lead days."""
+        self.assign(self.advent, "Mitglied")
+        self.assign(self.bugfix, "Auch-Mitglied", "Mitglied")
+        out, queries = self.notify("2", "5")
+        self.assertIn(f"{self.advent.datum}: 1 reminders, 1 digests", out)
+        self.assertIn(f"{self.bugfix.datum}: 2 reminders, 1 digests", out)
+        self.assertEqual(len(mail.outbox), 5)
+
+        # each responsible person gets the digest of his/her own task
+        digests = {
+            m.to[0]: m for m in mail.outbox if m.subject.endswith("Erinnerungen")
+        }
+        self.assertEqual(set(digests), {"vorstand@example.com", "superuser@example.com"})
+        self.assertIn("Adventskaffee", digests["vorstand@example.com"].body)
+        self.assertNotIn("Bugfixsuche", digests["vorstand@example.com"].body)
+        self.assertIn("Bugfixsuche", digests["superuser@example.com"].body)
+        self.assertEqual(
+            digests["superuser@example.com"].extra_headers["Reply-to"],
+            "superuser@example.com",
+        )
+        reminder = next(m for m in mail.outbox if m.to == ["auch-mitglied@example.com"])
+        self.assertIn("um 14 Uhr - 15 Uhr", reminder.body)
+
+        # the number of queries does not depend on the number of assignments
+        self.assign(self.advent, "Vorstand", "Superuser", "Auch-Mitglied")
+        out, more_queries = self.notify("2", "5")
+        self.assertIn(f"{self.advent.datum}: 4 reminders, 1 digests", out)
+        self.assertEqual(queries, more_queries)
+
+    def test_single_day(self):
+        """Test that only the given lead days are considered."""
+        self.assign(self.advent, "Mitglied")
+        self.assign(self.bugfix, "Auch-Mitglied")
+        out, _ = self.notify("5")
+        self.assertNotIn(str(self.advent.datum), out)
+        self.assertEqual(
+            sorted(m.to[0] for m in mail.outbox),
+            ["auch-mitglied@example.com", "superuser@example.com"],
+        )
+
+
+class CheckMeldungConsistencyTests(TestCase):
+    fixtures = NotifyAboutAssignmentsTests.fixtures + [
+        "boote/fixtures/01_boattypes.json",
+        "boote/fixtures/02_boats.json",
+    ]
+
+    def check(self):
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command("check_meldung_consistency", "--json", stdout=out)
+        queries = [q for q in queries if "post_office" not in q["sql"]]
+        return json.loads(out.getvalue())["befunde"], len(queries)
+
+    def test_consistent(self):
+        """Test that consistent data is neither reported nor mailed."""
+        befunde, queries = self.check()
+        self.assertTrue(befunde)
+        self.assertFalse(any(befunde.values()))
+        # one query per scan
+        self.assertEqual(queries, len(befunde))
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_findings(self):
+        """Test the scans for hours, missing Meldungen and overlapping bookings."""
+        user = User.objects.get(username="Mitglied")
+        task = Aufgabe.objects.get(aufgabe="Adventskaffee")
+        Meldung.objects.create(aufgabe=task, melder=user)
+        zuteilung = Zuteilung.objects.create(aufgabe=task, ausfuehrer=user)
+        StundenZuteilung.objects.create(zuteilung=zuteilung, uhrzeit=14)
+        ausserhalb = StundenZuteilung.objects.create(zuteilung=zuteilung, uhrzeit=20)
+        ohne_meldung = Zuteilung.objects.create(
+            aufgabe=task, ausfuehrer=User.objects.get(username="Vorstand")
+        )
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        boat = Boat.objects.get(pk=1)
+        morning = Booking.objects.create(
+            user=user, boat=boat, date=tomorrow, time_from=time(9), time_to=time(11))
+        overlap = Booking.objects.create(
+            user=user, boat=boat, date=tomorrow, time_from=time(10), time_to=time(12))
+        Booking.objects.create(  # cancelled
+            user=user, boat=boat, date=tomorrow, time_from=time(9), time_to=time(12),
+            status=0)
+        Booking.objects.create(  # touching only
+            user=user, boat=boat, date=tomorrow, time_from=time(12), time_to=time(13))
+
+        befunde, _ = self.check()
+        self.assertEqual(befunde["doppelte_meldungen"], [])
+        self.assertEqual(
+            [s["id"] for s in befunde["stunden_ausserhalb_stundenplan"]],
+            [ausserhalb.pk],
+        )
+        self.assertEqual(
+            [z["id"] for z in befunde["zuteilungen_ohne_meldung"]], [ohne_meldung.pk]
+        )
+        self.assertEqual(
+            [b["id"] for b in befunde["ueberlappende_buchungen"]],
+            [morning.pk, overlap.pk],
+        )
+        self.assertEqual(befunde["ueberlappende_buchungen"][0]["time_from"], "09:00:00")
+
+        call_command("send_queued_mail")
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn("außerhalb des Stundenplans", mail.outbox[0].body)
+        self.assertIn("Folgende Buchungen überlappen sich", mail.outbox[0].body)
+        self.assertNotIn("keine Meldung", mail.outbox[0].body)
+
+    def test_schnellzuweisung(self):
+        """Test that Zuteilungen without Meldung are reported, but not mailed."""
+        task = Aufgabe.objects.get(aufgabe="Adventskaffee")
+        worker = User.objects.get(username="Mitglied")
+        self.client.force_login(User.objects.get(username="Superuser"))
+        data = {
+            "aufgabe": task.aufgabe,
+            "verantwortlich": task.verantwortlich_id,
+            "gruppe": task.gruppe_id,
+            "anzahl": task.anzahl,
+            "stunden": task.stunden,
+            "datum": task.datum.isoformat(),
+            "bemerkung": "",
+            "schnellzuweisung": str(worker.pk),
+            "_edit": "Aufgabe ändern",
+        }
+        stundenplan = dict(task.stundenplan_set.values_list("uhrzeit", "anzahl"))
+        for uhrzeit in range(8, 24):
+            data[f"uhrzeit_{uhrzeit}"] = stundenplan.get(uhrzeit, 0)
+        response = self.client.post(
+            reverse("arbeitsplan-aufgabenEdit", args=(task.pk,)), data)
+        self.assertEqual(response.status_code, 302)
+        zuteilung = Zuteilung.objects.get(aufgabe=task, ausfuehrer=worker)
+
+        befunde, _ = self.check()
+        self.assertEqual(
+            [z["id"] for z in befunde["zuteilungen_ohne_meldung"]], [zuteilung.pk])
+        call_command("send_queued_mail")
+        self.assertEqual(len(mail.outbox), 0)
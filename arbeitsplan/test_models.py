@@ -1,9 +1,23 @@
 """Tests of arbeitsplan models."""
 
+import datetime
+from decimal import Decimal
+
 from django.contrib.auth.models import User
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
-from arbeitsplan.models import Aufgabe, StundenZuteilung, Zuteilung
+from arbeitsplan.models import (
+    Aufgabe,
+    benachrichtigung_vormerken,
+    Leistung,
+    Meldung,
+    Mitglied,
+    Stundenplan,
+    StundenZuteilung,
+    Zuteilung,
+)
 
 
 class StundenZuteilungTest(TestCase):
@@ -25,9 +39,10 @@ class StundenZuteilungTest(TestCase):
         self.timetable_hour = 14
 
         # Ensure assignment exists
-        self.assignment, _ = Zuteilung.objects.get_or_create(
-            aufgabe=self.task, ausfuehrer=self.user
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assignment, _ = Zuteilung.objects.get_or_create(
+                aufgabe=self.task, ausfuehrer=self.user
+            )
 
     def test_timetable_assignment_save(self):
         """Test custom save method of StundenZuteilung."""
@@ -39,7 +54,8 @@ class StundenZuteilungTest(TestCase):
         timetable_assignment = StundenZuteilung(
             zuteilung=self.assignment, uhrzeit=self.timetable_hour
         )
-        timetable_assignment.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            timetable_assignment.save()
         # Check if timetable_assignment was saved
         try:
             StundenZuteilung.objects.get(
@@ -50,26 +66,30 @@ class StundenZuteilungTest(TestCase):
                 f"StundenZuteilung not found for task {self.task} and user {self.user}."
             )
         # Check if notification is pending
+        self.user.mitglied.refresh_from_db()
         self.assertTrue(self.user.mitglied.zuteilungBenachrichtigungNoetig)
 
     def test_timetable_assignment_delete(self):
         """Test custom delete method of StundenZuteilung."""
         # Ensure timetable assignment exists
-        timetable_assignment, _ = StundenZuteilung.objects.get_or_create(
-            zuteilung=self.assignment, uhrzeit=self.timetable_hour
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            timetable_assignment, _ = StundenZuteilung.objects.get_or_create(
+                zuteilung=self.assignment, uhrzeit=self.timetable_hour
+            )
         # Ensure no notification is pending
         self.user.mitglied.zuteilungBenachrichtigungNoetig = False
         self.user.mitglied.save()
 
         # Test deletion of timetable assignment
-        timetable_assignment.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            timetable_assignment.delete()
         # Check if timetable assignment was deleted
         with self.assertRaises(StundenZuteilung.DoesNotExist):
             StundenZuteilung.objects.get(
                 zuteilung=self.assignment, uhrzeit=self.timetable_hour
             )
         # Check if notification is pending
+        self.user.mitglied.refresh_from_db()
         self.assertTrue(self.user.mitglied.zuteilungBenachrichtigungNoetig)
 
 
@@ -98,29 +118,261 @@ class ZuteilungTests(TestCase):
 
         # Test saving of assignment
         assignment = Zuteilung(aufgabe=self.task, ausfuehrer=self.user)
-        assignment.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            assignment.save()
         # Check if assignment was saved
         try:
             Zuteilung.objects.get(aufgabe=self.task, ausfuehrer=self.user)
         except Zuteilung.DoesNotExist:
             self.fail(f"Zuteilung not found for task {self.task} and user {self.user}.")
         # Check if notification is pending
+        self.user.mitglied.refresh_from_db()
         self.assertTrue(self.user.mitglied.zuteilungBenachrichtigungNoetig)
 
     def test_assignment_delete(self):
         """Test custom delete method of Zuteilung."""
         # Ensure assignment exists
-        assignment, _ = Zuteilung.objects.get_or_create(
-            aufgabe=self.task, ausfuehrer=self.user
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            assignment, _ = Zuteilung.objects.get_or_create(
+                aufgabe=self.task, ausfuehrer=self.user
+            )
         # Ensure no notification is pending
         self.user.mitglied.zuteilungBenachrichtigungNoetig = False
         self.user.mitglied.save()
 
         # Test deletion of assignment
-        assignment.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            assignment.delete()
         # Check if assignment was deleted
         with self.assertRaises(Zuteilung.DoesNotExist):
             Zuteilung.objects.get(aufgabe=self.task, ausfuehrer=self.user)
         # Check if notification is pending
+        self.user.mitglied.refresh_from_db()
         self.assertTrue(self.user.mitglied.zuteilungBenachrichtigungNoetig)
+
+
+class BenachrichtigungVormerkenTests(TestCase):
+    """Tests for the deferred notification flag."""
+
+    fixtures = [
+        "arbeitsplan/fixtures/members.json",
+        "arbeitsplan/fixtures/taskgroups.json",
+        "arbeitsplan/fixtures/tasks.json",
+        "mitglieder/fixtures/groups.json",
+        "mitglieder/fixtures/user.json",
+    ]
+
+    def setUp(self):
+        Mitglied.objects.update(zuteilungBenachrichtigungNoetig=False)
+
+    def flagged(self):
+        return set(
+            Mitglied.objects.filter(zuteilungBenachrichtigungNoetig=True)
+            .values_list("user__username", flat=True)
+        )
+
+    def test_one_update(self):
+        """Test that a batch of users is flagged with one UPDATE on commit."""
+        users = list(User.objects.filter(username__in=["Mitglied", "Auch-Mitglied"]))
+        with self.captureOnCommitCallbacks() as callbacks:
+            with transaction.atomic():
+                benachrichtigung_vormerken(users)
+        self.assertEqual(self.flagged(), set())
+        self.assertEqual(len(callbacks), 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            callbacks[0]()
+        self.assertEqual(len(queries), 1)
+        self.assertIn('SET "zuteilungBenachrichtigungNoetig"', queries[0]["sql"])
+        self.assertEqual(self.flagged(), {"Mitglied", "Auch-Mitglied"})
+
+    def test_on_commit(self):
+        """Test that allocations flag their members only when committed."""
+        users = list(User.objects.filter(username__in=["Mitglied", "Auch-Mitglied"]))
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                for aufgabe in Aufgabe.objects.all():
+                    for user in users:
+                        Zuteilung.objects.create(aufgabe=aufgabe, ausfuehrer=user)
+                Zuteilung.objects.filter(ausfuehrer=users[0]).first().delete()
+                self.assertEqual(self.flagged(), set())
+        self.assertEqual(self.flagged(), {"Mitglied", "Auch-Mitglied"})
+
+    def test_rollback(self):
+        """Test that users of rolled back changes are not flagged."""
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    benachrichtigung_vormerken(User.objects.filter(username="Mitglied"))
+                    raise ValueError
+            except ValueError:
+                pass
+            benachrichtigung_vormerken([User.objects.get(username="Vorstand").pk])
+        self.assertEqual(self.flagged(), {"Vorstand"})
+
+
+class MitgliedBalanceTests(TestCase):
+    """Tests for the balance annotations of Mitglied."""
+
+    fixtures = [
+        "arbeitsplan/fixtures/members.json",
+        "arbeitsplan/fixtures/taskgroups.json",
+        "arbeitsplan/fixtures/tasks.json",
+        "arbeitsplan/fixtures/timetables.json",
+        "mitglieder/fixtures/groups.json",
+        "mitglieder/fixtures/po.json",
+        "mitglieder/fixtures/user.json",
+    ]
+
+    def setUp(self):
+        self.task = Aufgabe.objects.get(aufgabe="Feuchtfröhliche Bugfixsuche")
+        self.timetable_task = Aufgabe.objects.get(aufgabe="Adventskaffee")
+        self.user = User.objects.get(last_name="Mitglied")
+
+        Meldung.objects.create(
+            aufgabe=self.task, melder=self.user, prefMitglied=Meldung.Preferences.YES
+        )
+        Meldung.objects.create(
+            aufgabe=self.timetable_task,
+            melder=self.user,
+            prefMitglied=Meldung.Preferences.NO,
+        )
+        Zuteilung.objects.create(aufgabe=self.task, ausfuehrer=self.user)
+        assignment = Zuteilung.objects.create(
+            aufgabe=self.timetable_task, ausfuehrer=self.user
+        )
+        # Only two of the three hours in the Stundenplan are assigned
+        StundenZuteilung.objects.create(zuteilung=assignment, uhrzeit=14)
+        StundenZuteilung.objects.create(zuteilung=assignment, uhrzeit=15)
+        for status, zeit in (("AK", "1.5"), ("OF", "2"), ("NE", "0.5")):
+            Leistung.objects.create(
+                aufgabe=self.task,
+                melder=self.user,
+                wann=datetime.date.today(),
+                zeit=zeit,
+                status=status,
+            )
+
+    def test_with_balances(self):
+        """Test annotated figures, taking the Stundenplan into account."""
+        with self.assertNumQueries(1):
+            mitglied = Mitglied.objects.with_balances().get(user=self.user)
+        self.assertEqual(mitglied.gemeldete_anzahl, 1)
+        self.assertEqual(mitglied.gemeldete_stunden, 12)
+        self.assertEqual(mitglied.zugeteilte_anzahl, 2)
+        self.assertEqual(mitglied.zugeteilte_stunden, 14)
+        self.assertEqual(mitglied.zugeteilte_stunden_ohne_datum, 12)
+        self.assertEqual(
+            mitglied.zugeteilte_stunden_vergangen
+            + mitglied.zugeteilte_stunden_zukuenftig,
+            2,
+        )
+        self.assertEqual(mitglied.behauptete_stunden, Decimal("4.0"))
+        self.assertEqual(mitglied.akzeptierte_stunden, Decimal("1.5"))
+        self.assertEqual(mitglied.offene_stunden, Decimal("2.0"))
+        self.assertEqual(mitglied.abgelehnte_stunden, Decimal("0.5"))
+
+    def test_without_data(self):
+        """Test that members without any records get zero balances."""
+        mitglied = Mitglied.objects.with_balances().get(user__last_name="Vorstand")
+        self.assertEqual(mitglied.zugeteilte_stunden, 0)
+        self.assertEqual(mitglied.akzeptierte_stunden, 0)
+
+    def test_methods_match_annotations(self):
+        """Test that the methods agree with and reuse the annotations."""
+        plain = Mitglied.objects.get(user=self.user)
+        annotated = Mitglied.objects.with_balances().get(user=self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(annotated.zugeteilteStunden(), 14)
+            self.assertEqual(annotated.zugeteilteStunden(0), 12)
+            self.assertEqual(annotated.akzeptierteStunden(), Decimal("1.5"))
+        self.assertEqual(plain.zugeteilteStunden(), 14)
+        self.assertEqual(plain.zugeteilteStunden(0), 12)
+        self.assertEqual(plain.gemeldeteAnzahlAufgaben(), 1)
+        self.assertEqual(plain.behaupteteStunden(), Decimal("4.0"))
+
+    def test_zuteilung_stunden(self):
+        """Test the hours per Zuteilung annotation."""
+        stunden = {
+            z.aufgabe_id: z.stunden()
+            for z in Zuteilung.objects.with_stunden().filter(ausfuehrer=self.user)
+        }
+        self.assertEqual(stunden, {self.task.id: 12, self.timetable_task.id: 2})
+
+
+class AufgabeSummaryTests(TestCase):
+    """Tests for the summary annotations of Aufgabe."""
+
+    fixtures = [
+        "arbeitsplan/fixtures/members.json",
+        "arbeitsplan/fixtures/taskgroups.json",
+        "arbeitsplan/fixtures/tasks.json",
+        "arbeitsplan/fixtures/timetables.json",
+        "mitglieder/fixtures/groups.json",
+        "mitglieder/fixtures/po.json",
+        "mitglieder/fixtures/user.json",
+    ]
+
+    def setUp(self):
+        self.task = Aufgabe.objects.get(aufgabe="Feuchtfröhliche Bugfixsuche")
+        self.timetable_task = Aufgabe.objects.get(aufgabe="Adventskaffee")
+        self.user = User.objects.get(last_name="Mitglied")
+        Meldung.objects.create(
+            aufgabe=self.task, melder=self.user, prefMitglied=Meldung.Preferences.YES
+        )
+
+    def assertSummary(self, aufgabe):
+        """Compare annotated summary with the plain methods of aufgabe."""
+        annotated = Aufgabe.objects.with_summary().get(pk=aufgabe.pk)
+        plain = Aufgabe.objects.get(pk=aufgabe.pk)
+        with self.assertNumQueries(0):
+            summary = (
+                annotated.numMeldungen(),
+                annotated.numZuteilungen(),
+                annotated.has_Stundenplan(),
+                annotated.stundenplan_complete(),
+            )
+        self.assertEqual(
+            summary,
+            (
+                plain.numMeldungen(),
+                plain.numZuteilungen(),
+                plain.has_Stundenplan(),
+                plain.stundenplan_complete(),
+            ),
+        )
+        return summary
+
+    def test_without_stundenplan(self):
+        """Test summary of an Aufgabe without Stundenplan."""
+        Zuteilung.objects.create(aufgabe=self.task, ausfuehrer=self.user)
+        self.assertEqual(self.assertSummary(self.task), (1, 1, False, True))
+
+    def test_stundenplan_complete(self):
+        """Test completeness of a Stundenplan, counting Zusatzhelfer."""
+        self.assertEqual(
+            self.assertSummary(self.timetable_task), (0, 0, True, False)
+        )
+
+        assignment = Zuteilung.objects.create(
+            aufgabe=self.timetable_task, ausfuehrer=self.user
+        )
+        for stundenplan in Stundenplan.objects.filter(
+            aufgabe=self.timetable_task, anzahl__gt=0
+        ):
+            StundenZuteilung.objects.create(
+                zuteilung=assignment, uhrzeit=stundenplan.uhrzeit
+            )
+        assignment.zusatzhelfer = max(
+            Stundenplan.objects.filter(aufgabe=self.timetable_task).values_list(
+                "anzahl", flat=True
+            )
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            assignment.save()
+        self.assertEqual(self.assertSummary(self.timetable_task), (0, 1, True, True))
+
+        assignment.zusatzhelfer = 0
+        with self.captureOnCommitCallbacks(execute=True):
+            assignment.save()
+        self.assertSummary(self.timetable_task)
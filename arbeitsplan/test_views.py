@@ -1,12 +1,22 @@
 """Tests of arbeitsplan views."""
 
+from datetime import timedelta
+from io import StringIO
+from urllib.parse import urlencode
+
 from django.contrib.auth.models import User
 from django.core import mail
+from django.core.cache import cache
 from django.core.management import call_command
+from django.db import connection
 from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from post_office.models import Email
 
-from arbeitsplan.models import Aufgabe, Mitglied, StundenZuteilung, Zuteilung
+from arbeitsplan.models import Aufgabe, Meldung, Mitglied, StundenZuteilung, Zuteilung
+from svpb import synthetic
 
 
 class SimpleTest(TestCase):
@@ -78,10 +88,34 @@ class SimpleTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(mail.outbox), 0)
 
+        # the mails are queued by a background job ...
+        call_command("run_jobs", once=True, stdout=StringIO())
+        u.refresh_from_db()
+        self.assertFalse(u.zuteilungBenachrichtigungNoetig)
+
         # and actually send it off:
         call_command("send_queued_mail")
         self.assertEqual(len(mail.outbox), 1)
 
+    def test_zuteilung_email_changed_meanwhile(self):
+        """Test that a change after the job started keeps the flag."""
+        geaendert = timezone.now() + timedelta(hours=1)
+        Mitglied.objects.filter(mitgliedsnummer="00003").update(
+            zuteilungBenachrichtigungNoetig=True, zuteilungGeaendert=geaendert)
+
+        cl, response = self.login_user(self.superuser)
+        cl.post(
+            "/arbeitsplan/benachrichtigen/zuteilung/",
+            {"eintragen": "Benachrichtigungen eintragen", "sendit_4": "on",
+             "ergaenzung": "", "anmerkung_4": ""},
+        )
+        call_command("run_jobs", once=True, stdout=StringIO())
+
+        u = Mitglied.objects.get(mitgliedsnummer="00003")
+        self.assertTrue(u.zuteilungBenachrichtigungNoetig)
+        self.assertEqual(u.zuteilungGeaendert, geaendert)
+        self.assertEqual(Email.objects.count(), 1)
+
 
 class AufgabenCreateTests(TestCase):
     """Tests for view AufgabenCreate."""
@@ -108,36 +142,37 @@ class AufgabenCreateTests(TestCase):
 
         # Test creation of new task with quick assignment
         self.client.force_login(self.user)
-        response = self.client.post(
-            reverse("arbeitsplan-aufgabenErzeugen"),
-            {
-                "aufgabe": "Schnellzuweisung testen",
-                "verantwortlich": "3",
-                "gruppe": "1",
-                "anzahl": "1",
-                "stunden": "1",
-                "datum": "",
-                "bemerkung": "",
-                "schnellzuweisung": str(self.worker.id),
-                "uhrzeit_8": "0",
-                "uhrzeit_9": "0",
-                "uhrzeit_10": "0",
-                "uhrzeit_11": "0",
-                "uhrzeit_12": "0",
-                "uhrzeit_13": "0",
-                "uhrzeit_14": "0",
-                "uhrzeit_15": "0",
-                "uhrzeit_16": "0",
-                "uhrzeit_17": "0",
-                "uhrzeit_18": "0",
-                "uhrzeit_19": "0",
-                "uhrzeit_20": "0",
-                "uhrzeit_21": "0",
-                "uhrzeit_22": "0",
-                "uhrzeit_23": "0",
-                "_edit": "Aufgabe anlegen",
-            },
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("arbeitsplan-aufgabenErzeugen"),
+                {
+                    "aufgabe": "Schnellzuweisung testen",
+                    "verantwortlich": "3",
+                    "gruppe": "1",
+                    "anzahl": "1",
+                    "stunden": "1",
+                    "datum": "",
+                    "bemerkung": "",
+                    "schnellzuweisung": str(self.worker.id),
+                    "uhrzeit_8": "0",
+                    "uhrzeit_9": "0",
+                    "uhrzeit_10": "0",
+                    "uhrzeit_11": "0",
+                    "uhrzeit_12": "0",
+                    "uhrzeit_13": "0",
+                    "uhrzeit_14": "0",
+                    "uhrzeit_15": "0",
+                    "uhrzeit_16": "0",
+                    "uhrzeit_17": "0",
+                    "uhrzeit_18": "0",
+                    "uhrzeit_19": "0",
+                    "uhrzeit_20": "0",
+                    "uhrzeit_21": "0",
+                    "uhrzeit_22": "0",
+                    "uhrzeit_23": "0",
+                    "_edit": "Aufgabe anlegen",
+                },
+            )
         self.assertEqual(response.status_code, 302)
 
         # Check if task was created
@@ -214,10 +249,11 @@ class AufgabenUpdateTests(TestCase):
         # Prepare data to post (copy dict to prevent side effects for other tests)
         post_data = self.post_data.copy()
         post_data["schnellzuweisung"] = str(self.worker.id)
-        response = self.client.post(
-            reverse("arbeitsplan-aufgabenEdit", kwargs={"pk": self.task.id}),
-            post_data,
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("arbeitsplan-aufgabenEdit", kwargs={"pk": self.task.id}),
+                post_data,
+            )
         self.assertEqual(response.status_code, 302)
 
         # Check if assignment was created
@@ -245,10 +281,11 @@ class AufgabenUpdateTests(TestCase):
         # Prepare data to post (copy dict to prevent side effects for other tests)
         post_data = self.post_data.copy()
         post_data["schnellzuweisung"] = [str(self.worker.id), str(self.worker_2.id)]
-        response = self.client.post(
-            reverse("arbeitsplan-aufgabenEdit", kwargs={"pk": self.task.id}),
-            post_data,
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("arbeitsplan-aufgabenEdit", kwargs={"pk": self.task.id}),
+                post_data,
+            )
         self.assertEqual(response.status_code, 302)
 
         # Check if assignments were created
@@ -274,17 +311,19 @@ class AufgabenUpdateTests(TestCase):
     def test_quick_assignment_delete_single(self):
         """Test quick assignment feature - delete single user."""
         # Ensure assignment exists
-        Zuteilung.objects.get_or_create(aufgabe=self.task, ausfuehrer=self.worker)
+        with self.captureOnCommitCallbacks(execute=True):
+            Zuteilung.objects.get_or_create(aufgabe=self.task, ausfuehrer=self.worker)
         # Ensure no notification is pending
         self.worker.mitglied.zuteilungBenachrichtigungNoetig = False
         self.worker.mitglied.save()
 
         # Test updating task with quick assignment
         self.client.force_login(self.user)
-        response = self.client.post(
-            reverse("arbeitsplan-aufgabenEdit", kwargs={"pk": self.task.id}),
-            self.post_data,
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("arbeitsplan-aufgabenEdit", kwargs={"pk": self.task.id}),
+                self.post_data,
+            )
         self.assertEqual(response.status_code, 302)
 
         # Check if assignment was deleted
@@ -298,8 +337,9 @@ class AufgabenUpdateTests(TestCase):
     def test_quick_assignment_delete_multiple(self):
         """Test quick assignment feature - delete multiple users."""
         # Ensure assignment exists
-        Zuteilung.objects.get_or_create(aufgabe=self.task, ausfuehrer=self.worker)
-        Zuteilung.objects.get_or_create(aufgabe=self.task, ausfuehrer=self.worker_2)
+        with self.captureOnCommitCallbacks(execute=True):
+            Zuteilung.objects.get_or_create(aufgabe=self.task, ausfuehrer=self.worker)
+            Zuteilung.objects.get_or_create(aufgabe=self.task, ausfuehrer=self.worker_2)
         # Ensure no notifications are pending
         self.worker.mitglied.zuteilungBenachrichtigungNoetig = False
         self.worker.mitglied.save()
@@ -308,10 +348,11 @@ class AufgabenUpdateTests(TestCase):
 
         # Test updating task with quick assignment
         self.client.force_login(self.user)
-        response = self.client.post(
-            reverse("arbeitsplan-aufgabenEdit", kwargs={"pk": self.task.id}),
-            self.post_data,
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("arbeitsplan-aufgabenEdit", kwargs={"pk": self.task.id}),
+                self.post_data,
+            )
         self.assertEqual(response.status_code, 302)
 
         # Check if assignments were deleted
@@ -329,7 +370,8 @@ class AufgabenUpdateTests(TestCase):
     def test_quick_assignment_replace(self):
         """Test quick assignment feature - replace assigned user with new one."""
         # Ensure assignment exists
-        Zuteilung.objects.get_or_create(aufgabe=self.task, ausfuehrer=self.worker)
+        with self.captureOnCommitCallbacks(execute=True):
+            Zuteilung.objects.get_or_create(aufgabe=self.task, ausfuehrer=self.worker)
         # Ensure no notifications are pending
         self.worker.mitglied.zuteilungBenachrichtigungNoetig = False
         self.worker.mitglied.save()
@@ -341,10 +383,11 @@ class AufgabenUpdateTests(TestCase):
         # Prepare data to post (copy dict to prevent side effects for other tests)
         post_data = self.post_data.copy()
         post_data["schnellzuweisung"] = str(self.worker_2.id)
-        response = self.client.post(
-            reverse("arbeitsplan-aufgabenEdit", kwargs={"pk": self.task.id}),
-            post_data,
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("arbeitsplan-aufgabenEdit", kwargs={"pk": self.task.id}),
+                post_data,
+            )
         self.assertEqual(response.status_code, 302)
 
         # Check if assignment for worker was deleted
@@ -367,7 +410,8 @@ class AufgabenUpdateTests(TestCase):
     def test_quick_assignment_no_change(self):
         """Test quick assignment feature - no change to assigned user."""
         # Ensure assignment exists
-        Zuteilung.objects.get_or_create(aufgabe=self.task, ausfuehrer=self.worker)
+        with self.captureOnCommitCallbacks(execute=True):
+            Zuteilung.objects.get_or_create(aufgabe=self.task, ausfuehrer=self.worker)
         # Ensure no notification is pending
         self.worker.mitglied.zuteilungBenachrichtigungNoetig = False
         self.worker.mitglied.save()
@@ -421,16 +465,17 @@ class ManuelleZuteilungViewTests(TestCase):
 
         # Test creation of assignment
         self.client.force_login(self.user)
-        response = self.client.post(
-            reverse(
-                "arbeitsplan-manuellezuteilungAufgabe", kwargs={"aufgabe": self.task.id}
-            ),
-            {
-                "box_3_1": "1",
-                "eintragen": "Zuteilung+eintragen/ändern",
-                "status": "3_1=0",
-            },
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse(
+                    "arbeitsplan-manuellezuteilungAufgabe", kwargs={"aufgabe": self.task.id}
+                ),
+                {
+                    "box_3_1": "1",
+                    "eintragen": "Zuteilung+eintragen/ändern",
+                    "status": "3_1=0",
+                },
+            )
         self.assertEqual(response.status_code, 302)
 
         # Check if assignment was created
@@ -446,22 +491,24 @@ class ManuelleZuteilungViewTests(TestCase):
     def test_assignment_delete(self):
         """Test deletion of Zuteilung."""
         # Ensure assignment exists
-        Zuteilung.objects.get_or_create(aufgabe=self.task, ausfuehrer=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            Zuteilung.objects.get_or_create(aufgabe=self.task, ausfuehrer=self.user)
         # Ensure no notification is pending
         self.user.mitglied.zuteilungBenachrichtigungNoetig = False
         self.user.mitglied.save()
 
         # Test deletion of assigment
         self.client.force_login(self.user)
-        response = self.client.post(
-            reverse(
-                "arbeitsplan-manuellezuteilungAufgabe", kwargs={"aufgabe": self.task.id}
-            ),
-            {
-                "eintragen": "Zuteilung+eintragen/ändern",
-                "status": "3_1=1",
-            },
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse(
+                    "arbeitsplan-manuellezuteilungAufgabe", kwargs={"aufgabe": self.task.id}
+                ),
+                {
+                    "eintragen": "Zuteilung+eintragen/ändern",
+                    "status": "3_1=1",
+                },
+            )
         self.assertEqual(response.status_code, 302)
 
         # Check if assignment was deleted
@@ -472,6 +519,384 @@ class ManuelleZuteilungViewTests(TestCase):
         self.user.refresh_from_db()
         self.assertTrue(self.user.mitglied.zuteilungBenachrichtigungNoetig)
 
+    def test_assignment_bulk(self):
+        """Test that a submit flags every changed member with one UPDATE."""
+        mitglied = User.objects.get(username="Mitglied")
+        aufgaben = list(Aufgabe.objects.order_by("pk")[:3])
+        with self.captureOnCommitCallbacks(execute=True):
+            Zuteilung.objects.create(aufgabe=aufgaben[0], ausfuehrer=mitglied)
+        Mitglied.objects.update(zuteilungBenachrichtigungNoetig=False)
+
+        status = {f"{mitglied.pk}_{aufgaben[0].pk}": "1"}
+        data = {"eintragen": "Zuteilung+eintragen/ändern"}
+        for user in (self.user, mitglied):
+            for aufgabe in aufgaben[1:]:
+                status[f"{user.pk}_{aufgabe.pk}"] = "0"
+                data[f"box_{user.pk}_{aufgabe.pk}"] = "1"
+        data["status"] = ";".join(f"{k}={v}" for k, v in status.items())
+
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse("arbeitsplan-manuellezuteilung"),
+                                            data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            sorted(Zuteilung.objects.values_list("ausfuehrer", "aufgabe")),
+            sorted((u.pk, a.pk) for u in (self.user, mitglied) for a in aufgaben[1:]),
+        )
+        updates = [q["sql"] for q in queries
+                   if 'SET "zuteilungBenachrichtigungNoetig"' in q["sql"]]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(
+            set(Mitglied.objects.filter(zuteilungBenachrichtigungNoetig=True)
+                .values_list("user", flat=True)),
+            {self.user.pk, mitglied.pk},
+        )
+
+    def test_matrix_queries(self):
+        """Test that the matrix is built without writes, independent of #users."""
+        self.client.force_login(self.user)
+        url = reverse("arbeitsplan-manuellezuteilung")
+        Zuteilung.objects.create(aufgabe=self.task, ausfuehrer=self.user)
+
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        # Assignments without a Meldung must not create one any more
+        self.assertFalse(Meldung.objects.exists())
+
+        for i in range(5):
+            user = User.objects.create(username=f"user{i}", last_name=f"Nutzer{i}")
+            Meldung.objects.create(
+                aufgabe=self.task,
+                melder=user,
+                prefMitglied=Meldung.Preferences.YES,
+                bemerkung=f"Bemerkung {i}",
+            )
+            Zuteilung.objects.create(aufgabe=self.task, ausfuehrer=user)
+
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(url)
+        self.assertContains(response, "Bemerkung 4")
+        self.assertContains(response, f'name="box_{user.id}_{self.task.id}" checked')
+
+    def test_header_queries(self):
+        """Test that the column headers do not query per Aufgabe."""
+        self.client.force_login(self.user)
+        url = reverse("arbeitsplan-manuellezuteilung")
+
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+
+        timetable_task = Aufgabe.objects.get(aufgabe="Adventskaffee")
+        for i in range(5):
+            task = Aufgabe.objects.create(
+                aufgabe=f"Aufgabe {i}",
+                verantwortlich=timetable_task.verantwortlich,
+                gruppe=timetable_task.gruppe,
+                anzahl=1,
+                stunden=2,
+            )
+            task.stundenplan_set.create(uhrzeit=10, anzahl=1)
+
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(url)
+        self.assertContains(response, "UNVOLLSTÄNDIG", count=6)
+
+
+class CreateMeldungenViewTests(TestCase):
+    """Tests for CreateMeldungenView."""
+
+    fixtures = [
+        "arbeitsplan/fixtures/members.json",
+        "arbeitsplan/fixtures/taskgroups.json",
+        "arbeitsplan/fixtures/tasks.json",
+        "arbeitsplan/fixtures/timetables.json",
+        "mitglieder/fixtures/groups.json",
+        "mitglieder/fixtures/po.json",
+        "mitglieder/fixtures/user.json",
+    ]
+
+    def setUp(self):
+        self.task = Aufgabe.objects.get(aufgabe="Feuchtfröhliche Bugfixsuche")
+        self.user = User.objects.get(username="Mitglied")
+        self.url = reverse("arbeitsplan-meldung")
+        # post_office caches the mail templates, which changes the query counts
+        cache.clear()
+
+    def add_tasks(self, number):
+        return [
+            Aufgabe.objects.create(
+                aufgabe=f"Aufgabe {i}",
+                verantwortlich=self.task.verantwortlich,
+                gruppe=self.task.gruppe,
+                anzahl=1,
+                stunden=2,
+            )
+            for i in range(number)
+        ]
+
+    def test_default_meldungen(self):
+        """Test that missing Meldungen are created for open Aufgaben only."""
+        full_task, open_task = self.add_tasks(2)
+        Zuteilung.objects.create(
+            aufgabe=full_task, ausfuehrer=User.objects.get(username="Vorstand")
+        )
+        self.client.force_login(self.user)
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        meldungen = Meldung.objects.filter(melder=self.user)
+        self.assertQuerySetEqual(
+            meldungen.values_list("aufgabe", flat=True),
+            [self.task.id, open_task.id],
+            ordered=False,
+        )
+        self.assertFalse(meldungen.exclude(prefMitglied=Meldung.Preferences.NO))
+        for meldung in meldungen:
+            self.assertContains(response, f'name="bemerkung_{meldung.id}"')
+
+    def test_queries(self):
+        """Test that the number of queries does not depend on #Aufgaben."""
+        self.client.force_login(self.user)
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+
+        self.add_tasks(5)
+        # creates the missing Meldungen: one insert and one select more
+        with self.assertNumQueries(len(queries) + 2):
+            self.client.get(self.url)
+        with self.assertNumQueries(len(queries)):
+            self.client.get(self.url)
+        self.assertEqual(Meldung.objects.filter(melder=self.user).count(), 6)
+
+    def test_submit(self):
+        """Test bulk submit with a single notification per Vorstand."""
+        (other_task,) = self.add_tasks(1)
+        self.client.force_login(self.user)
+        self.client.get(self.url)
+        meldung, other_meldung = (
+            Meldung.objects.get(melder=self.user, aufgabe=task)
+            for task in (self.task, other_task)
+        )
+
+        # session, user, Meldungen, Zuteilungen, bulk update, one mail
+        with self.assertNumQueries(8):
+            response = self.client.post(
+                self.url,
+                {
+                    f"bemerkung_{meldung.id}": "Gerne",
+                    f"prefMitglied_{meldung.id}": Meldung.Preferences.YES,
+                    f"bemerkung_{other_meldung.id}": "",
+                    f"prefMitglied_{other_meldung.id}": Meldung.Preferences.YES,
+                    "eintragen": "Meldungen eintragen/ändern",
+                },
+            )
+        self.assertEqual(response.status_code, 302)
+
+        meldung.refresh_from_db()
+        other_meldung.refresh_from_db()
+        self.assertEqual(meldung.bemerkung, "Gerne")
+        self.assertEqual(meldung.prefMitglied, Meldung.Preferences.YES)
+        self.assertEqual(other_meldung.prefMitglied, Meldung.Preferences.YES)
+
+        call_command("send_queued_mail")
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(
+            f"zu folgenden Aufgaben: {self.task.aufgabe}, {other_task.aufgabe}\n",
+            mail.outbox[0].body.replace("\r\n", "\n"),
+        )
+
+    def test_quickmeldung(self):
+        """Test that a Schnellmeldung notifies the Verantwortlichen."""
+        self.client.force_login(self.user)
+        response = self.client.get(
+            reverse("arbeitsplan-quickmeldung", args=(self.task.id,)))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            Meldung.objects.get(melder=self.user, aufgabe=self.task).bemerkung,
+            "QUICKMELDUNG",
+        )
+        call_command("send_queued_mail")
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(f"zu folgenden Aufgaben: {self.task.aufgabe}",
+                      mail.outbox[0].body)
+        self.assertIn("QUICKMELDUNG", mail.outbox[0].body)
+
+    def test_submit_withdraw_assigned(self):
+        """Test that a Meldung with an existing Zuteilung cannot be withdrawn."""
+        meldung = Meldung.objects.create(
+            aufgabe=self.task, melder=self.user, prefMitglied=Meldung.Preferences.YES
+        )
+        Zuteilung.objects.create(aufgabe=self.task, ausfuehrer=self.user)
+        self.client.force_login(self.user)
+
+        self.client.post(
+            self.url,
+            {
+                f"bemerkung_{meldung.id}": "Doch nicht",
+                f"prefMitglied_{meldung.id}": Meldung.Preferences.NO,
+            },
+        )
+
+        meldung.refresh_from_db()
+        self.assertEqual(meldung.bemerkung, "Doch nicht")
+        self.assertEqual(meldung.prefMitglied, Meldung.Preferences.YES)
+        call_command("send_queued_mail")
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn("Versuch abgewiesen", mail.outbox[0].body)
+
+
+class ZuteilungUebersichtViewTests(TestCase):
+    """Tests for ZuteilungUebersichtView."""
+
+    fixtures = [
+        "arbeitsplan/fixtures/members.json",
+        "arbeitsplan/fixtures/taskgroups.json",
+        "arbeitsplan/fixtures/tasks.json",
+        "arbeitsplan/fixtures/timetables.json",
+        "mitglieder/fixtures/groups.json",
+        "mitglieder/fixtures/po.json",
+        "mitglieder/fixtures/user.json",
+    ]
+
+    def setUp(self):
+        self.task = Aufgabe.objects.get(aufgabe="Adventskaffee")
+        self.user = User.objects.get(username="Vorstand")
+        self.url = (
+            reverse("arbeitsplan-zuteilungUebersicht")
+            + "?stundenplan=on&filter=Filter+anwenden"
+        )
+
+    def add_task(self, name):
+        """Create an Aufgabe with a Stundenplan and one assigned hour."""
+        task = Aufgabe.objects.create(
+            aufgabe=name,
+            verantwortlich=self.task.verantwortlich,
+            gruppe=self.task.gruppe,
+            anzahl=2,
+            stunden=2,
+        )
+        task.stundenplan_set.create(uhrzeit=9, anzahl=3)
+        task.stundenplan_set.create(uhrzeit=10, anzahl=3)
+        assignment = Zuteilung.objects.create(aufgabe=task, ausfuehrer=self.user)
+        StundenZuteilung.objects.create(zuteilung=assignment, uhrzeit=9)
+        return task
+
+    def test_overview_queries(self):
+        """Test that the overview needs a fixed number of queries."""
+        self.client.force_login(self.user)
+        self.add_task("Aufgabe 0")
+
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+        for i in range(1, 6):
+            self.add_task(f"Aufgabe {i}")
+
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(self.url)
+        self.assertContains(response, "3 / 1", count=6)
+        self.assertContains(response, "3 / 0", count=6)
+
+
+class SaldenTests(TestCase):
+    """Tests for view Salden."""
+
+    fixtures = [
+        "mitglieder/fixtures/groups.json",
+        "mitglieder/fixtures/po.json",
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vorstand = synthetic.generate_arbeitsplan(mitglieder=80, aufgaben=15)[
+            "vorstand"][0]
+
+    def get_rows(self, saldenstatus):
+        response = self.client.get(
+            reverse("arbeitsplan-salden")
+            + f"?saldenstatus={saldenstatus}&filter=Filter+anwenden"
+        )
+        self.assertEqual(response.status_code, 200)
+        return dict((r["user"].id, r) for r in response.context["object_list"].data)
+
+    def test_figures(self):
+        """Test that the pivot matches the per-member figures."""
+        self.client.force_login(self.vorstand)
+        rows = self.get_rows("--")
+        self.assertEqual(len(rows), User.objects.count())
+
+        for m in Mitglied.objects.all():
+            row = rows[m.user_id]
+            with self.subTest(mitglied=m.pk):
+                self.assertEqual(row["AK"][0], m.akzeptierteStunden())
+                self.assertEqual(row["OF"][0], m.offeneStunden())
+                self.assertEqual(row["NE"][0], m.abgelehnteStunden())
+                self.assertEqual(row["zugeteilt"][0], m.zugeteilteStunden())
+                self.assertEqual(row["past"], m.zugeteilteStunden(-1))
+                self.assertEqual(row["future"], m.zugeteilteStunden(+1))
+                self.assertEqual(row["nodate"], m.zugeteilteStunden(0))
+
+    def test_saldenstatus(self):
+        """Test that the status filter splits the members as defined."""
+        self.client.force_login(self.vorstand)
+        rows = self.get_rows("--")
+
+        def erreichbar(r):
+            return r["AK"][0] + r["OF"][0] + r["future"] + r["nodate"]
+
+        erwartet = {"OK": set(), "CH": set(), "PR": set()}
+        for r in rows.values():
+            arbeitslast = r["user"].mitglied.arbeitslast
+            if r["AK"][0] >= arbeitslast:
+                erwartet["OK"].add(r["user"].id)
+            elif erreichbar(r) >= arbeitslast:
+                erwartet["CH"].add(r["user"].id)
+            if erreichbar(r) < arbeitslast:
+                erwartet["PR"].add(r["user"].id)
+
+        for status, ids in erwartet.items():
+            with self.subTest(status=status):
+                self.assertTrue(ids)
+                self.assertEqual(set(self.get_rows(status)), ids)
+
+    def test_name_filter(self):
+        """Test that the sums are only computed for the filtered members."""
+        self.client.force_login(self.vorstand)
+        mitglied = Mitglied.objects.filter(user__leistung__isnull=False).first()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse("arbeitsplan-salden") + "?" + urlencode({
+                    "last_name": mitglied.user.last_name, "filter": "Filter anwenden"})
+            )
+        rows = response.context["object_list"].data
+        self.assertIn(mitglied.user, [r["user"] for r in rows])
+        self.assertLess(len(rows), User.objects.count())
+        summen = [q["sql"] for q in queries
+                  if "GROUP BY" in q["sql"] and ("leistung" in q["sql"]
+                                                 or "zuteilung" in q["sql"])]
+        self.assertEqual(len(summen), 2)
+        for sql in summen:
+            self.assertIn(mitglied.user.last_name, sql)
+
+    def test_queries(self):
+        """Test that the number of queries does not grow with the members."""
+        self.client.force_login(self.vorstand)
+        self.get_rows("CH")
+        with CaptureQueriesContext(connection) as queries:
+            self.get_rows("CH")
+
+        synthetic.generate_arbeitsplan(mitglieder=40, aufgaben=5, seed=1)
+        with self.assertNumQueries(len(queries)):
+            self.get_rows("CH")
+
 
 class StundenplaeneEditTests(TestCase):
     """Tests for view StundenplaeneEdit."""
@@ -490,9 +915,10 @@ class StundenplaeneEditTests(TestCase):
         self.task = Aufgabe.objects.get(aufgabe="Adventskaffee")
         self.user = User.objects.get(username="Superuser")
         # Ensure assignment exists
-        self.assignment, _ = Zuteilung.objects.get_or_create(
-            aufgabe=self.task, ausfuehrer=self.user
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assignment, _ = Zuteilung.objects.get_or_create(
+                aufgabe=self.task, ausfuehrer=self.user
+            )
 
     def test_timetable_assignment_create(self):
         """Test creation of StundenZuteilung."""
@@ -502,19 +928,20 @@ class StundenplaeneEditTests(TestCase):
 
         # Test creation of timetable assignment
         self.client.force_login(self.user)
-        response = self.client.post(
-            reverse(
-                "arbeitsplan-stundenplaeneEdit", kwargs={"aufgabeid": self.task.id}
-            ),
-            {
-                "anzahl_3": "0",
-                "uhrzeit_3_14": "1",
-                "uhrzeit_3_15": "1",
-                "uhrzeit_3_16": "1",
-                "eintragen": "Stundenzuteilung+eintragen/ändern",
-                "checkedboxes": "",
-            },
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse(
+                    "arbeitsplan-stundenplaeneEdit", kwargs={"aufgabeid": self.task.id}
+                ),
+                {
+                    "anzahl_3": "0",
+                    "uhrzeit_3_14": "1",
+                    "uhrzeit_3_15": "1",
+                    "uhrzeit_3_16": "1",
+                    "eintragen": "Stundenzuteilung+eintragen/ändern",
+                    "checkedboxes": "",
+                },
+            )
         self.assertEqual(response.status_code, 302)
 
         # Check if timetable assignments were created
@@ -534,25 +961,27 @@ class StundenplaeneEditTests(TestCase):
     def test_timetable_assignment_delete(self):
         """Test deletion of StundenZuteilung."""
         # Ensure timetable assignment exists
-        StundenZuteilung.objects.get_or_create(zuteilung=self.assignment, uhrzeit=14)
-        StundenZuteilung.objects.get_or_create(zuteilung=self.assignment, uhrzeit=15)
-        StundenZuteilung.objects.get_or_create(zuteilung=self.assignment, uhrzeit=16)
+        with self.captureOnCommitCallbacks(execute=True):
+            StundenZuteilung.objects.get_or_create(zuteilung=self.assignment, uhrzeit=14)
+            StundenZuteilung.objects.get_or_create(zuteilung=self.assignment, uhrzeit=15)
+            StundenZuteilung.objects.get_or_create(zuteilung=self.assignment, uhrzeit=16)
         # Ensure no notification is pending
         self.user.mitglied.zuteilungBenachrichtigungNoetig = False
         self.user.mitglied.save()
 
         # Test deletion of timetable assignments
         self.client.force_login(self.user)
-        response = self.client.post(
-            reverse(
-                "arbeitsplan-stundenplaeneEdit", kwargs={"aufgabeid": self.task.id}
-            ),
-            {
-                "anzahl_3": "0",
-                "eintragen": "Stundenzuteilung+eintragen/ändern",
-                "checkedboxes": "3_14,3_15,3_16",
-            },
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse(
+                    "arbeitsplan-stundenplaeneEdit", kwargs={"aufgabeid": self.task.id}
+                ),
+                {
+                    "anzahl_3": "0",
+                    "eintragen": "Stundenzuteilung+eintragen/ändern",
+                    "checkedboxes": "3_14,3_15,3_16",
+                },
+            )
         self.assertEqual(response.status_code, 302)
 
         # Check if StundenZuteilung objects were deleted
@@ -568,6 +997,108 @@ class StundenplaeneEditTests(TestCase):
         self.assertTrue(self.user.mitglied.zuteilungBenachrichtigungNoetig)
 
 
+    def test_timetable_page(self):
+        """Test the matrix and its headers from a fixed number of queries."""
+        self.client.force_login(self.user)
+        url = reverse("arbeitsplan-stundenplaeneEdit", kwargs={"aufgabeid": self.task.id})
+        anzahl = []
+        for n in (2, 20):
+            helfer = [User.objects.create(username=f"helfer{n}_{i}", last_name=f"H{n}_{i}")
+                      for i in range(n)]
+            for user in helfer:
+                zuteilung = Zuteilung.objects.create(aufgabe=self.task, ausfuehrer=user,
+                                                     zusatzhelfer=1)
+                StundenZuteilung.objects.create(zuteilung=zuteilung, uhrzeit=15)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            anzahl.append(len(queries))
+            self.assertContains(response, f"H{n}_0")
+        self.assertEqual(anzahl[0], anzahl[1])
+
+        # needed / assigned including zusatzhelfer
+        self.assertContains(response, "15 - 16<span style=\"font-weight:normal\"><br> (1 / 44)")
+        self.assertContains(response, "14 - 15<span style=\"font-weight:normal\"><br> (1 / 0)")
+        self.assertContains(response, f'name="uhrzeit_{helfer[0].pk}_15"')
+
+    def post_matrix(self, helfer):
+        """Post a matrix moving every helper from 14 h to 15 and 16 h."""
+        data = {
+            "eintragen": "Stundenzuteilung+eintragen/ändern",
+            "checkedboxes": ",".join(f"{user.pk}_14" for user in helfer),
+        }
+        for user in helfer:
+            data[f"anzahl_{user.pk}"] = "1"
+            data[f"uhrzeit_{user.pk}_15"] = "1"
+            data[f"uhrzeit_{user.pk}_16"] = "1"
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    reverse("arbeitsplan-stundenplaeneEdit",
+                            kwargs={"aufgabeid": self.task.id}),
+                    data,
+                )
+        self.assertEqual(response.status_code, 302)
+        return len(queries)
+
+    def test_timetable_assignment_bulk(self):
+        """Test that the submit costs the same number of queries for any size."""
+        self.client.force_login(self.user)
+        anzahl = []
+        for n in (2, 20):
+            Zuteilung.objects.filter(aufgabe=self.task).delete()
+            helfer = [User.objects.create(username=f"helfer{n}_{i}") for i in range(n)]
+            for user in helfer:
+                with self.captureOnCommitCallbacks(execute=True):
+                    zuteilung = Zuteilung.objects.create(aufgabe=self.task, ausfuehrer=user)
+                    StundenZuteilung.objects.create(zuteilung=zuteilung, uhrzeit=14)
+            Mitglied.objects.update(zuteilungBenachrichtigungNoetig=False)
+
+            anzahl.append(self.post_matrix(helfer))
+            self.assertEqual(
+                sorted(StundenZuteilung.objects.filter(zuteilung__aufgabe=self.task)
+                       .values_list("uhrzeit", flat=True)),
+                [15] * n + [16] * n,
+            )
+            self.assertEqual(Zuteilung.objects.filter(zusatzhelfer=1).count(), n)
+            self.assertEqual(
+                Mitglied.objects.filter(zuteilungBenachrichtigungNoetig=True).count(), n
+            )
+        self.assertEqual(anzahl[0], anzahl[1])
+
+        # submitting the same matrix again changes nothing
+        self.post_matrix(helfer)
+        self.assertEqual(
+            StundenZuteilung.objects.filter(zuteilung__aufgabe=self.task).count(), 40
+        )
+
+    def test_timetable_stale_page(self):
+        """Test that a stale page keeps hours assigned after it was rendered."""
+        with self.captureOnCommitCallbacks(execute=True):
+            StundenZuteilung.objects.create(zuteilung=self.assignment, uhrzeit=14)
+        self.client.force_login(self.user)
+        url = reverse("arbeitsplan-stundenplaeneEdit", kwargs={"aufgabeid": self.task.id})
+        response = self.client.get(url)
+        self.assertContains(response, 'name="checkedboxes" value="3_14"')
+
+        # another Vorstand member assigns 16 h in the meantime
+        with self.captureOnCommitCallbacks(execute=True):
+            StundenZuteilung.objects.create(zuteilung=self.assignment, uhrzeit=16)
+
+        # the stale page moves 14 h to 15 h, 16 h was not shown there
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {
+                "anzahl_3": "0",
+                "uhrzeit_3_15": "1",
+                "eintragen": "Stundenzuteilung+eintragen/ändern",
+                "checkedboxes": "3_14",
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            sorted(self.assignment.stundenzuteilung_set.values_list("uhrzeit", flat=True)),
+            [15, 16],
+        )
+
+
 class ZuteilungLoeschenViewTests(TestCase):
     """Tests for view ZuteilungLoeschenView."""
 
@@ -588,18 +1119,20 @@ class ZuteilungLoeschenViewTests(TestCase):
     def test_assignment_delete(self):
         """Test deletion of Zuteilung."""
         # Ensure assignment exists
-        assignment, _ = Zuteilung.objects.get_or_create(
-            aufgabe=self.task, ausfuehrer=self.user
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            assignment, _ = Zuteilung.objects.get_or_create(
+                aufgabe=self.task, ausfuehrer=self.user
+            )
         # Ensure no notification is pending
         self.user.mitglied.zuteilungBenachrichtigungNoetig = False
         self.user.mitglied.save()
 
         # Test deletion of assignment
         self.client.force_login(self.user)
-        response = self.client.post(
-            reverse("arbeitsplan-zuteilungDelete", kwargs={"pk": assignment.id}),
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("arbeitsplan-zuteilungDelete", kwargs={"pk": assignment.id}),
+            )
         self.assertEqual(response.status_code, 302)
 
         # Check if assignment was deleted
@@ -8,11 +8,13 @@ from django.conf import settings
 from django.contrib import messages
 from django.contrib.messages.views import SuccessMessageMixin
 from django.core.exceptions import PermissionDenied
-from django.urls import reverse_lazy
-from django.db.models import Q
-from django.db.models import Sum, F, Count
+from django.urls import reverse, reverse_lazy
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch, Q
+from django.db.models import Count, Sum, F
 from django.http import HttpResponseRedirect
 from django.shortcuts import redirect, get_object_or_404
+from django.utils.html import format_html
 from django.utils.http import urlencode
 from django.views.generic import UpdateView, DeleteView, TemplateView
 from django.views.generic import View, ListView, CreateView
@@ -23,34 +25,50 @@ from post_office.models import EmailTemplate
 # Arbeitsplan-Importe:
 from . import forms
 from .tables import *  # TODO: change import not to polute name space
+from svpb import jobs
 from svpb.views import isVorstand, isVorstandMixin
 
 
-def notifyVorstand(meldung, mailcomment):
-    """IF a meldung has been created or updated by the Mitglied,
+def notifyVorstand(aenderungen):
+    """IF meldungen have been created or updated by the Mitglied,
     then send an email to the corresponding Vorstand.
+
+    aenderungen is a list of (meldung, mailcomment) pairs; all changes for
+    Aufgaben of the same Verantwortlichen are combined into one email. The
+    template meldungNotify gets the names of the Aufgaben as aufgaben, the
+    changed Meldungen as meldungen, and melder and comment.
     """
-    # sanity check: does the verantwortlicher of the aufgabe of the meldung have an email=
-    try:
+    proVorstand = defaultdict(list)
+    for meldung, mailcomment in aenderungen:
+        # sanity check: does the verantwortlicher of the aufgabe of the meldung have an email=
         em = meldung.aufgabe.verantwortlich.email
-    except:
-        # try to inform some other way?
-        return
-
-    mail.send(em,
-              template="meldungNotify",
-              context={'comment': ', '.join(mailcomment),
-                       'meldung': meldung,
-                       'melder': meldung.melder,
-                   }
+        if not em:
+            # try to inform some other way?
+            continue
+        proVorstand[em].append((meldung, mailcomment))
+
+    for em, liste in proVorstand.items():
+        if len(liste) == 1:
+            comment = ', '.join(liste[0][1])
+        else:
+            comment = '; '.join('{0}: {1}'.format(m.aufgabe.aufgabe,
+                                                  ', '.join(mc))
+                                for m, mc in liste)
+
+        mail.send(em,
+                  template="meldungNotify",
+                  context={'comment': comment,
+                           'aufgaben': ', '.join(m.aufgabe.aufgabe
+                                                 for m, _ in liste),
+                           'meldungen': [m for m, _ in liste],
+                           'melder': liste[0][0].melder,
+                       }
 
-    )
+        )
     # and finally send out all queued mails:
     # call_command('send_queued_mail')
     # do that as a cronjob?
 
-    pass
-
 ###############
 
 
@@ -432,7 +450,8 @@ class ListAufgabenView (FilteredListView):
         qs = super(ListAufgabenView, self).apply_filter()
 
         qs = qs.filter(Q(datum__gte=datetime.date.today())|Q(datum=None))
-        qs = [q for q in qs if q.is_open()]
+        # same as is_open(), but in the database
+        qs = qs.with_summary().filter(anzahl__gt=F('anzahl_zuteilungen'))
 
         return qs
 
@@ -588,101 +607,118 @@ class MeldungEdit (FilteredListView):
 
 
     def processUpdate(self, request):
+        # collect the posted values per meldung id
+        updates = defaultdict(dict)
         for k, value in request.POST.items():
             if (k.startswith('bemerkung') or k.startswith('prefMitglied')):
-
                 key, id = k.split('_', 1)
+                updates[int(id)][key] = value
+            else:
+                # not interested in those keys
+                pass
 
-                id = int(id)
-
-                safeit = False
-                mailcomment = []
-
-                try:
-                    m = models.Meldung.objects.get(id=id)
-                except models.Meldung.DoesNotExist:
-                    print("consistency of database destroyed")
-                    # TODO: display error
-                    continue
-
-                if ((not m.aufgabe.datum ==  None) and
-                    (m.aufgabe.datum < datetime.date.today())):
-                    messages.error(request,
-                                   """Die Aufgabe {0} liegt in der Vergangenheit.
-                                   Solche Meldungen können nicht verändert werden.""".
-                                   format(m.aufgabe.aufgabe))
-                    continue
-
-                if key == 'bemerkung':
-                    if m.bemerkung != value:
-                        m.bemerkung = value
-                        safeit = True
-                        mailcomment.append("Neue Bemerkung")
-                        messages.success(request,
-                                         "Bei Aufgabe {0} wurde die Bemerkung aktualisiert".
-                                         format(m.aufgabe.aufgabe))
-
-                if key == 'prefMitglied':
-                    if m.prefMitglied != int(value):
+        if not updates:
+            return
+
+        meldungen = (models.Meldung.objects
+                     .select_related('aufgabe__verantwortlich', 'melder')
+                     .in_bulk(list(updates)))
+        zuteilungen = set(models.Zuteilung.objects
+                          .filter(aufgabe__in=[m.aufgabe_id for m in meldungen.values()],
+                                  ausfuehrer__in=[m.melder_id for m in meldungen.values()])
+                          .values_list('aufgabe_id', 'ausfuehrer_id'))
+
+        geaendert = []
+        aenderungen = []
+        for id, values in updates.items():
+            m = meldungen.get(id)
+            if m is None:
+                print("consistency of database destroyed")
+                # TODO: display error
+                continue
+
+            if ((not m.aufgabe.datum ==  None) and
+                (m.aufgabe.datum < datetime.date.today())):
+                messages.error(request,
+                               """Die Aufgabe {0} liegt in der Vergangenheit.
+                               Solche Meldungen können nicht verändert werden.""".
+                               format(m.aufgabe.aufgabe))
+                continue
+
+            safeit = False
+            mailcomment = []
+
+            if 'bemerkung' in values:
+                value = values['bemerkung']
+                if m.bemerkung != value:
+                    m.bemerkung = value
+                    safeit = True
+                    mailcomment.append("Neue Bemerkung")
+                    messages.success(request,
+                                     "Bei Aufgabe {0} wurde die Bemerkung aktualisiert".
+                                     format(m.aufgabe.aufgabe))
+
+            if 'prefMitglied' in values:
+                value = int(values['prefMitglied'])
+                if m.prefMitglied != value:
+                    if (m.prefMitglied ==
+                        models.Meldung.MODELDEFAULTS['prefMitglied']):
+                        mailcomment.append("Neue Meldung")
+                        messages.success(
+                            request,
+                            f"Du hast dich für die Aufgabe {m.aufgabe.aufgabe} "
+                            "gemeldet. Der Aufgabenverantwortliche wird dies prüfen"
+                            " und dich ggf. zuteilen. Falls du in den nächsten "
+                            "Tagen keine Zuteilung erhältst, melde dich bitte auch "
+                            "für andere Aufgaben."
+                        )
+                        m.prefMitglied = value
                         safeit = True
-
-                        if (m.prefMitglied ==
-                            models.Meldung.MODELDEFAULTS['prefMitglied']):
-                            mailcomment.append("Neue Meldung")
-                            messages.success(
+                    elif (value ==
+                          models.Meldung.MODELDEFAULTS['prefMitglied']):
+                        # TODO: das muss man am besten direkt verbieten, wenn es schon eine Zuteilung gibt!
+                        # first: check whether such a Zuteilung already exsts
+                        if (m.aufgabe_id, m.melder_id) in zuteilungen:
+                            # it exists! we have to recheck this and inform user
+                            mailcomment.append("Versuch eine Meldung zurückzuziehen, für die schon Zuteilung bestand. Versuch abgewiesen.")
+                            messages.error(
                                 request,
-                                f"Du hast dich für die Aufgabe {m.aufgabe.aufgabe} "
-                                "gemeldet. Der Aufgabenverantwortliche wird dies prüfen"
-                                " und dich ggf. zuteilen. Falls du in den nächsten "
-                                "Tagen keine Zuteilung erhältst, melde dich bitte auch "
-                                "für andere Aufgaben."
+                                "Du hast versucht, die Meldung für die Aufgabe "
+                                f"{m.aufgabe.aufgabe} zurückzuziehen. Allerdings "
+                                "wurde dir diese Aufgaben bereits zugeteilt. "
+                                "Leider kannst du daher die Meldung nicht mehr "
+                                "zurückziehen. Setze dich bitte mit dem "
+                                "Aufgabenverantwortlichen in Verbindung."
                             )
-                        elif (int(value) ==
-                              models.Meldung.MODELDEFAULTS['prefMitglied']):
-                            # TODO: CHECK
-                            # TODO: das muss man am besten direkt verbieten, wenn es schon eine Zuteilung gibt!
-                            # first: check whether such a Zuteilung already exsts
-                            try:
-                                zu = models.Zuteilung.objects.get(aufgabe=m.aufgabe,
-                                                                  ausfuehrer=m.melder)
-
-                                # it exists! we have to recheck this and inform user
-                                mailcomment.append("Versuch eine Meldung zurückzuziehen, für die schon Zuteilung bestand. Versuch abgewiesen.")
-                                safeit = False # this is important! Reason to initialize safeit up front
-                                messages.error(
-                                    request,
-                                    "Du hast versucht, die Meldung für die Aufgabe "
-                                    f"{m.aufgabe.aufgabe} zurückzuziehen. Allerdings "
-                                    "wurde dir diese Aufgaben bereits zugeteilt. "
-                                    "Leider kannst du daher die Meldung nicht mehr "
-                                    "zurückziehen. Setze dich bitte mit dem "
-                                    "Aufgabenverantwortlichen in Verbindung."
-                                )
-                            except models.Zuteilung.DoesNotExist:
-                                mailcomment.append("Meldung zurueckgezogen")
-                                messages.success(
-                                    request,
-                                    "Du hast die Meldung für die Aufgabe "
-                                    f"{m.aufgabe.aufgabe} zurückgezogen."
-                                )
-                                safeit = True
                         else:
-                            mailcomment.append("Praeferenz aktualisiert.")
-                            messages.success(request,
-                                             "Bei Aufgabe {0} wurde die Präferenz aktualisiert".
-                                             format(m.aufgabe.aufgabe))
-
+                            mailcomment.append("Meldung zurueckgezogen")
+                            messages.success(
+                                request,
+                                "Du hast die Meldung für die Aufgabe "
+                                f"{m.aufgabe.aufgabe} zurückgezogen."
+                            )
+                            m.prefMitglied = value
+                            safeit = True
+                    else:
+                        mailcomment.append("Praeferenz aktualisiert.")
+                        messages.success(request,
+                                         "Bei Aufgabe {0} wurde die Präferenz aktualisiert".
+                                         format(m.aufgabe.aufgabe))
                         m.prefMitglied = value
+                        safeit = True
 
-                if safeit:
-                    m.save()
+            if safeit:
+                # bulk_update does not handle auto_now
+                m.veraendert = datetime.date.today()
+                geaendert.append(m)
 
-                if mailcomment:
-                    notifyVorstand(m, mailcomment)
+            if mailcomment:
+                aenderungen.append((m, mailcomment))
 
-            else:
-                # not interested in those keys
-                pass
+        models.Meldung.objects.bulk_update(geaendert,
+                                           ['bemerkung', 'prefMitglied', 'veraendert'])
+
+        notifyVorstand(aenderungen)
 
 
 class MeldungenListeView (FilteredListView):
@@ -741,12 +777,8 @@ class CreateMeldungenView (MeldungEdit):
             else:
                 meld = meld.filter(prefMitglied=models.Meldung.Preferences.NO)
 
-            # turn this into aufgaben IDs
-            aufIDs = [m.aufgabe.id for m in meld]
-            # and get an Aufgaben queryset out of these ids
-            aufgQs = models.Aufgabe.objects.filter(id__in=aufIDs)
             # interset this with what we already have as queryset:
-            qs = qs & aufgQs
+            qs = qs.filter(id__in=meld.values('aufgabe'))
 
         return qs
 
@@ -799,13 +831,42 @@ class CreateMeldungenView (MeldungEdit):
         qs = super(CreateMeldungenView, self).apply_filter()
         qs = qs.filter(Q(datum__gte=datetime.date.today())|Q(datum=None))
 
-        qs = [q for q in qs if q.is_open()]
+        # same as is_open(), but in the database
+        qs = qs.with_summary().filter(anzahl__gt=F('anzahl_zuteilungen'))
 
         return qs
 
+    def get_meldungen(self, aufgaben):
+        """Return the Meldungen of the user for aufgaben, keyed by Aufgabe id.
+
+        Missing Meldungen are created with default values in a single insert;
+        concurrent requests are caught by the unique_aufgabe_melder constraint.
+        """
+        user = self.request.user
+        meldungen = models.Meldung.objects.filter(melder=user,
+                                                  aufgabe__in=aufgaben)
+        meldungDict = dict((m.aufgabe_id, m) for m in meldungen)
+
+        fehlend = [a for a in aufgaben if a.id not in meldungDict]
+        if fehlend:
+            models.Meldung.objects.bulk_create(
+                [models.Meldung(aufgabe=a, melder=user,
+                                **models.Meldung.MODELDEFAULTS)
+                 for a in fehlend],
+                ignore_conflicts=True,
+            )
+            # ignore_conflicts does not set primary keys, fetch them
+            meldungDict.update(
+                (m.aufgabe_id, m)
+                for m in meldungen.filter(aufgabe__in=fehlend))
+
+        return meldungDict
+
     def get_queryset(self):
 
-        qsAufgaben = self.apply_filter()
+        qsAufgaben = list(self.apply_filter()
+                          .select_related('gruppe', 'verantwortlich'))
+        meldungen = self.get_meldungen(qsAufgaben)
 
         # fill the table with all aufgaben
         # overwrite preferences and bemerkung if for them, a value exists
@@ -827,16 +888,7 @@ class CreateMeldungenView (MeldungEdit):
                  'fehlende_zuteilungen': None,
                 }
             # add what we can find from Meldung:
-            try:
-                m, newcreateFlag = models.Meldung.objects.get_or_create(
-                    aufgabe=a,
-                    melder=self.request.user,
-                    defaults = models.Meldung.MODELDEFAULTS,
-                )
-            except models.Meldung.MultipleObjectsReturned:
-                messages.error(self.request,
-                               "Leider ist ein Datenbankfehler aufgetreten!")
-                return self.get_filtered_table([])
+            m = meldungen[a.id]
 
             d['id'] = m.id
             d['prefMitglied'] = m.prefMitglied
@@ -910,7 +962,7 @@ class QuickMeldung(View):
                     f"Danke! Du hast dich für die Aufgabe {aufgabe.aufgabe} gemeldet. "
                     "Der Vorstand wird dies prüfen und ggf. eine Zuteilung erstellen."
                 )
-                notifyVorstand(meldung, ["QUICKMELDUNG"])
+                notifyVorstand([(meldung, ["QUICKMELDUNG"])])
             else:
                 messages.warning(
                     self.request,
@@ -959,7 +1011,7 @@ class ListZuteilungenView(FilteredListView):
             self.intro_text = """
             Welche Zuteilung sind für mich eingetragen?
             """
-            self.context['zuteilungSummary'] = sum([z.stunden() for z in qs])
+            self.context['zuteilungSummary'] = self.request.user.mitglied.zugeteilteStunden()
             self.context['arbeitslast'] = self.request.user.mitglied.arbeitslast
 
         qs = self.apply_filter(qs)
@@ -982,13 +1034,13 @@ class ManuelleZuteilungView (isVorstandMixin, FilteredListView):
         """applies a spare capacity available filter to a user Qs"""
 
         if ("AM" in busy):
+            meldungen = (models.Meldung.objects
+                         .filter(melder=OuterRef('pk'))
+                         .exclude(prefMitglied=models.Meldung.Preferences.NO))
             if self.aufgabengruppe:
                 """Only keep those users who have a meldung for an aufagebn in this gruppe"""
-                qs = [q for q in qs
-                      if q.meldung_set
-                           .exclude(prefMitglied=models.Meldung.Preferences.NO)
-                           .filter(aufgabe__gruppe__gruppe=self.aufgabengruppe)
-                           .count()]
+                qs = qs.filter(Exists(
+                    meldungen.filter(aufgabe__gruppe__gruppe=self.aufgabengruppe)))
 
             # are we looking at a SINGLE Aufgabe?
             # then filter down further to only those users
@@ -998,11 +1050,7 @@ class ManuelleZuteilungView (isVorstandMixin, FilteredListView):
                 if self.aufgabeQs.count() == 1:
                     aufgabe = self.aufgabeQs[0]
 
-                    qs = [q for q in qs
-                          if q.meldung_set
-                               .exclude(prefMitglied=models.Meldung.Preferences.NO)
-                               .filter(aufgabe=aufgabe)
-                               .count()]
+                    qs = qs.filter(Exists(meldungen.filter(aufgabe=aufgabe)))
             except:
                 pass
 
@@ -1028,12 +1076,9 @@ class ManuelleZuteilungView (isVorstandMixin, FilteredListView):
 
     def ungenuegend_zuteilungen_filter(self, qs, restrict):
         if restrict == 'UN':
-            # qs=qs.filter(anzahl__gt=zuteilung_set.count())
-            qs = (qs.annotate(num_Zuteilung=Count('zuteilung')).
-                  filter(anzahl__gt=F('num_Zuteilung')))
+            qs = qs.with_summary().filter(anzahl__gt=F('anzahl_zuteilungen'))
         elif restrict == 'ZU':
-            qs = (qs.annotate(num_Zuteilung=Count('zuteilung')).
-                  filter(anzahl__lte=F('num_Zuteilung')))
+            qs = qs.with_summary().filter(anzahl__lte=F('anzahl_zuteilungen'))
         return qs
 
     filtertitle = "Nach Aufgabengruppen oder Mitgliedern filtern"
@@ -1062,7 +1107,11 @@ class ManuelleZuteilungView (isVorstandMixin, FilteredListView):
     """
 
     def get_data(self):
-        userQs = models.User.objects.all()
+        # balances are needed by the busy filter and for every row
+        userQs = models.User.objects.prefetch_related(
+            Prefetch("mitglied",
+                     queryset=models.Mitglied.objects.with_balances("zugeteilte_stunden"))
+        )
         aufgabeQs = models.Aufgabe.objects.all()
 
         return (userQs, aufgabeQs)
@@ -1100,9 +1149,26 @@ class ManuelleZuteilungView (isVorstandMixin, FilteredListView):
 
         ztlist = []
         statuslist = {}
-        aufgaben = dict([(unicodedata.normalize('NFKD', a.aufgabe).encode('ASCII', 'ignore'),
-                          (-1, 'x'))
-                          for a in aufgabenQs])
+        # the summary feeds the column headers of the table
+        aufgabenQs = list(aufgabenQs.with_summary().select_related('gruppe'))
+        tags = dict([(a.id,
+                      unicodedata.normalize('NFKD', a.aufgabe).encode('ASCII', 'ignore').decode())
+                     for a in aufgabenQs])
+        aufgaben = dict([(tag, (-1, 'x')) for tag in tags.values()])
+
+        userQs = list(userQs)
+        userIds = [u.id for u in userQs]
+
+        # two queries for the whole matrix, pivoted by (user, aufgabe) below
+        meldungen = {}
+        for m in (models.Meldung.objects
+                  .filter(melder__in=userIds, aufgabe__in=list(tags))
+                  .values('melder_id', 'aufgabe_id', 'prefMitglied', 'bemerkung')):
+            meldungen[(m['melder_id'], m['aufgabe_id'])] = m
+
+        zuteilungen = set(models.Zuteilung.objects
+                          .filter(ausfuehrer__in=userIds, aufgabe__in=list(tags))
+                          .values_list('ausfuehrer_id', 'aufgabe_id'))
 
         for u in userQs:
             tmp = {'last_name': u.last_name,
@@ -1110,56 +1176,26 @@ class ManuelleZuteilungView (isVorstandMixin, FilteredListView):
                     'mitglied': u,
                     }
             tmp.update(aufgaben)
-            mQs =  models.Meldung.objects.filter(melder=u)
-            ## if self.aufgabengruppe <> None:
-            ##     mQs = mQs.filter(aufgabe__gruppe__gruppe = self.aufgabengruppe)
-            mQs = mQs.filter(aufgabe__in = aufgabenQs)
-
-            # filter out all veto'ed meldungen
-            mQs = mQs.exclude(prefMitglied=models.Meldung.Preferences.NO)
-
-            for m in mQs:
-                tag = unicodedata.normalize('NFKD',
-                                            m.aufgabe.aufgabe).encode('ASCII', 'ignore').decode()
-
-                tmp[tag] = (
-                    0,
-                    f"box_{u.id}_{m.aufgabe.id}",
-                    ((f"<br><small>{m.bemerkung}</small>") if m.bemerkung else ""),
-                )
-                statuslist[f"{u.id}_{m.aufgabe.id}"] = "0"
-
-            zQs =  models.Zuteilung.objects.filter(ausfuehrer=u)
-            ## if self.aufgabengruppe <> None:
-            ##     zQs = zQs.filter(aufgabe__gruppe__gruppe =  self.aufgabengruppe)
-            zQs = zQs.filter(aufgabe__in=aufgabenQs)
-
-            for z in zQs:
-                tag = unicodedata.normalize('NFKD', z.aufgabe.aufgabe).encode('ASCII', 'ignore').decode()
-                meldung, meldungCreated = z.aufgabe.meldung_set.get_or_create(
-                    melder=u,
-                    aufgabe=z.aufgabe,
-                    defaults= models.Meldung.MODELDEFAULTS,
-                    )
-                tmp[tag] = (
-                    1,
-                    f"box_{u.id}_{z.aufgabe.id}",
-                    (
-                        f"<br><small>{meldung.bemerkung}</small>"
-                        if meldung.bemerkung
-                        else ""
-                    ),
-                )
-                statuslist[f"{u.id}_{z.aufgabe.id}"] = "1"
 
-            # TODO: Add to tmp the amount of already zugeteilt work per user
-            # This is wrong, have to take into account Stundenplanzuteilungen!
-            ## tmp['zugeteilt'] = (models.Zuteilung.objects
-            ##                     .filter(ausfuehrer = u)
-            ##                     .aggregate(Sum('aufgabe__stunden'))
-            ##                     ['aufgabe__stunden__sum']
-            ##                     )
+            for aufgabeId, tag in tags.items():
+                meldung = meldungen.get((u.id, aufgabeId))
+                bemerkung = (f"<br><small>{meldung['bemerkung']}</small>"
+                             if meldung and meldung['bemerkung']
+                             else "")
+
+                if (u.id, aufgabeId) in zuteilungen:
+                    status = "1"
+                elif (meldung and
+                      meldung['prefMitglied'] != models.Meldung.Preferences.NO):
+                    # veto'ed meldungen do not get a box
+                    status = "0"
+                else:
+                    continue
+
+                tmp[tag] = (int(status), f"box_{u.id}_{aufgabeId}", bemerkung)
+                statuslist[f"{u.id}_{aufgabeId}"] = status
 
+            # balances are annotated by get_data, taking Stundenplan into account
             tmp['zugeteilt'] = u.mitglied.zugeteilteStunden()
             tmp['offen'] = u.mitglied.arbeitslast - tmp['zugeteilt']
 
@@ -1176,6 +1212,14 @@ class ManuelleZuteilungView (isVorstandMixin, FilteredListView):
         return (ztlist, aufgabenQs)
 
     def post (self,request, *args, **kwargs):
+        """Apply the changed boxes as a diff to the stored Zuteilungen.
+
+        Only boxes whose state differs from the one stored in the hidden status
+        field at rendering time are changed. Existing Zuteilungen of the
+        involved users and Aufgaben are loaded in one query; new ones are
+        bulk created, removed ones deleted with one statement, and the changed
+        users are flagged for a notification with one UPDATE on commit.
+        """
 
         previousStatus = dict([ tuple(s.split('=') )
                    for s in
@@ -1187,56 +1231,62 @@ class ManuelleZuteilungView (isVorstandMixin, FilteredListView):
                      if item[0][:4] == "box_"
                     ])
 
-        # find all items in  newState  that have a zero in prevState
-        # add that zuteilung
+        # items in newState with a zero in prevState are to be added,
+        # items in prevState with a 1 that do not appear in newState are removed
+        neu = set()
+        entfernt = set()
         for k, v in newState.items():
             if previousStatus[k] == '0':
-                user, aufgabe = k.split('_')
-                aufgabeObj = models.Aufgabe.objects.get(id=int(aufgabe))
-                ausfuehrerObj = models.User.objects.get(id=int(user))
-                ## z = models.Zuteilung(aufgabe=aufgabeObj,
-                ##                      ausfuehrer=ausfuehrerObj,
-                ##                      )
-                ## z.save()
-
-                z, created = models.Zuteilung.objects.get_or_create(
-                    aufgabe=aufgabeObj,
-                    ausfuehrer=ausfuehrerObj)
-
-                if not created:
-                    messages.debug(request,
-                                   "warnung: Aufgabe {0} war bereits an {1} {2} zugeteilt"
-                                   .format(
-                                       aufgabeObj.aufgabe,
-                                       ausfuehrerObj.first_name,
-                                       ausfuehrerObj.last_name))
-
-                messages.success(request,
-                                 "Aufgabe {0} wurde an {1} {2} zugeteilt"
-                                 .format(
-                                     aufgabeObj.aufgabe,
-                                     ausfuehrerObj.first_name,
-                                     ausfuehrerObj.last_name))
-
-        # find all items in prevState with a 1 there that do no appear in newState
-        # remove that zuteilung
+                neu.add(tuple(int(i) for i in k.split('_')))
         for k, v in previousStatus.items():
             if v=='1' and k not in newState:
-                user, aufgabe = k.split('_')
-                aufgabeObj = models.Aufgabe.objects.get(id=int(aufgabe))
-                ausfuehrerObj = models.User.objects.get(id=int(user))
-                z = models.Zuteilung.objects.filter (aufgabe=aufgabeObj,
-                                                  ausfuehrer=ausfuehrerObj,
-                                                 )
-                for zz in z:
-                    zz.delete()
-
-                messages.success(request,
-                                 "Aufgabe {0} wird nicht mehr"
-                                 " von  {1} {2} durchgeführt."
-                                 .format(aufgabeObj.aufgabe,
-                                         ausfuehrerObj.first_name,
-                                         ausfuehrerObj.last_name))
+                entfernt.add(tuple(int(i) for i in k.split('_')))
+
+        paare = neu | entfernt
+        users = models.User.objects.in_bulk([u for u, a in paare])
+        aufgaben = models.Aufgabe.objects.in_bulk([a for u, a in paare])
+        vorhanden = {(z.ausfuehrer_id, z.aufgabe_id): z.pk
+                     for z in models.Zuteilung.objects.filter(
+                             ausfuehrer__in=users, aufgabe__in=aufgaben)}
+
+        for user, aufgabe in sorted(neu):
+            if (user, aufgabe) in vorhanden:
+                messages.debug(request,
+                               "warnung: Aufgabe {0} war bereits an {1} {2} zugeteilt"
+                               .format(
+                                   aufgaben[aufgabe].aufgabe,
+                                   users[user].first_name,
+                                   users[user].last_name))
+
+            messages.success(request,
+                             "Aufgabe {0} wurde an {1} {2} zugeteilt"
+                             .format(
+                                 aufgaben[aufgabe].aufgabe,
+                                 users[user].first_name,
+                                 users[user].last_name))
+
+        for user, aufgabe in sorted(entfernt):
+            messages.success(request,
+                             "Aufgabe {0} wird nicht mehr"
+                             " von  {1} {2} durchgeführt."
+                             .format(aufgaben[aufgabe].aufgabe,
+                                     users[user].first_name,
+                                     users[user].last_name))
+
+        anlegen = [p for p in neu if p not in vorhanden]
+        loeschen = [p for p in entfernt if p in vorhanden]
+        with transaction.atomic():
+            if anlegen:
+                # a concurrent submit may have added the same Zuteilung already
+                models.Zuteilung.objects.bulk_create(
+                    [models.Zuteilung(ausfuehrer=users[user], aufgabe=aufgaben[aufgabe])
+                     for user, aufgabe in anlegen],
+                    ignore_conflicts=True)
+            if loeschen:
+                models.Zuteilung.objects.filter(
+                    pk__in=[vorhanden[p] for p in loeschen]).delete()
+            models.benachrichtigung_vormerken(
+                user for user, aufgabe in anlegen + loeschen)
 
         # TODO: emails senden?
 
@@ -1276,12 +1326,9 @@ class ZuteilungUebersichtView(isVorstandMixin, FilteredListView):
 
     def ungenuegend_zuteilungen_filter(self, qs, restrict):
         if restrict == 'UN':
-            # qs=qs.filter(anzahl__gt=zuteilung_set.count())
-            qs = (qs.annotate(num_Zuteilung=Count('zuteilung')).
-                  filter(anzahl__gt=F('num_Zuteilung')))
+            qs = qs.with_summary().filter(anzahl__gt=F('anzahl_zuteilungen'))
         elif restrict == 'ZU':
-            qs = (qs.annotate(num_Zuteilung=Count('zuteilung')).
-                  filter(anzahl__lte=F('num_Zuteilung')))
+            qs = qs.with_summary().filter(anzahl__lte=F('anzahl_zuteilungen'))
         return qs
 
     def stundenplan_anzeigen_filter(self, qs, show):
@@ -1320,8 +1367,28 @@ class ZuteilungUebersichtView(isVorstandMixin, FilteredListView):
 
     def annotate_data(self, qs):
 
+        # counts per Aufgabe come with the summary annotations
+        aufgaben = list(qs.with_summary().select_related('gruppe'))
+        aufgabenIds = [a.id for a in aufgaben]
+
+        # required and assigned persons per (aufgabe, uhrzeit),
+        # one grouped query each
+        stundenplaene = defaultdict(dict)
+        for aufgabeId, uhrzeit, anzahl in (models.Stundenplan.objects
+                                           .filter(aufgabe__in=aufgabenIds,
+                                                   anzahl__gt=0)
+                                           .values_list('aufgabe', 'uhrzeit', 'anzahl')):
+            stundenplaene[aufgabeId][uhrzeit] = anzahl
+
+        zugeteilt = dict(((z['zuteilung__aufgabe'], z['uhrzeit']), z['anzahl'])
+                         for z in (models.StundenZuteilung.objects
+                                   .filter(zuteilung__aufgabe__in=aufgabenIds)
+                                   .order_by()
+                                   .values('zuteilung__aufgabe', 'uhrzeit')
+                                   .annotate(anzahl=Count('id'))))
+
         data = []
-        for aufgabe in qs:
+        for aufgabe in aufgaben:
             newEntry = defaultdict(int)
             newEntry['id'] = aufgabe.id
             newEntry['aufgabe'] = mark_safe(
@@ -1333,7 +1400,7 @@ class ZuteilungUebersichtView(isVorstandMixin, FilteredListView):
             newEntry['required'] = aufgabe.anzahl
             newEntry['gruppe'] = aufgabe.gruppe.gruppe
             newEntry['gemeldet'] = aufgabe.numMeldungen()
-            newEntry['zugeteilt'] = aufgabe.zuteilung_set.count()
+            newEntry['zugeteilt'] = aufgabe.numZuteilungen()
             newEntry['editlink'] = mark_safe(
                 '<a href="{0}?mitglied_ausgelastet=AM&filter=Filter+anwenden">'
                 'Zuteilung</a>'.format(
@@ -1343,19 +1410,12 @@ class ZuteilungUebersichtView(isVorstandMixin, FilteredListView):
 
             if aufgabe.has_Stundenplan():
 
-                for s in aufgabe.stundenplan_set.filter(anzahl__gt=0):
-                    newEntry['u'+str(s.uhrzeit)] = {
-                        'required': s.anzahl,
-                        'zugeteilt': 0
+                for uhrzeit, anzahl in stundenplaene[aufgabe.id].items():
+                    newEntry['u'+str(uhrzeit)] = {
+                        'required': anzahl,
+                        'zugeteilt': zugeteilt.get((aufgabe.id, uhrzeit), 0),
                         }
 
-                # TODO: Die Schleifen auf aggregate processing umstellen
-                for zs in aufgabe.zuteilung_set.all():
-                    for stdzut in zs.stundenzuteilung_set.all():
-                        newEntry['u'+str(stdzut.uhrzeit)]['zugeteilt'] += 1
-
-
-                # newEntry['zugeteilt'] = None
                 newEntry['stundenplanlink'] = mark_safe('<a href="{0}">Stundenplan</a>'.format(
                     reverse ('arbeitsplan-stundenplaeneEdit',
                              args=(aufgabe.id,)),
@@ -1366,11 +1426,6 @@ class ZuteilungUebersichtView(isVorstandMixin, FilteredListView):
 
             data.append(newEntry)
 
-        # TODO: allow filtering of those Aufgaben
-        # qs = self.apply_filter(qs)
-
-        # for each remaining Aufgabe in qs, find the already assigned STunden
-
         return data
 
 
@@ -1398,19 +1453,21 @@ class StundenplaeneEdit(isVorstandMixin, FilteredListView):
     Vornamen / Nachnamen """
 
 
-    def get_filtered_table(self, qs, aufgabe):
-        table = self.tableClassFactory(qs, aufgabe)
+    def get_filtered_table(self, qs, benoetigt, zugewiesen):
+        table = self.tableClassFactory(qs, benoetigt, zugewiesen)
         django_tables2.RequestConfig(self.request, paginate=False).configure(table)
 
         return table
 
     def get_queryset(self):
         """For a given Aufgabe, find all users with a zuteiulung to that aufgabe.
-        Construct, for each such users, two things:
-        a) checkboxes, showing for each possible Stundenplan timeslot,
-           whether it is currently occupiued or not
-        b) an entry in the data: list of dictionaries with entries first_name,
-           last_name, and the timeslots 0/1
+        Construct, for each such users, an entry in the data: list of
+        dictionaries with entries first_name, last_name, anzahl and the
+        timeslots 0/1 (checkboxes, showing for each possible Stundenplan
+        timeslot, whether it is currently occupied or not).
+
+        Everything is computed from one fetch of the Stundenplan and one
+        prefetch of the Zuteilungen with users and Stundenzuteilungen.
         """
 
         try:
@@ -1425,137 +1482,121 @@ class StundenplaeneEdit(isVorstandMixin, FilteredListView):
                            + " - Aufgabe: " + aufgabe.aufgabe
                            + " " + aufgabe.datum.isoformat())
 
+        benoetigt = dict(aufgabe.stundenplan_set.values_list('uhrzeit', 'anzahl'))
+        zuteilungen = (aufgabe.zuteilung_set
+                       .select_related('ausfuehrer')
+                       .prefetch_related('stundenzuteilung_set')
+                       .order_by('ausfuehrer__last_name', 'ausfuehrer__first_name'))
+
         data = []
         checkedboxes = []
-
-        stundenplan = aufgabe.stundenplan_set.filter(anzahl__gt=0)
-
-        zugeteilteUser = [z.ausfuehrer for z in aufgabe.zuteilung_set.all()]
-
-        # construct the checkboxes string:
-        # userid_uhrzeit, if that user works on that time
-
-        # for each zuteilung, the following gives a separate queryset:
-        stundenzuteilungenQuerysets = [z.stundenzuteilung_set.all()
-                                       for z in aufgabe.zuteilung_set.all()]
-        checkedboxes = [str(sz.zuteilung.ausfuehrer.id) + "_" + str(sz.uhrzeit)
-                        for szQs in stundenzuteilungenQuerysets
-                        for sz in szQs]
+        zugewiesen = collections.Counter()
 
         # construct the list of dicts for users:
-        for u in zugeteilteUser:
+        for zuteilung in zuteilungen:
+            u = zuteilung.ausfuehrer
+            stunden = set(sz.uhrzeit for sz in zuteilung.stundenzuteilung_set.all())
+            # userid_uhrzeit, if that user works on that time
+            checkedboxes.extend(str(u.id) + "_" + str(uhrzeit)
+                                for uhrzeit in sorted(stunden))
             newEntry = {'last_name': u.last_name,
                         'first_name': u.first_name,
+                        'anzahl': (zuteilung.zusatzhelfer,
+                                   'anzahl_{}'.format(str(u.id))),
                         }
-            zuteilungThisUser = aufgabe.zuteilung_set.filter(ausfuehrer=u)
-            if zuteilungThisUser.count() != 1:
-                messages.error('Error 13: ' + aufgabe.__unicode__()
-                               + ' - ' + u.__unicode__())
-
-            newEntry['anzahl'] = (zuteilungThisUser[:1].get().zusatzhelfer,
-                                  'anzahl_{}'.format(str(u.id)))
-
-            stundenzuteilung = (zuteilungThisUser[:1].get().
-                                stundenzuteilung_set.values_list('uhrzeit',
-                                                                 flat=True))
-            for s in stundenplan:
-                newEntry['u'+str(s.uhrzeit)] = ((1 if s.uhrzeit in stundenzuteilung
-                                                 else 0),
-                                                 ('uhrzeit_' +
-                                                  str(u.id) + "_" +
-                                                  str(s.uhrzeit)),
-                                                 )
+            for uhrzeit, anzahl in benoetigt.items():
+                if anzahl > 0:
+                    newEntry['u'+str(uhrzeit)] = ((1 if uhrzeit in stunden else 0),
+                                                  ('uhrzeit_' +
+                                                   str(u.id) + "_" +
+                                                   str(uhrzeit)),
+                                                  )
+            for uhrzeit in stunden:
+                zugewiesen[uhrzeit] += zuteilung.zusatzhelfer + 1
             data.append(newEntry)
 
-
-        ## # TODO: rewrite that to only iterate over users with zuteilung for this aufgabe
-        ## # should be tremendously more efficient
-        ## for u in models.User.objects.all():
-        ##     newEntry = {'last_name': u.last_name,
-        ##                 'first_name': u.first_name,
-        ##                 }
-
-        ##     try:
-        ##         zuteilung = models.Zuteilung.objects.get(ausfuehrer=u,
-        ##                                                  aufgabe=aufgabe)
-        ##         stundenzuteilungen =  zuteilung.stundenzuteilung_set.values_list('uhrzeit',
-        ##                                                                          flat=True )
-
-        ##         for s in stundenplaene:
-        ##             tag = 'uhrzeit_' + str(u.id) + "_" + str(s.uhrzeit)
-        ##             present = s.uhrzeit in stundenzuteilungen
-        ##             newEntry['u'+ str(s.uhrzeit)] = (1 if present else 0, tag)
-        ##             if present:
-        ##                 checkedboxes.append(str(u.id) + "_" + str(s.uhrzeit))
-
-        ##         data.append(newEntry)
-
-        ##     except models.Zuteilung.DoesNotExist:  # keine Zuteilung gefunden
-        ##         pass
-
-        ## # prepare user id list to be passed into the hidden field,
-        ## # to ease processing later
+        # the boxes checked when rendering, so that the submit only removes
+        # hours unchecked on this page, not hours added in the meantime
         self.tableformHidden = [{'name': 'checkedboxes',
                                  'value': ','.join(checkedboxes)}]
 
-        table = self.get_filtered_table(data, aufgabe)
+        table = self.get_filtered_table(data, benoetigt, zugewiesen)
 
         return table
 
     def post(self, request, aufgabeid, *args, **kwargs):
-        if self.request.POST.get('checkedboxes'):
-            tmp = [x.split('_')
-                   for x in
-                   self.request.POST.get('checkedboxes').split(',')
-                  ]
-        else:
-            tmp = []
-
-        checkedboxes = [(int(x[0]), int(x[1])) for x in tmp ]
+        """Apply the submitted matrix as a diff to the stored Stundenzuteilungen.
+
+        All Zuteilungen of the Aufgabe are loaded once with their
+        Stundenzuteilungen; only users (anzahl_ fields) and hours (Stundenplan
+        with anzahl > 0) shown on the submitted page are compared. A
+        Stundenzuteilung is only deleted if its box was checked when the page
+        was rendered (hidden field checkedboxes) and is unchecked now, so a
+        stale page does not remove hours someone else assigned in the
+        meantime. Inserts, deletes and the notification flag are written in
+        bulk in one transaction.
+        """
 
-        # any values to add?
-        for v in self.request.POST:
+        aufgabe = get_object_or_404(models.Aufgabe, pk=aufgabeid)
+        zuteilungen = (aufgabe.zuteilung_set
+                       .prefetch_related('stundenzuteilung_set'))
+        uhrzeiten = set(aufgabe.stundenplan_set.filter(anzahl__gt=0)
+                        .values_list('uhrzeit', flat=True))
 
-            if v.startswith('anzahl'):
-                # what is the anzahl value?
-                anzahl = int(self.request.POST.get(v))
+        angezeigt = set()
+        for box in self.request.POST.get('checkedboxes', '').split(','):
+            if box:
+                uid, uhrzeit = box.split('_')
+                angezeigt.add((int(uid), int(uhrzeit)))
 
+        anzahl = {}
+        gewaehlt = set()
+        for v in self.request.POST:
+            if v.startswith('anzahl_'):
                 _tmp, uid = v.split('_')
-                zuteilung = models.Zuteilung.objects.get (ausfuehrer__id = uid,
-                                                          aufgabe__id = aufgabeid)
-
-                if zuteilung.zusatzhelfer != anzahl:
-                    zuteilung.zusatzhelfer = anzahl
-                    zuteilung.save()
-
+                anzahl[int(uid)] = int(self.request.POST.get(v))
             if v.startswith('uhrzeit_'):
                 tag, uid, uhrzeit = v.split('_')
-
-                # try to remove this checked box from the list of originally checked boxes,
-                # not a problem if not there, then it is simply a new check
-                try:
-                    checkedboxes.remove ((int(uid), int(uhrzeit)))
-                except ValueError:
-                    pass
-
-                zuteilung = models.Zuteilung.objects.get (ausfuehrer__id = uid,
-                                                          aufgabe__id = aufgabeid)
-                stundenzuteilung, created  = models.StundenZuteilung.objects.get_or_create (
-                    zuteilung = zuteilung,
-                    uhrzeit = int(uhrzeit),
-                    )
-                if created:
-                    stundenzuteilung.save()
-
-        # anything still in checkedboxes had been checked before, but was not in QueryDict
-        # i.e., it has been uncheked by user and should be removed
-        for uid, uhrzeit in checkedboxes:
-            zuteilung =  models.Zuteilung.objects.get (ausfuehrer__id = uid,
-                                                          aufgabe__id = aufgabeid)
-
-            stundenzuteilung = zuteilung.stundenzuteilung_set.get(uhrzeit=uhrzeit)
-
-            stundenzuteilung.delete()
+                gewaehlt.add((int(uid), int(uhrzeit)))
+
+        geaendert = []
+        neu = []
+        entfernt = []
+        betroffen = set()
+        for zuteilung in zuteilungen:
+            uid = zuteilung.ausfuehrer_id
+            if uid not in anzahl:
+                # not shown on the submitted page
+                continue
+
+            if zuteilung.zusatzhelfer != anzahl[uid]:
+                zuteilung.zusatzhelfer = anzahl[uid]
+                geaendert.append(zuteilung)
+                betroffen.add(uid)
+
+            vorhanden = {sz.uhrzeit: sz.pk
+                         for sz in zuteilung.stundenzuteilung_set.all()}
+            for uhrzeit in uhrzeiten:
+                if (uid, uhrzeit) in gewaehlt and uhrzeit not in vorhanden:
+                    neu.append(models.StundenZuteilung(zuteilung=zuteilung,
+                                                       uhrzeit=uhrzeit))
+                    betroffen.add(uid)
+                elif ((uid, uhrzeit) in angezeigt
+                      and (uid, uhrzeit) not in gewaehlt
+                      and uhrzeit in vorhanden):
+                    entfernt.append(vorhanden[uhrzeit])
+                    betroffen.add(uid)
+
+        with transaction.atomic():
+            if geaendert:
+                models.Zuteilung.objects.bulk_update(geaendert, ['zusatzhelfer'])
+            if neu:
+                # a concurrent submit may have added the same hour already
+                models.StundenZuteilung.objects.bulk_create(neu,
+                                                            ignore_conflicts=True)
+            if entfernt:
+                models.StundenZuteilung.objects.filter(pk__in=entfernt).delete()
+            models.benachrichtigung_vormerken(betroffen)
 
         return redirect (# "arbeitsplan-stundenplaeneEdit",
                          self.request.get_full_path(),
@@ -1787,13 +1828,26 @@ class Salden(isVorstandMixin, FilteredListView):
     filtertitle = "Salden nach Vor- oder Nachnamen filtern"
     filterform_class = forms.SaldenFilter
 
+    def saldenstatus_filter(self, qs, saldenstatus):
+        """Apply the Saldenstatus filter in the database,
+        see MitgliedQuerySet.saldenstatus for the definition of the choices.
+        """
+        if saldenstatus in ('OK', 'CH', 'PR'):
+            qs = qs.filter(mitglied__in=models.Mitglied.objects.saldenstatus(
+                saldenstatus).values('pk'))
+        return qs
+
     filterconfig = [('first_name', 'first_name__icontains'),
                     ('last_name', 'last_name__icontains'),
+                    ('saldenstatus', saldenstatus_filter),
                     ]
 
 
     model = models.User
 
+    def get_data(self):
+        return models.User.objects.select_related("mitglied")
+
     intro_text = """
     Ein Überblick über die von den Mitgliedern geleistete Arbeit,
     basiered auf den vorliegenden Leistungsmeldungen und deren
@@ -1832,44 +1886,27 @@ class Salden(isVorstandMixin, FilteredListView):
     # TODO: für einen anklickbaren User braucht es nur:
     # http://127.0.0.1:8000/arbeitsplan/leistungenBearbeiten/z=all/?last_name=Pan&first_name=Peter&status=OF&filter=Filter+anwenden
 
-    def check_filter(self, userdata):
-        """Apply a filter based on annotated data. HArd to do in the generic way
-        of filterprocessing...
-        """
-        try:
-            filterchoice = self.filterform.cleaned_data['saldenstatus']
-        except AttributeError:
-            filterchoice = '--'
-        # see the Saldenstatus table for definition of these choices!
-
-        return {
-            '--': lambda u: True,
-            'OK': lambda u: u['AK'][0] >= u['user'].mitglied.arbeitslast,
-            'CH': lambda u: ((u['AK'][0] < u['user'].mitglied.arbeitslast) and
-                             (u['AK'][0] +
-                              u['OF'][0] +
-                              u['future'] + u['nodate'] >=
-                             u['user'].mitglied.arbeitslast)
-                             ),
-            'PR': lambda u: (u['AK'][0] +
-                             u['OF'][0] +
-                             u['future'] + u['nodate'] <
-                             u['user'].mitglied.arbeitslast),
-            }[filterchoice](userdata)
-
     def annotate_data(self, userQs):
         res = []
 
         rurl = reverse("arbeitsplan-leistungBearbeiten", args=('all',))
 
+        # two grouped queries for the filtered members instead of queries
+        # per member
+        leistungen = dict((l['melder'], l) for l in
+                          models.Leistung.objects.filter(melder__in=userQs)
+                          .zeit_nach_status())
+        zuteilungen = dict((z['ausfuehrer'], z) for z in
+                           models.Zuteilung.objects.filter(ausfuehrer__in=userQs)
+                           .stunden_nach_datum())
+
         for u in userQs:
             tmp = {}
             tmp['user'] = u
             tmp['box'] = ("box-" + str(u.id), True)
-            qs = models.Leistung.objects.filter(melder=u)
+            zeiten = leistungen.get(u.id, {})
             for s in models.Leistung.Status:
-                zeit = qs.filter(status=s.value
-                                 ).aggregate(Sum('zeit'))['zeit__sum']
+                zeit = zeiten.get(s.value)
 
                 if zeit:
                     linktarget = rurl + "?" + urlencode({
@@ -1884,15 +1921,12 @@ class Salden(isVorstandMixin, FilteredListView):
 
                 tmp[s.value] = (zeit, linktarget)
 
+            stunden = zuteilungen.get(u.id, {})
+            zugeteilt = stunden.get('gesamt', 0)
 
-            # TODO: add linked column here as well
-            ## zugeteilt = (models.Zuteilung.objects.
-            ##              filter(ausfuehrer=u).aggregate(Sum('aufgabe__stunden'))['aufgabe__stunden__sum'])
-            zugeteilt = u.mitglied.zugeteilteStunden()
-
-            tmp['past'] = u.mitglied.zugeteilteStunden(-1)
-            tmp['future'] = u.mitglied.zugeteilteStunden(+1)
-            tmp['nodate'] = u.mitglied.zugeteilteStunden(0)
+            tmp['past'] = stunden.get('vergangen', 0)
+            tmp['future'] = stunden.get('zukuenftig', 0)
+            tmp['nodate'] = stunden.get('ohne_datum', 0)
             linktarget = reverse("arbeitsplan-zuteilunglist",
                                  args=('all',)) + "?" + urlencode({
                                      'last_name': u.last_name,
@@ -1902,8 +1936,7 @@ class Salden(isVorstandMixin, FilteredListView):
 
             tmp['zugeteilt'] = (zugeteilt, linktarget)
 
-            if self.check_filter(tmp):
-                res.append(tmp)
+            res.append(tmp)
 
         return res
 
@@ -1957,31 +1990,52 @@ class FilteredEmailCreateView (isVorstandMixin, FilteredListView):
 
     def post(self, request, *args, **kwargs):
 
-        users_no_email = []
-
-        # extarct all the ids that are to be sent out
+        # extract all the ids that are to be sent out
         idlist = []
         for k in list(request.POST.keys()):
             if k.startswith('sendit_'):
                 __, sendid = k.split('_')
                 idlist.append(int(sendid))
 
-        ergaenzung = request.POST['ergaenzung']
+        # the mails are rendered and queued by a background job,
+        # see svpb.jobs and arbeitsplan.jobs.notifications
+        jobs.enqueue(
+            "arbeitsplan.jobs.notifications",
+            "{0} ({1} Empfänger)".format(self.title, len(idlist)),
+            user=request.user,
+            view="{0}.{1}".format(type(self).__module__, type(self).__name__),
+            ids=idlist,
+            anmerkungen={str(i): request.POST.get('anmerkung_'+str(i), '')
+                         for i in idlist},
+            ergaenzung=request.POST['ergaenzung'],
+        )
+        messages.success(request,
+                         format_html("{0} Benachrichtigungen werden im Hintergrund "
+                                     'eingetragen, siehe <a href="{1}">Aufträge</a>.',
+                                     len(idlist), reverse("jobs")))
+
+        ## TODO: better redirect home
+        return redirect(request.get_full_path())
+
+    def send(self, job, ids, anmerkungen, ergaenzung):
+        """Queue the mails for the given ids; called by the background job.
 
-        # do the actual sending:
-        # pull out the leistungs object and send it out
-        for i in idlist:
-            instance = self.model.objects.get(pk=i)
+        Users without email address are listed in job.message.
+        """
+
+        users_no_email = []
+        gesendet = 0
+
+        # pull out the instances and send them out
+        for instance in self.model.objects.filter(pk__in=ids):
             thisuser = self.getUser (instance)
 
             if thisuser.email:
-                anmerkung = request.POST['anmerkung_'+str(i)]
-
                 ## construct the dict manually; model_to_dict or similar not plausible;
                 ## sadly, not possible to pass a model instance AND a dict into send_mail
 
                 d = self.constructTemplateDict(instance)
-                d['anmerkung'] = anmerkung
+                d['anmerkung'] = anmerkungen.get(str(instance.pk), "")
                 d['ergaenzung'] = ergaenzung
 
                 mail.send(
@@ -1991,22 +2045,17 @@ class FilteredEmailCreateView (isVorstandMixin, FilteredListView):
                     )
 
                 self.saveUpdate(instance, thisuser)
-
-                messages.success(request,
-                                 "Benachrichtigung an "
-                                 "Mitglied {0} {1} eingetragen".format(thisuser.first_name,
-                                                                        thisuser.last_name,))
+                gesendet += 1
             else:
                 if not thisuser in users_no_email:
-                    messages.error(request,
-                                   "Für Nutzer {0} {1} liegt keine email-Adresse vor,"
-                                   " keine Benachrichtigung gesendet".format(thisuser.first_name,
-                                                                              thisuser.last_name,)
-                                                                              )
                     users_no_email.append(thisuser)
 
-        ## TODO: better redirect home
-        return redirect(request.get_full_path())
+        job.message = "{0} Benachrichtigungen eingetragen.".format(gesendet)
+        if users_no_email:
+            job.message += (
+                "\nKeine email-Adresse, keine Benachrichtigung gesendet: " +
+                ", ".join("{0} {1}".format(u.first_name, u.last_name)
+                          for u in users_no_email))
 
 
 class MeldungNoetigEmailView(FilteredEmailCreateView):
@@ -2042,12 +2091,14 @@ class MeldungNoetigEmailView(FilteredEmailCreateView):
         #   - Members which already worked enough (members can report for arbitrary
         #     tasks without an assignment existing)
         #   - Members with enough assignments
-        qs = [
-            q
-            for q in qs
-            if (q.akzeptierteStunden() < q.arbeitslast)
-            and (q.zugeteilteStunden() < q.arbeitslast)
-        ]
+        qs = (
+            qs.with_balances()
+            .filter(
+                akzeptierte_stunden__lt=F("arbeitslast"),
+                zugeteilte_stunden__lt=F("arbeitslast"),
+            )
+            .select_related("user")
+        )
 
         return qs
 
@@ -2119,15 +2170,24 @@ class ZuteilungEmailView(FilteredEmailCreateView):
     def getUser(self, instance):
         return instance.user
 
+    def send(self, job, ids, anmerkungen, ergaenzung):
+        # assignments changed after this moment keep their flag, see saveUpdate
+        self.start = datetime.datetime.now(tz=datetime.timezone.utc)
+        super(ZuteilungEmailView, self).send(job, ids, anmerkungen, ergaenzung)
+
     def saveUpdate(self, instance, thisuser):
-        """ tell the instance (of Mitglied) that it has been notified"""
+        """ tell the instance (of Mitglied) that it has been notified
 
-        instance.zuteilungsbenachrichtigung = datetime.datetime.now(
-            tz=datetime.timezone.utc
-        )
-        instance.zuteilungBenachrichtigungNoetig = False
+        Like notify_about_assignments, the flag is only cleared if the
+        assignments did not change since the job started, and only the
+        notification fields are written.
+        """
 
-        instance.save()
+        (models.Mitglied.objects.filter(pk=instance.pk)
+         .filter(Q(zuteilungGeaendert__isnull=True)
+                 | Q(zuteilungGeaendert__lte=self.start))
+         .update(zuteilungBenachrichtigungNoetig=False,
+                 zuteilungsbenachrichtigung=self.start))
 
     def annotate_data(self, qs):
         qs = super(ZuteilungEmailView, self).annotate_data(qs)
@@ -1,4 +1,4 @@
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import io
 import locale
 
@@ -10,7 +10,7 @@ from django.utils.safestring import mark_safe
 from PIL import Image
 
 from .custom_widgets import AdvancedFileInput
-from .models import Boat
+from .models import Boat, club_boat_choices
 
 
 locale.setlocale(locale.LC_TIME, "de_DE.UTF-8")
@@ -93,25 +93,8 @@ BOOKING_TYPE = [
     ["REP", "Reparatur"],
 ]
 
-MONTHS = []
-MONTHS.append(["01", "Januar"])
-MONTHS.append(["02", "Februar"])
-MONTHS.append(["03", "März"])
-MONTHS.append(["04", "April"])
-MONTHS.append(["05", "Mai"])
-MONTHS.append(["06", "Juni"])
-MONTHS.append(["07", "Juli"])
-MONTHS.append(["08", "August"])
-MONTHS.append(["09", "September"])
-MONTHS.append(["10", "Oktober"])
-MONTHS.append(["11", "November"])
-MONTHS.append(["12", "Dezember"])
-
-DAYS = []
-for i in range(1, 10):
-    DAYS.append(["0" + str(i), "0" + str(i)])
-for i in range(10, 32):
-    DAYS.append([str(i), str(i)])
+# Maximum number of dates of one priority reservation
+MAX_PRIORITY_DATES = 60
 
 
 class NewReservationForm(forms.Form):
@@ -198,15 +181,6 @@ class NewReservationForm(forms.Form):
 
 
 class NewClubReservationForm(forms.Form):
-    CBOATS = []
-
-    try:
-        club_boats = Boat.objects.filter(club_boat=True)
-        for cb in club_boats:
-            CBOATS.append([cb.pk, cb.name + " (" + cb.type.name + ")"])
-    except Exception:
-        pass
-
     res_type = forms.ChoiceField(
         label="Reservierungs-Typ",
         required=True,
@@ -217,13 +191,23 @@ class NewClubReservationForm(forms.Form):
         label="Vereinsboot",
         required=True,
         widget=forms.CheckboxSelectMultiple,
-        choices=CBOATS,
+        choices=[],  # set per instance, see __init__
     )
-    res_month = forms.ChoiceField(
-        label="Monat", required=True, widget=forms.Select(), choices=MONTHS
+    res_date = forms.DateField(
+        label="Datum",
+        required=True,
+        widget=forms.DateInput(attrs={"type": "date"}),
     )
-    res_day = forms.ChoiceField(
-        label="Tag des Monats", required=True, widget=forms.Select(), choices=DAYS
+    res_until = forms.DateField(
+        label="Wöchentlich wiederholen bis",
+        required=False,
+        widget=forms.DateInput(attrs={"type": "date"}),
+    )
+    res_dates = forms.CharField(
+        label="Weitere Termine",
+        required=False,
+        widget=forms.Textarea(attrs={"rows": 3}),
+        help_text="Ein Datum pro Zeile, z.B. 24.05.2025",
     )
     res_start = forms.ChoiceField(
         label="Von",
@@ -248,32 +232,95 @@ class NewClubReservationForm(forms.Form):
 
         self.helper.add_input(Submit("submit", "Termin speichern"))
         super(NewClubReservationForm, self).__init__(*args, **kwargs)
+        self.fields["res_boat"].choices = club_boat_choices()
 
     def clean(self):
+        """Collect all dates in cleaned_data["dates"], the times as time objects."""
         cleaned_data = super(NewClubReservationForm, self).clean()
 
         # check date and time
-        now = datetime.now()
-        res_year = now.year
-        res_month = cleaned_data["res_month"]
-        res_day = cleaned_data["res_day"]
-        res_start = cleaned_data["res_start"]
-        res_end = cleaned_data["res_end"]
-
-        res_date = str(res_year) + "-" + res_month + "-" + res_day
-
+        res_date = cleaned_data.get("res_date")
+        if not res_date:
+            raise forms.ValidationError("Bitte Datum auswählen.")
         try:
-            start = datetime.strptime(res_date + " " + res_start, "%Y-%m-%d %H:%M")
-        except ValueError:
-            raise forms.ValidationError("Bitte Datum und Start-Uhrzeit auswählen.")
+            start = datetime.strptime(cleaned_data["res_start"], "%H:%M").time()
+        except (KeyError, ValueError):
+            raise forms.ValidationError("Bitte Start-Uhrzeit auswählen.")
         try:
-            end = datetime.strptime(res_date + " " + res_end, "%Y-%m-%d %H:%M")
-        except ValueError:
-            raise forms.ValidationError("Bitte Datum und End-Uhrzeit auswählen.")
+            end = datetime.strptime(cleaned_data["res_end"], "%H:%M").time()
+        except (KeyError, ValueError):
+            raise forms.ValidationError("Bitte End-Uhrzeit auswählen.")
 
         if start >= end:
             raise forms.ValidationError("Das Ende muss nach dem Start sein.")
 
+        # collect dates: first date, weekly repetitions and further dates
+        dates = {res_date}
+        res_until = cleaned_data.get("res_until")
+        if res_until:
+            if res_until < res_date:
+                raise forms.ValidationError(
+                    "Das Ende der Wiederholung muss nach dem Datum sein."
+                )
+            # check before building the dates, res_until may be years ahead
+            if (res_until - res_date).days // 7 + 1 > MAX_PRIORITY_DATES:
+                raise forms.ValidationError(
+                    f"Maximal {MAX_PRIORITY_DATES} Termine auf einmal möglich."
+                )
+            d = res_date
+            while d <= res_until:
+                dates.add(d)
+                d += timedelta(days=7)
+        for line in cleaned_data.get("res_dates", "").split():
+            try:
+                dates.add(datetime.strptime(line, "%d.%m.%Y").date())
+            except ValueError:
+                raise forms.ValidationError(
+                    f"Unbekanntes Datum: {line} (bitte als TT.MM.JJJJ angeben)."
+                )
+
+        if min(dates) < date.today():
+            raise forms.ValidationError(
+                "Termine in der Vergangenheit sind nicht möglich."
+            )
+        if len(dates) > MAX_PRIORITY_DATES:
+            raise forms.ValidationError(
+                f"Maximal {MAX_PRIORITY_DATES} Termine auf einmal möglich."
+            )
+
+        cleaned_data["dates"] = sorted(dates)
+        cleaned_data["start"] = start
+        cleaned_data["end"] = end
+        return cleaned_data
+
+
+class BookingHistoryForm(forms.Form):
+    """Filters of the booking history (booking_all), all optional."""
+
+    von = forms.DateField(
+        label="Von", required=False, widget=forms.DateInput(attrs={"type": "date"})
+    )
+    bis = forms.DateField(
+        label="Bis", required=False, widget=forms.DateInput(attrs={"type": "date"})
+    )
+    boot = forms.ModelChoiceField(
+        label="Boot",
+        required=False,
+        queryset=Boat.objects.select_related("type").order_by("name"),
+    )
+
+    def __init__(self, *args, **kwargs):
+        super(BookingHistoryForm, self).__init__(*args, **kwargs)
+        self.helper = FormHelper()
+        self.helper.form_id = "id-booking-history"
+        self.helper.form_class = "blueForms"
+        self.helper.form_method = "GET"
+        self.fields["boot"].label_from_instance = (
+            lambda boat: boat.name + " (" + boat.type.name + ")"
+        )
+
+        self.helper.add_input(Submit("submit", "Filtern"))
+
 
 class BootIssueForm(forms.Form):
     res_reported_descr = forms.CharField(
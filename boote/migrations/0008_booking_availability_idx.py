@@ -0,0 +1,19 @@
+# Generated by Django 5.2.14 on 2026-10-18 15:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boote', '0007_boat_instructions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['boat', 'date', 'status', 'time_from', 'time_to'], name='booking_availability_idx'),
+        ),
+    ]
@@ -3,8 +3,14 @@ from pathlib import Path
 import uuid
 
 from django.contrib.auth.models import User
+from django.core.cache import caches
 from django.core.validators import FileExtensionValidator
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
+
+# Cache lifetime of the public booking display (display_stamp) and of the
+# club boat choices (club_boat_choices)
+DISPLAY_TIMEOUT = 24 * 60 * 60
 
 
 class BoatType(models.Model):
@@ -17,6 +23,17 @@ class BoatType(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        super(BoatType, self).save(*args, **kwargs)
+        # the type name is part of the club boat choices and the display
+        invalidate_display(date.today())
+        invalidate_club_boats()
+
+    def delete(self, *args, **kwargs):
+        invalidate_display(date.today())
+        invalidate_club_boats()
+        return super(BoatType, self).delete(*args, **kwargs)
+
 
 def boat_img_path(instance, filename):
     unique_filename = uuid.uuid4()
@@ -51,26 +68,30 @@ class Boat(models.Model):
         validators=[FileExtensionValidator(allowed_extensions=["pdf"])],
     )
 
+    def save(self, *args, **kwargs):
+        super(Boat, self).save(*args, **kwargs)
+        # name, type or club_boat may have changed
+        invalidate_display(date.today())
+        invalidate_club_boats()
+
+    def delete(self, *args, **kwargs):
+        invalidate_display(date.today())
+        invalidate_club_boats()
+        return super(Boat, self).delete(*args, **kwargs)
+
     def getBookings7days(self):
         """Get list that describes bookings for upcoming 7 days.
 
         0 for free, 1 for partially booked, 2 for fully booked.
         """
-        d1 = datetime.now()
-        d2 = d1 + timedelta(days=6)
-        result = [0, 0, 0, 0, 0, 0, 0]
-        for booking in Booking.objects.filter(
-            boat=self, date__lte=d2, date__gte=d1, status=1
-        ):
-            offset = (booking.date - d1.date()).days
-            result[offset] = 1
-        return result
+        return booked_days(self, num_days=7)[self.pk]
 
     def get_detailed_bookings(self, num_days=1):
         """Get detailed bookings for the next num_days.
 
         The returned list is intended for usage in booking table templates.
-        It contains data for each half-hour slot from 8:00 to 22:00.
+        It contains data for each half-hour slot from 8:00 to 22:00, see
+        booking_grid for several boats at once.
 
         Args:
             num_days (int): The number of days to get bookings for.
@@ -81,46 +102,247 @@ class Boat(models.Model):
                     - second level: half-hour slots
                     - third level: booking details (user id, display name, booking type)
         """
-        start_hour = 8
-        end_hour = 22
-        # There are two half-hour slots per hour
-        num_slots = (end_hour - start_hour) * 2
-
-        # Initialize empty result structure [days][slots][booking data]
-        res = [[["", "", ""] for _ in range(num_slots)] for _ in range(num_days)]
-
-        start_date = date.today()
-        end_date = start_date + timedelta(days=num_days - 1)
-
-        for booking in Booking.objects.filter(
-            boat=self, date__lte=end_date, date__gte=start_date, status=1
-        ):
-            # Calculate index of the booking day relative to start_date
-            day_idx = (booking.date - start_date).days
-
-            uid = booking.user.username
-            usertag = booking.user.first_name + " " + booking.user.last_name
-
-            # Convert start and end times into half-hour slot indices
-            slot_start_idx = round(
-                (booking.time_from.hour - start_hour) * 2
-                + (booking.time_from.minute / 30)
-            )
-            slot_end_idx = round(
-                (booking.time_to.hour - start_hour) * 2 + (booking.time_to.minute / 30)
-            )
-
-            # Store booking data for corresponding half-hour slots
-            for i in range(max(0, slot_start_idx), min(num_slots, slot_end_idx)):
-                res[day_idx][i] = [uid, usertag, booking.type]
-
-        return res
+        return booking_grid(self, num_days)[self.pk]
 
     def getNumberOfIssues(self):
         return BoatIssue.objects.filter(boat=self, status=1).count()
 
 
+def club_boat_choices():
+    """Choices [id, "name (type)"] of all club boats.
+
+    Cached in the "boote" cache until a Boat is saved or deleted, so forms
+    need neither a query per instance nor one at import time.
+    """
+    cache = caches["boote"]
+    choices = cache.get("club_boat_choices")
+    if choices is None:
+        choices = [
+            [boat.pk, boat.name + " (" + boat.type.name + ")"]
+            for boat in Boat.objects.filter(club_boat=True).select_related("type")
+        ]
+        cache.set("club_boat_choices", choices, DISPLAY_TIMEOUT)
+    return choices
+
+
+def invalidate_club_boats():
+    """Drop the cached club_boat_choices, after the current transaction."""
+    transaction.on_commit(lambda: caches["boote"].delete("club_boat_choices"))
+
+
+def lock_boats(boats):
+    """Lock the rows of boats until the end of the current transaction.
+
+    Concurrent reservations of the same boat wait for each other, so an
+    availability check followed by an insert cannot be interleaved. Rows are
+    locked in the order of their ids to prevent deadlocks.
+    """
+    list(
+        Boat.objects.select_for_update()
+        .filter(pk__in=_boat_ids(boats))
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+
+
+def _boat_ids(boats):
+    if isinstance(boats, (Boat, int)):
+        boats = [boats]
+    return [b.pk if isinstance(b, Boat) else b for b in boats]
+
+
+def booked_days(boats, num_days=7):
+    """Which of the next num_days boats are booked, in one query.
+
+    Args:
+        boats: A Boat, a boat id or a list of them.
+        num_days (int): The number of days, starting today.
+
+    Returns:
+        dict: Boat id -> list with one entry per day, 0 for free, 1 for booked.
+    """
+    boat_ids = _boat_ids(boats)
+    start_date = date.today()
+    end_date = start_date + timedelta(days=num_days - 1)
+    res = {boat_id: [0] * num_days for boat_id in boat_ids}
+    for boat_id, day in Booking.objects.filter(
+        boat__in=boat_ids, date__lte=end_date, date__gte=start_date, status=1
+    ).values_list("boat", "date").distinct():
+        res[boat_id][(day - start_date).days] = 1
+    return res
+
+
+def booking_grid(boats, num_days=1):
+    """Detailed bookings of boats for the next num_days, in one query.
+
+    All active bookings of all boats are fetched at once (with their users) and
+    filled into the half-hour slots from 8:00 to 22:00 in one pass.
+
+    Args:
+        boats: A Boat, a boat id or a list of them.
+        num_days (int): The number of days, starting today.
+
+    Returns:
+        dict: Boat id -> list as returned by Boat.get_detailed_bookings.
+    """
+    start_hour = 8
+    end_hour = 22
+    # There are two half-hour slots per hour
+    num_slots = (end_hour - start_hour) * 2
+
+    # Initialize empty result structure {boat: [days][slots][booking data]}
+    boat_ids = _boat_ids(boats)
+    res = {
+        boat_id: [[["", "", ""] for _ in range(num_slots)] for _ in range(num_days)]
+        for boat_id in boat_ids
+    }
+
+    start_date = date.today()
+    end_date = start_date + timedelta(days=num_days - 1)
+
+    for booking in Booking.objects.filter(
+        boat__in=boat_ids, date__lte=end_date, date__gte=start_date, status=1
+    ).select_related("user"):
+        # Calculate index of the booking day relative to start_date
+        day = res[booking.boat_id][(booking.date - start_date).days]
+
+        uid = booking.user.username
+        usertag = booking.user.first_name + " " + booking.user.last_name
+
+        # Convert start and end times into half-hour slot indices
+        slot_start_idx = round(
+            (booking.time_from.hour - start_hour) * 2
+            + (booking.time_from.minute / 30)
+        )
+        slot_end_idx = round(
+            (booking.time_to.hour - start_hour) * 2 + (booking.time_to.minute / 30)
+        )
+
+        # Store booking data for corresponding half-hour slots
+        for i in range(max(0, slot_start_idx), min(num_slots, slot_end_idx)):
+            day[i] = [uid, usertag, booking.type]
+
+    return res
+
+
+def display_stamp(day):
+    """Time of the last change of the bookings on day.
+
+    Used as version of the cached public booking display and for its ETag and
+    Last-Modified headers. If no change is known, the time of the first call
+    is stored.
+    """
+    cache = caches["boote"]
+    key = f"booking_display:{day.isoformat()}"
+    stamp = cache.get(key)
+    if stamp is None:
+        stamp = timezone.now()
+        if not cache.add(key, stamp, DISPLAY_TIMEOUT):
+            # another process was faster
+            stamp = cache.get(key, stamp)
+    return stamp
+
+
+def invalidate_display(day):
+    """Mark the bookings on day as changed, after the current transaction."""
+    transaction.on_commit(lambda: caches["boote"].set(
+        f"booking_display:{day.isoformat()}", timezone.now(), DISPLAY_TIMEOUT
+    ))
+
+
+class BookingQuerySet(models.QuerySet):
+    def overlapping(self, boats, date, time_from, time_to):
+        """Active bookings of boats overlapping time_from to time_to on date.
+
+        boats is a Boat, a boat id or a list of them, or an expression like
+        OuterRef("boat") when used in a subquery. date may also be a list of
+        dates, to check all of them at once. Bookings just touching the
+        interval (ending at time_from or starting at time_to) do not overlap.
+        The lookup is covered by the availability index of Booking.
+        """
+        if hasattr(boats, "resolve_expression"):
+            boat_filter = {"boat": boats}
+        else:
+            boat_filter = {"boat__in": _boat_ids(boats)}
+        if isinstance(date, (list, tuple, set)):
+            date_filter = {"date__in": date}
+        else:
+            date_filter = {"date": date}
+        return self.filter(
+            **boat_filter,
+            **date_filter,
+            status=1,
+            time_from__lt=time_to,
+            time_to__gt=time_from,
+        )
+
+    def reserve(self, user, boat, date, time_from, time_to, type="PRV"):
+        """Create a Booking if boat is available from time_from to time_to.
+
+        The availability check and the insert run in one transaction with the
+        boat row locked, so two members cannot book the same slot at the same
+        time. Returns the new booking and an empty list, or None and the
+        overlapping bookings.
+        """
+        with transaction.atomic():
+            lock_boats(boat)
+            overlapping = list(self.overlapping(boat, date, time_from, time_to))
+            if overlapping:
+                return None, overlapping
+            return self.create(
+                user=user,
+                boat=boat,
+                type=type,
+                date=date,
+                time_from=time_from,
+                time_to=time_to,
+            ), []
+
+    def reserve_priority(self, user, boats, dates, time_from, time_to, type):
+        """Create priority bookings (e.g. Ausbildung) of boats on all dates.
+
+        Every date and boat is checked against the existing bookings in one
+        query, with the boats locked. If another priority booking overlaps,
+        nothing is created and None and the overlapping priority bookings are
+        returned. Otherwise overlapping member bookings (PRV) are displaced,
+        i.e. cancelled, and the new bookings and the displaced bookings are
+        returned. Everything happens in one transaction.
+        """
+        boat_ids = _boat_ids(boats)
+        with transaction.atomic():
+            lock_boats(boat_ids)
+            overlapping = list(
+                self.overlapping(boat_ids, list(dates), time_from, time_to)
+                .select_related("boat", "user")
+                .order_by("date", "time_from", "boat__name")
+            )
+            conflicts = [b for b in overlapping if b.type != "PRV"]
+            if conflicts:
+                return None, conflicts
+            # save() is bypassed, so the display is invalidated here
+            self.filter(pk__in=[b.pk for b in overlapping]).update(status=0)
+            for b in overlapping:
+                b.status = 0
+            bookings = self.bulk_create([
+                self.model(
+                    user=user,
+                    boat_id=boat_id,
+                    type=type,
+                    date=day,
+                    time_from=time_from,
+                    time_to=time_to,
+                )
+                for day in dates
+                for boat_id in boat_ids
+            ])
+            for day in set(dates):
+                invalidate_display(day)
+        return bookings, overlapping
+
+
 class Booking(models.Model):
+    objects = BookingQuerySet.as_manager()
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     created_date = models.DateField(default=datetime.now)
     boat = models.ForeignKey(Boat, on_delete=models.CASCADE)
@@ -140,6 +362,25 @@ class Booking(models.Model):
     time_to = models.TimeField()
     notified = models.BooleanField(default=False)
 
+    def save(self, *args, **kwargs):
+        super(Booking, self).save(*args, **kwargs)
+        invalidate_display(self.date)
+
+    def delete(self, *args, **kwargs):
+        invalidate_display(self.date)
+        return super(Booking, self).delete(*args, **kwargs)
+
+    class Meta:
+        indexes = [
+            # Availability of boats, see BookingQuerySet.overlapping
+            models.Index(
+                fields=["boat", "date", "status", "time_from", "time_to"],
+                name="booking_availability_idx",
+            ),
+            # Keyset pagination of the booking history, see booking_all
+            models.Index(fields=["date", "id"], name="booking_history_idx"),
+        ]
+
 
 class BoatIssue(models.Model):
     boat = models.ForeignKey(Boat, on_delete=models.CASCADE)
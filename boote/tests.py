@@ -0,0 +1,366 @@
+"""Tests of boat bookings"""
+from datetime import date, time, timedelta
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.http import QueryDict
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from .forms import NewClubReservationForm
+from .models import Boat, Booking, booked_days, booking_grid
+
+
+class BookingTest(TestCase):
+    fixtures = [
+        "arbeitsplan/fixtures/members.json",
+        "mitglieder/fixtures/groups.json",
+        "mitglieder/fixtures/user.json",
+        "boote/fixtures/01_boattypes.json",
+        "boote/fixtures/02_boats.json",
+    ]
+
+    def setUp(self):
+        self.user = User.objects.get(username="Mitglied")
+        self.boat = Boat.objects.get(pk=1)
+        self.tomorrow = date.today() + timedelta(days=1)
+        self.client = Client()
+        self.client.force_login(self.user)
+        caches["boote"].clear()
+
+    def book(self, time_from, time_to, boat=None, status=1):
+        # run the invalidation of the booking display
+        with self.captureOnCommitCallbacks(execute=True):
+            return Booking.objects.create(
+                user=self.user,
+                boat=boat or self.boat,
+                date=self.tomorrow,
+                time_from=time_from,
+                time_to=time_to,
+                status=status,
+            )
+
+    def test_overlapping(self):
+        """Test the interval overlap lookup."""
+        morning = self.book(time(9), time(11))
+        self.book(time(11), time(12), status=0)
+        other_boat = self.book(time(9), time(11), boat=Boat.objects.get(pk=2))
+
+        for time_from, time_to, expected in [
+            (time(8), time(9), []),
+            (time(8), time(9, 30), [morning]),
+            (time(10), time(10, 30), [morning]),
+            (time(10, 30), time(12), [morning]),
+            (time(8), time(12), [morning]),
+            (time(11), time(13), []),
+        ]:
+            with self.subTest(time_from=time_from, time_to=time_to):
+                self.assertEqual(
+                    list(Booking.objects.overlapping(
+                        self.boat, self.tomorrow, time_from, time_to)),
+                    expected,
+                )
+        self.assertCountEqual(
+            Booking.objects.overlapping([1, 2], self.tomorrow, time(10), time(12)),
+            [morning, other_boat],
+        )
+
+    def test_reserve(self):
+        """Test that a reservation checks availability in one locked query."""
+        self.book(time(9), time(11))
+        # savepoint, lock, overlap check, release
+        with self.assertNumQueries(4):
+            booking, overlapping = Booking.objects.reserve(
+                self.user, self.boat, self.tomorrow, time(10), time(12))
+        self.assertIsNone(booking)
+        self.assertEqual(len(overlapping), 1)
+
+        booking, overlapping = Booking.objects.reserve(
+            self.user, self.boat, self.tomorrow, time(11), time(12))
+        self.assertEqual((booking.time_from, booking.type), (time(11), "PRV"))
+        self.assertEqual(overlapping, [])
+
+    def test_booking_boot(self):
+        """Test booking a boat and the error for an overlapping booking."""
+        url = f"/boote/booking/boot/{self.boat.pk}/"
+        data = {
+            "res_date": self.tomorrow.strftime("%Y-%m-%d"),
+            "res_start": "10:00",
+            "res_duration": "120",
+            "accepted_agb": "on",
+        }
+        response = self.client.post(url, data)
+        self.assertRedirects(response, "/boote/booking/my_bookings/")
+        booking = Booking.objects.get()
+        self.assertEqual((booking.date, booking.time_from, booking.time_to),
+                         (self.tomorrow, time(10), time(12)))
+
+        data["res_start"] = "11:00"
+        response = self.client.post(url, data)
+        self.assertContains(response, "Dein Termin startet in anderem reservierten")
+        self.assertNotContains(response, "Dein Termin endet in anderem")
+        self.assertEqual(Booking.objects.count(), 1)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_booking_grid(self):
+        """Test the slot matrix of several boats, built in one query."""
+        self.book(time(9), time(10, 30))
+        self.book(time(11), time(12), status=0)
+        other_boat = Boat.objects.get(pk=2)
+        self.book(time(21), time(23), boat=other_boat)
+        with self.assertNumQueries(1):
+            grid = booking_grid([self.boat, other_boat], num_days=2)
+        self.assertEqual(len(grid[self.boat.pk]), 2)
+        today, tomorrow = grid[self.boat.pk]
+        self.assertEqual(len(tomorrow), 28)
+        self.assertTrue(all(slot == ["", "", ""] for slot in today))
+        entry = ["Mitglied", f"{self.user.first_name} {self.user.last_name}", "PRV"]
+        self.assertEqual(tomorrow[1:6], [["", "", ""]] + [entry] * 3 + [["", "", ""]])
+        self.assertEqual(grid[other_boat.pk][1][26:], [entry] * 2)
+        self.assertEqual(self.boat.get_detailed_bookings(2), grid[self.boat.pk])
+
+        with self.assertNumQueries(1):
+            days = booked_days([self.boat, other_boat])
+        self.assertEqual(days[self.boat.pk], [0, 1, 0, 0, 0, 0, 0])
+        self.assertEqual(self.boat.getBookings7days(), days[self.boat.pk])
+
+    def test_booking_today_public(self):
+        """Test that the public display is cached until today's bookings change."""
+        url = "/boote/booking/today/public/?tab=3"
+        self.client.logout()
+        self.tomorrow = date.today()
+        self.book(time(9), time(11))
+        with self.assertNumQueries(2):  # boats, bookings
+            response = self.client.get(url)
+        self.assertContains(response, "Vino")
+        self.assertNotContains(response, "Azubine")
+        self.assertIn("no-cache", response["Cache-Control"])
+        etag = response["ETag"]
+
+        # cached, and polling clients get a 304
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response["ETag"], etag)
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+
+        # other tabs are cached separately
+        response = self.client.get("/boote/booking/today/public/?tab=2")
+        self.assertContains(response, "Azubine")
+        self.assertNotEqual(response["ETag"], etag)
+
+        # bookings on other days do not change the display
+        self.tomorrow = date.today() + timedelta(days=1)
+        self.book(time(9), time(11))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # new bookings do, without querying per boat
+        self.tomorrow = date.today()
+        for boat in Boat.objects.filter(club_boat=True):
+            self.book(time(14), time(16), boat=boat)
+        with self.assertNumQueries(2):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        # as well as cancelled bookings
+        self.client.force_login(self.user)
+        booking = Booking.objects.filter(date=date.today()).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(f"/boote/booking_remove/{booking.pk}/")
+        self.client.logout()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        # and renamed boat types
+        with self.captureOnCommitCallbacks(execute=True):
+            self.boat.type.name = "Zugvogel"
+            self.boat.type.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_booking_overview(self):
+        """Test that the week overview and today's bookings do not query per boat."""
+        self.tomorrow = date.today()
+        self.book(time(9), time(11))
+        queries = {}
+        for url in ["/boote/booking/overview/", "/boote/booking/today/"]:
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(url)
+            self.assertContains(response, "Vino")
+            queries[url] = len(captured)
+
+        for boat in Boat.objects.filter(club_boat=True):
+            self.book(time(14), time(16), boat=boat)
+        for url, expected in queries.items():
+            with self.subTest(url=url), self.assertNumQueries(expected):
+                self.client.get(url)
+
+    def test_booking_all(self):
+        """Test the keyset pagination and filters of the booking history."""
+        other_boat = Boat.objects.get(pk=2)
+        bookings = []
+        for days in range(5):
+            self.tomorrow = date.today() - timedelta(days=days)
+            bookings.append(self.book(time(9), time(10)))
+            bookings.append(self.book(time(9), time(10), boat=other_boat))
+        # newest first, same date ordered by id
+        expected = sorted(bookings, key=lambda b: (b.date, b.pk), reverse=True)
+
+        url = "/boote/booking/all/"
+        with patch("boote.views.BOOKING_HISTORY_PAGE_SIZE", 4):
+            seen = []
+            params = {}
+            while True:
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url, params)
+                seen += response.context["bookings"]
+                if not response.context["next_params"]:
+                    break
+                params = QueryDict(response.context["next_params"])
+            # boat, type and user come with the bookings
+            self.assertEqual(
+                sum("boote_booking" in q["sql"] for q in queries), 1)
+            self.assertEqual(seen, expected)
+
+            response = self.client.get(url, {
+                "von": (date.today() - timedelta(days=3)).isoformat(),
+                "bis": (date.today() - timedelta(days=1)).isoformat(),
+                "boot": other_boat.pk,
+            })
+            self.assertEqual(
+                [b.date for b in response.context["bookings"]],
+                [date.today() - timedelta(days=d) for d in (1, 2, 3)],
+            )
+            self.assertTrue(
+                all(b.boat == other_boat for b in response.context["bookings"]))
+        self.assertContains(response, other_boat.name)
+        self.assertNotContains(response, "Als CSV exportieren")
+
+    def test_booking_all_csv(self):
+        """Test that the Vorstand can export the filtered booking history."""
+        self.book(time(9), time(10))
+        self.book(time(11), time(12), boat=Boat.objects.get(pk=2))
+        url = "/boote/booking/all/csv/"
+        response = self.client.get(url)
+        self.assertRedirects(
+            response, "/keinVorstand/?next=" + url, fetch_redirect_response=False)
+
+        self.client.force_login(User.objects.get(username="Vorstand"))
+        response = self.client.get(url, {"boot": self.boat.pk})
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith("Datum;Von;Bis;Boot"))
+        self.assertIn(f"{self.tomorrow.isoformat()};09:00;10:00;Vino;", lines[1])
+        self.assertIn(";Freie Nutzung;Aktiv;", lines[1])
+
+    def test_reserve_priority(self):
+        """Test that priority bookings displace member bookings, not each other."""
+        other_boat = Boat.objects.get(pk=2)
+        next_week = self.tomorrow + timedelta(days=7)
+        member = self.book(time(10), time(12))
+        other = self.book(time(8), time(9))  # touching only
+        dates = [self.tomorrow, next_week]
+        # savepoint, lock, overlap check, cancel, insert, release
+        with self.assertNumQueries(6):
+            bookings, displaced = Booking.objects.reserve_priority(
+                self.user, [self.boat, other_boat], dates, time(9), time(13), "AUS")
+        self.assertEqual(len(bookings), 4)
+        self.assertEqual(displaced, [member])
+        member.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((member.status, other.status), (0, 1))
+        self.assertEqual(
+            Booking.objects.filter(type="AUS", status=1, boat=other_boat).count(), 2)
+
+        bookings, conflicts = Booking.objects.reserve_priority(
+            self.user, [other_boat], [next_week], time(12), time(14), "REG")
+        self.assertIsNone(bookings)
+        self.assertEqual([(b.date, b.type) for b in conflicts], [(next_week, "AUS")])
+        self.assertFalse(Booking.objects.filter(type="REG").exists())
+
+    def test_booking_priority_boot(self):
+        """Test weekly priority bookings with a further date and the report."""
+        start = date.today() + timedelta(days=2)
+        member = self.book(time(10), time(11))
+        member.date = start + timedelta(days=14)
+        member.save()
+        self.client.force_login(User.objects.get(username="Vorstand"))
+        extra = start + timedelta(days=30)
+        data = {
+            "res_type": "AUS",
+            "res_boat": [str(self.boat.pk)],
+            "res_date": start.isoformat(),
+            "res_until": (start + timedelta(days=20)).isoformat(),
+            "res_dates": extra.strftime("%d.%m.%Y"),
+            "res_start": "09:00",
+            "res_end": "12:00",
+        }
+        response = self.client.post("/boote/booking/priority/new/", data, follow=True)
+        self.assertContains(response, "4 Termine eingetragen.")
+        self.assertContains(response, "wurden storniert")
+        self.assertEqual(
+            list(Booking.objects.filter(type="AUS").values_list("date", flat=True)
+                 .order_by("date")),
+            [start + timedelta(days=d) for d in (0, 7, 14, 30)],
+        )
+        member.refresh_from_db()
+        self.assertEqual(member.status, 0)
+        call_command("send_queued_mail")
+        self.assertEqual(mail.outbox[0].to, [self.user.email])
+        self.assertIn("Reservierung storniert", mail.outbox[0].subject)
+
+        # overlapping priority bookings are refused
+        response = self.client.post("/boote/booking/priority/new/", data)
+        self.assertContains(response, "es wurde nichts gespeichert")
+        self.assertEqual(Booking.objects.filter(type="AUS").count(), 4)
+
+        data["res_dates"] = "morgen"
+        response = self.client.post("/boote/booking/priority/new/", data)
+        self.assertContains(response, "Unbekanntes Datum: morgen")
+        data["res_dates"] = ""
+        data["res_date"] = (date.today() - timedelta(days=1)).isoformat()
+        response = self.client.post("/boote/booking/priority/new/", data)
+        self.assertContains(response, "Termine in der Vergangenheit")
+        data["res_date"] = start.isoformat()
+        data["res_until"] = "9999-12-31"
+        response = self.client.post("/boote/booking/priority/new/", data)
+        self.assertContains(response, "Maximal 60 Termine")
+
+    def test_club_boat_choices(self):
+        """Test that the club boat choices are cached until a boat is saved."""
+        with self.assertNumQueries(1):
+            form = NewClubReservationForm()
+        self.assertIn(
+            (self.boat.pk, "Vino (Kielzugvogel)"), form.fields["res_boat"].choices)
+        with self.assertNumQueries(0):
+            NewClubReservationForm()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.boat.name = "Vino II"
+            self.boat.save()
+            Boat.objects.create(
+                owner=self.user, type=self.boat.type, name="Neu", club_boat=True)
+        choices = NewClubReservationForm().fields["res_boat"].choices
+        self.assertIn((self.boat.pk, "Vino II (Kielzugvogel)"), choices)
+        self.assertIn("Neu (Kielzugvogel)", [label for _, label in choices])
+
+        # renaming the boat type changes the labels, too
+        with self.captureOnCommitCallbacks(execute=True):
+            self.boat.type.name = "Zugvogel"
+            self.boat.type.save()
+        choices = NewClubReservationForm().fields["res_boat"].choices
+        self.assertIn((self.boat.pk, "Vino II (Zugvogel)"), choices)
@@ -80,6 +80,10 @@ urlpatterns = [
          active_and_login_required(boote.views.booking_all),
          name="booking-all",
     ),
+    re_path(r'^booking/all/csv/$',
+         active_and_login_required(boote.views.booking_all_csv),
+         name="booking-all-csv",
+    ),
     re_path(r'^booking/my_bookings/$',
          active_and_login_required(boote.views.booking_my_bookings),
          name="booking-my-bookings",
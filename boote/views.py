@@ -1,25 +1,47 @@
-from datetime import datetime, timedelta
+import csv
+from datetime import date, datetime, timedelta
 
 from django.conf import settings
-from django.http import HttpResponseRedirect
+from django.contrib import messages
+from django.contrib.auth.decorators import user_passes_test
+from django.core.cache import caches
+from django.db.models import Q
+from django.http import HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import redirect, render
 from django.template.loader import render_to_string
 from django.urls import reverse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from post_office import mail
 
+from svpb.views import isVorstand
 from .forms import (
+    BookingHistoryForm,
     NewReservationForm,
     NewClubReservationForm,
     BootIssueForm,
     BootEditForm,
 )
-from .models import Boat, Booking, BoatIssue
+from .models import (
+    DISPLAY_TIMEOUT,
+    Boat,
+    Booking,
+    BoatIssue,
+    booked_days,
+    booking_grid,
+    display_stamp,
+)
+
+
+def club_boat_bookings(boats):
+    """Today's bookings of boats as [boat, slots] pairs, see booking_grid."""
+    boats = list(boats.select_related("type"))
+    grid = booking_grid(boats, num_days=1)
+    return [[boat, grid[boat.pk][0]] for boat in boats]
 
 
 def booking_today(request):
-    bookings = []
-    for boat in Boat.objects.filter(club_boat=True, active=True):
-        bookings.append([boat, boat.get_detailed_bookings(num_days=1)[0]])
+    bookings = club_boat_bookings(Boat.objects.filter(club_boat=True, active=True))
 
     context = {
         "bookings": bookings,
@@ -30,9 +52,13 @@ def booking_today(request):
 
 
 def booking_overview(request):
+    boats = list(
+        Boat.objects.filter(club_boat=True, active=True).select_related("type")
+    )
+    days = booked_days(boats, num_days=7)
     overview = []
-    for boat in Boat.objects.filter(club_boat=True, active=True):
-        overview.append([boat.name, boat.type.name, boat.pk, boat.getBookings7days()])
+    for boat in boats:
+        overview.append([boat.name, boat.type.name, boat.pk, days[boat.pk]])
 
     dates = []
     d = datetime.now()
@@ -58,85 +84,168 @@ def booking_training_public(request):
     return render(request, "boote/booking_traning.html", context)
 
 
+# Tabs of the public display: boat type shown, title and image. Tab 3 shows all
+# boats EXCEPT the types of the other tabs.
+PUBLIC_TABS = {
+    '1': ('Conger', 'Conger', 'boote/conger.jpg'),
+    '2': ('Mariner 19', 'Mariner 19', 'boote/mariner19.jpg'),
+    '3': (None, 'Andere Boote', 'boote/other.jpg'),
+    '4': ('Bootskran', 'Bootskran', 'boote/kran.jpg'),
+}
+
+
+def public_etag(request):
+    """ETag of the public display: changes with the bookings of today."""
+    tab = request.GET.get('tab', '1')
+    return f"{date.today()}-{tab}-{display_stamp(date.today()).timestamp()}"
+
+
+def public_last_modified(request):
+    return display_stamp(date.today())
+
+
+def public_bookings(tab):
+    """Today's bookings of the boats shown in tab, cached until they change."""
+    today = date.today()
+    # Unknown tabs show all boats
+    key = (f"booking_today_public:{today}:{display_stamp(today).timestamp()}:"
+           f"{tab if tab in PUBLIC_TABS else ''}")
+    cache = caches["boote"]
+    filtered_bookings = cache.get(key)
+    if filtered_bookings is None:
+        boats = Boat.objects.filter(club_boat=True)
+        specific_types = [t for t, _, _ in PUBLIC_TABS.values() if t]
+        if tab == '3':
+            boats = boats.exclude(type__name__in=specific_types)
+        elif tab in PUBLIC_TABS:
+            boats = boats.filter(type__name=PUBLIC_TABS[tab][0])
+        filtered_bookings = club_boat_bookings(boats)
+        cache.set(key, filtered_bookings, DISPLAY_TIMEOUT)
+    return filtered_bookings
+
+
+@cache_control(no_cache=True)
+@condition(etag_func=public_etag, last_modified_func=public_last_modified)
 def booking_today_public(request):
-    bookings = []
-    for boat in Boat.objects.filter(club_boat=True):
-        bookings.append([boat, boat.get_detailed_bookings(num_days=1)[0]])
-
-    # BOATS
-    boat_types = {
-        '1': 'Conger',
-        '2': 'Mariner 19',
-        '4': 'Bootskran'
-    }  # Map tabs to boat types
-
     tab = request.GET.get('tab', '1')  # Tab comes from request, defaults to '1'
-    target_type = boat_types.get(tab)
-
-    if tab == '3':  # Option 3: show all boats EXCEPT the specific types
-        specific_types = set(boat_types.values())
-        filtered_bookings = [
-            (boat, overviewday) for boat, overviewday in bookings
-            if boat.type.name not in specific_types
-        ]
-    else:
-        filtered_bookings = [
-            (boat, overviewday) for boat, overviewday in bookings
-            if target_type is None or boat.type.name == target_type
-        ]
-
-    # Title
-    tab_title = {
-        '1': 'Conger',
-        '2': 'Mariner 19',
-        '3': 'Andere Boote',
-        '4': 'Bootskran'
-    }
-    title = tab_title.get(tab)
-
-    # IMAGES
-    tab_images = {
-        '1': 'boote/conger.jpg',
-        '2': 'boote/mariner19.jpg',
-        '3': 'boote/other.jpg',
-        '4': 'boote/kran.jpg'
-    }
-    selected_image = tab_images.get(tab)
+    _, title, selected_image = PUBLIC_TABS.get(tab, (None, None, None))
 
     context = {
-        "bookings": bookings,
         "weekday": datetime.now().strftime("%A"),
         "date": datetime.now().strftime("%d. %b"),
         "time": datetime.now().strftime("%H:%M"),
         "tab": tab,
         "title": title,
         "selected_image": selected_image,
-        "filtered_bookings": filtered_bookings
+        "filtered_bookings": public_bookings(tab),
     }
 
     return render(request, "boote/booking_today_public.html", context)
 
 
+# Bookings per page of the booking history
+BOOKING_HISTORY_PAGE_SIZE = 50
+
+
+def booking_history(form):
+    """Bookings matching the filters of form, newest first.
+
+    Invalid or missing filters are ignored.
+    """
+    bookings = Booking.objects.select_related("boat__type", "user").order_by(
+        "-date", "-id"
+    )
+    if form.is_valid():
+        if form.cleaned_data["von"]:
+            bookings = bookings.filter(date__gte=form.cleaned_data["von"])
+        if form.cleaned_data["bis"]:
+            bookings = bookings.filter(date__lte=form.cleaned_data["bis"])
+        if form.cleaned_data["boot"]:
+            bookings = bookings.filter(boat=form.cleaned_data["boot"])
+    return bookings
+
+
 def booking_all(request):
-    bookings = []
-    for booking in Booking.objects.filter().order_by("-date"):
-        bookings.append(
-            [
-                booking,
-                booking.date.strftime("%A"),
-                booking.date.strftime("%Y %b %d"),
-                booking.time_from.strftime("%H:%M"),
-                booking.time_to.strftime("%H:%M"),
-            ]
+    """Booking history, paginated by (date, id) of the last booking shown.
+
+    The parameter nach=<date>_<id> continues after that booking, so every page
+    is an index range scan, however much history there is.
+    """
+    form = BookingHistoryForm(request.GET or None)
+    bookings = booking_history(form)
+
+    try:
+        nach_date, nach_id = request.GET["nach"].split("_")
+        nach_date, nach_id = date.fromisoformat(nach_date), int(nach_id)
+    except (KeyError, ValueError):
+        nach_date = None
+    if nach_date:
+        bookings = bookings.filter(date__lte=nach_date).filter(
+            Q(date__lt=nach_date) | Q(id__lt=nach_id)
         )
 
+    # One more to find out whether there is a next page
+    page = list(bookings[:BOOKING_HISTORY_PAGE_SIZE + 1])
+    params = request.GET.copy()
+    params.pop("nach", None)
+    next_params = None
+    if len(page) > BOOKING_HISTORY_PAGE_SIZE:
+        page = page[:BOOKING_HISTORY_PAGE_SIZE]
+        next_params = params.copy()
+        next_params["nach"] = f"{page[-1].date.isoformat()}_{page[-1].pk}"
+        next_params = next_params.urlencode()
+
     context = {
-        "bookings": bookings,
+        "bookings": page,
+        "form": form,
+        "filter_params": params.urlencode(),
+        "next_params": next_params,
+        "is_first_page": nach_date is None,
+        "is_vorstand": isVorstand(request.user).exists(),
     }
 
     return render(request, "boote/booking_all.html", context)
 
 
+class EchoBuffer:
+    """File-like object returning what is written, for streaming CSV."""
+
+    def write(self, value):
+        return value
+
+
+@user_passes_test(isVorstand, login_url="/keinVorstand/")
+def booking_all_csv(request):
+    """All bookings matching the filters of booking_all as streamed CSV."""
+    form = BookingHistoryForm(request.GET or None)
+    writer = csv.writer(EchoBuffer(), delimiter=";")
+
+    def rows():
+        yield writer.writerow([
+            "Datum", "Von", "Bis", "Boot", "Bootstyp", "Vorname", "Nachname",
+            "Benutzername", "Typ", "Status", "Erstellt", "Benachrichtigt",
+        ])
+        for b in booking_history(form).iterator(chunk_size=2000):
+            yield writer.writerow([
+                b.date.isoformat(),
+                b.time_from.strftime("%H:%M"),
+                b.time_to.strftime("%H:%M"),
+                b.boat.name,
+                b.boat.type.name,
+                b.user.first_name,
+                b.user.last_name,
+                b.user.username,
+                b.get_type_display(),
+                "Aktiv" if b.status == 1 else "Storniert",
+                b.created_date.isoformat(),
+                "Ja" if b.notified else "Nein",
+            ])
+
+    response = StreamingHttpResponse(rows(), content_type="text/csv; charset=utf-8")
+    response["Content-Disposition"] = 'attachment; filename="reservierungen.csv"'
+    return response
+
+
 def booking_my_bookings(request):
     user = request.user
 
@@ -197,14 +306,6 @@ def booking_boot(request, boot_pk):
     boot = Boat.objects.get(pk=boot_pk)
     user = request.user
 
-    num_days = 14
-    bookings = boot.get_detailed_bookings(num_days)
-    overview = []
-    d = datetime.now()
-    for i in range(0, num_days):
-        overview.append([d.strftime("%A"), d.strftime("%d. %b"), bookings[i]])
-        d = d + timedelta(days=1)
-
     error_list = []
 
     # if this is a POST request we need to process the form data
@@ -221,52 +322,29 @@ def booking_boot(request, boot_pk):
             res_duration = int(res_duration)
 
             start = datetime.strptime(res_date + " " + res_start, "%Y-%m-%d %H:%M")
-            end = start + timedelta(0, 0, 0, 0, res_duration)  # minutes
-            res_end = end
+            end = start + timedelta(minutes=res_duration)
 
-            # check if dates overlapping
-            if Booking.objects.filter(
-                boat=boot,
-                date=res_date,
-                status=1,
-                time_from__lte=res_start,
-                time_to__gt=res_start,
-            ):
-                error_list.append("Dein Termin startet in anderem reservierten Termin.")
-            if Booking.objects.filter(
-                boat=boot,
-                date=res_date,
-                status=1,
-                time_from__lt=res_end,
-                time_to__gt=res_end,
-            ):
-                error_list.append("Dein Termin endet in anderem reservierten Termin.")
-            if Booking.objects.filter(
-                boat=boot,
-                date=res_date,
-                status=1,
-                time_from__gte=res_start,
-                time_to__lte=res_end,
-            ):
-                error_list.append("An deinem Termin besteht schon eine Reservierung.")
-
-            if not error_list:
-                # save new booking
-                b = Booking(
-                    user=user,
-                    boat=boot,
-                    date=res_date,
-                    time_from=res_start,
-                    time_to=res_end,
-                )
-                b.save()
+            # save new booking, unless it overlaps with existing ones
+            booking, overlapping = Booking.objects.reserve(
+                user, boot, start.date(), start.time(), end.time()
+            )
+            if booking:
                 # redirect to a new URL:
                 return HttpResponseRedirect(reverse("booking-my-bookings"))
+            error_list = overlap_errors(overlapping, start.time(), end.time())
 
     # if a GET (or any other method) we'll create a blank form
     else:
         form = NewReservationForm()
 
+    num_days = 14
+    bookings = boot.get_detailed_bookings(num_days)
+    overview = []
+    d = datetime.now()
+    for i in range(0, num_days):
+        overview.append([d.strftime("%A"), d.strftime("%d. %b"), bookings[i]])
+        d = d + timedelta(days=1)
+
     context = {
         "error_list": error_list,
         "form": form,
@@ -278,6 +356,18 @@ def booking_boot(request, boot_pk):
     return render(request, "boote/booking_boot.html", context)
 
 
+def overlap_errors(overlapping, start, end):
+    """Describe how the interval start to end overlaps existing bookings."""
+    error_list = []
+    if any(b.time_from <= start < b.time_to for b in overlapping):
+        error_list.append("Dein Termin startet in anderem reservierten Termin.")
+    if any(b.time_from < end < b.time_to for b in overlapping):
+        error_list.append("Dein Termin endet in anderem reservierten Termin.")
+    if any(start <= b.time_from and b.time_to <= end for b in overlapping):
+        error_list.append("An deinem Termin besteht schon eine Reservierung.")
+    return error_list
+
+
 def booking_priority_boot_list(request):
     return booking_priority_boot(request, False)
 
@@ -288,15 +378,14 @@ def booking_priority_boot_new(request):
 
 def booking_priority_boot(request, new_booking=False):
     user = request.user
-    bookings_reg = Booking.objects.filter(
-        status=1, type="REG", date__gte=datetime.now()
-    ).order_by("date")
-    bookings_aus = Booking.objects.filter(
-        status=1, type="AUS", date__gte=datetime.now()
-    ).order_by("date")
-    bookings_rep = Booking.objects.filter(
-        status=1, type="REP", date__gte=datetime.now()
-    ).order_by("date")
+    upcoming = (
+        Booking.objects.filter(status=1, date__gte=datetime.now())
+        .select_related("boat__type", "user")
+        .order_by("date")
+    )
+    bookings_reg = upcoming.filter(type="REG")
+    bookings_aus = upcoming.filter(type="AUS")
+    bookings_rep = upcoming.filter(type="REP")
 
     error_list = []
 
@@ -308,32 +397,38 @@ def booking_priority_boot(request, new_booking=False):
         # check whether it's valid:
         if form.is_valid():
             # process the data in form.cleaned_data as required
-            res_boat = form.cleaned_data["res_boat"]
-            res_year = datetime.now().year
-            res_month = form.cleaned_data["res_month"]
-            res_day = form.cleaned_data["res_day"]
-            res_start = form.cleaned_data["res_start"]
-            res_end = form.cleaned_data["res_end"]
-            res_type = form.cleaned_data["res_type"]
-
-            # construct the res_date
-            res_date = str(res_year) + "-" + res_month + "-" + res_day
-
-            # no checking for overlapping
-
-            if not error_list:
-                # save new booking
-                for b in res_boat:
-                    boot = Boat.objects.get(pk=b)
-                    b = Booking(
-                        user=user,
-                        type=res_type,
-                        boat=boot,
-                        date=res_date,
-                        time_from=res_start,
-                        time_to=res_end,
+            bookings, overlapping = Booking.objects.reserve_priority(
+                user,
+                [int(b) for b in form.cleaned_data["res_boat"]],
+                form.cleaned_data["dates"],
+                form.cleaned_data["start"],
+                form.cleaned_data["end"],
+                form.cleaned_data["res_type"],
+            )
+            if bookings is None:
+                error_list.append(
+                    "Folgende Termine überschneiden sich, es wurde nichts gespeichert:"
+                )
+                for b in overlapping:
+                    error_list.append(
+                        f"{b.boat.name} am {b.date:%d.%m.%Y} von {b.time_from:%H:%M} "
+                        f"bis {b.time_to:%H:%M} ({b.get_type_display()})"
+                    )
+            else:
+                messages.success(request, f"{len(bookings)} Termine eingetragen.")
+                if overlapping:
+                    notify_displaced(overlapping)
+                    messages.warning(
+                        request,
+                        "Folgende Reservierungen von Mitgliedern wurden storniert, "
+                        "die Mitglieder wurden per E-Mail benachrichtigt: "
+                        + "; ".join(
+                            f"{b.boat.name} am {b.date:%d.%m.%Y} von "
+                            f"{b.time_from:%H:%M} bis {b.time_to:%H:%M} "
+                            f"({b.user.first_name} {b.user.last_name})"
+                            for b in overlapping
+                        ),
                     )
-                    b.save()
 
                 # redirect to a new URL:
                 return HttpResponseRedirect(reverse("priority-booking-boot-list"))
@@ -355,6 +450,22 @@ def booking_priority_boot(request, new_booking=False):
     return render(request, "boote/booking_priority_boot.html", context)
 
 
+def notify_displaced(bookings):
+    """Queue one mail per member booking displaced by a priority booking."""
+    mail.send_many([
+        {
+            "recipients": [b.user.email],
+            "sender": settings.DEFAULT_FROM_EMAIL,
+            "subject": f"[SVPB] Reservierung storniert - {b.boat.name}",
+            "message": render_to_string(
+                "boote/email_displaced.txt", context={"booking": b}
+            ),
+        }
+        for b in bookings
+        if b.user.email
+    ])
+
+
 def booking_remove(request, booking_pk):
     booking = Booking.objects.get(pk=booking_pk, user=request.user)
     booking.status = 0
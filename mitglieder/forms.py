@@ -275,3 +275,22 @@ class SVPBPasswordChangeForm(PasswordChangeForm):
                 style="max-width: 530px;",
             )
         )
+
+
+class LettersBatchForm(forms.Form):
+    """Form to generate password letters for all new members since a date."""
+
+    seit = forms.DateField(
+        label="Angelegt seit",
+        widget=forms.DateInput(attrs={"type": "date"}),
+        help_text="Alle aktiven Mitglieder, die seit diesem Tag angelegt wurden, "
+        "sich noch nie angemeldet und noch kein Anschreiben bekommen haben, "
+        "bekommen ein neues Passwort.",
+    )
+
+    def __init__(self, *args, **kwargs):
+        super(LettersBatchForm, self).__init__(*args, **kwargs)
+        self.helper = FormHelper()
+        self.helper.form_id = self.__class__.__name__
+        self.helper.form_method = "post"
+        self.helper.add_input(Submit("apply", "Anschreiben erzeugen"))
@@ -0,0 +1,33 @@
+"""Background jobs of the mitglieder app, see svpb.jobs."""
+
+import os
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+
+from mitglieder.views import preparePassword
+
+
+def member_excel(job, workdir):
+    """Create and return the Excel file of all members."""
+    path = os.path.join(workdir, settings.FILENAME_MEMBER_EXCEL)
+    out = StringIO()
+    call_command("create_member_excel", output=path, stdout=out)
+    job.message = out.getvalue().strip()
+    return path
+
+
+def letters(job, workdir):
+    """Set new passwords and return the PDF letters for the given users."""
+    users = User.objects.filter(pk__in=job.arguments["users"]).select_related(
+        "mitglied"
+    ).order_by("last_name", "first_name")
+    if not users:
+        job.message = "Keine Mitglieder ausgewählt."
+        return None
+    filename = f"Anschreiben-{job.created:%Y-%m-%d}-{job.pk}.pdf"
+    r = preparePassword(users, workdir, filename)
+    job.message = f"Anschreiben für {len(r)} Mitglieder."
+    return os.path.join(workdir, filename)
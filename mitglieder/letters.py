@@ -0,0 +1,133 @@
+"""PDF letters with the passwords of new members.
+
+The newUserLaTeX template is rendered in chunks of LETTERS_CHUNK_SIZE letters,
+which are compiled by up to LETTERS_WORKERS parallel xelatex processes and then
+merged into one PDF with pdfpages. The preamble is precompiled once into a
+format file (mylatexformat) in LETTERS_CACHE_DIR, named after its hash, so each
+chunk only typesets its letters. If the format cannot be built, the chunks are
+compiled with the full preamble.
+"""
+
+import hashlib
+import logging
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from jinja2 import Template
+
+logger = logging.getLogger(__name__)
+
+BEGIN_DOCUMENT = "\\begin{document}"
+
+MERGE = """\\documentclass{article}
+\\usepackage{pdfpages}
+\\begin{document}
+%s
+\\end{document}
+"""
+
+
+def chunks(items, size):
+    """Split a list into lists of at most size items."""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def environment():
+    """Environment for xelatex: files (e.g. the logo) are found relative to
+    BASE_DIR, formats in LETTERS_CACHE_DIR."""
+    env = dict(os.environ)
+    env["TEXINPUTS"] = f"{settings.BASE_DIR}{os.pathsep}{env.get('TEXINPUTS', '')}"
+    env["TEXFORMATS"] = (
+        f"{settings.LETTERS_CACHE_DIR}{os.pathsep}{env.get('TEXFORMATS', '')}"
+    )
+    return env
+
+
+def xelatex(texfile, workdir, *options):
+    """Compile workdir/texfile and return the path of the PDF.
+
+    Raises:
+        RuntimeError: If no PDF was produced, with the end of the log.
+    """
+    name = os.path.splitext(texfile)[0]
+    subprocess.run(
+        ["xelatex", "-interaction=batchmode", *options, texfile],
+        cwd=workdir, env=environment(), stdout=subprocess.DEVNULL,
+    )
+    pdf = os.path.join(workdir, name + ".pdf")
+    if not os.path.exists(pdf):
+        try:
+            with open(os.path.join(workdir, name + ".log"), errors="replace") as f:
+                log = "".join(f.readlines()[-20:])
+        except OSError:
+            log = ""
+        raise RuntimeError(f"xelatex did not produce {name}.pdf\n{log}")
+    return pdf
+
+
+def preamble_format(preamble):
+    """Name of the cached format with the precompiled preamble.
+
+    Returns None if the format cannot be built.
+    """
+    name = "letters-" + hashlib.sha256(preamble.encode()).hexdigest()[:16]
+    cache = settings.LETTERS_CACHE_DIR
+    if os.path.exists(os.path.join(cache, name + ".fmt")):
+        return name
+    os.makedirs(cache, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=cache) as tmp:
+        with open(os.path.join(tmp, "preamble.tex"), "w", encoding="utf-8") as f:
+            f.write(preamble + BEGIN_DOCUMENT + "\n\\end{document}\n")
+        subprocess.run(
+            ["xelatex", "-ini", "-interaction=batchmode", f"-jobname={name}",
+             "&xelatex", "mylatexformat.ltx", "preamble.tex"],
+            cwd=tmp, env=environment(), stdout=subprocess.DEVNULL,
+        )
+        fmt = os.path.join(tmp, name + ".fmt")
+        if not os.path.exists(fmt):
+            logger.warning("Could not build LaTeX format %s, using full preamble", name)
+            return None
+        # atomic, in case another job builds the same format
+        os.replace(fmt, os.path.join(cache, name + ".fmt"))
+    return name
+
+
+def compile_letters(template, dicts, workdir, filename):
+    """Render template for dicts and compile it into workdir/filename.
+
+    Args:
+        template (str): Jinja template of a LaTeX document, looping over dicts.
+        dicts (list[dict]): One dict per letter.
+        workdir (str): Directory for the LaTeX files and the resulting PDF.
+        filename (str): Name of the resulting PDF.
+
+    Returns:
+        str: Path of the PDF.
+    """
+    template = Template(template)
+    documents = [template.render(dicts=teil)
+                 for teil in chunks(dicts, settings.LETTERS_CHUNK_SIZE)]
+    fmt = preamble_format(documents[0].split(BEGIN_DOCUMENT)[0])
+    options = [f"-fmt={fmt}"] if fmt else []
+
+    def compile_chunk(nummer, document):
+        texfile = f"chunk-{nummer:03d}.tex"
+        with open(os.path.join(workdir, texfile), "w", encoding="utf-8") as f:
+            f.write(document)
+        return xelatex(texfile, workdir, *options)
+
+    with ThreadPoolExecutor(settings.LETTERS_WORKERS) as pool:
+        pdfs = list(pool.map(compile_chunk, range(len(documents)), documents))
+
+    if len(pdfs) > 1:
+        with open(os.path.join(workdir, "merge.tex"), "w", encoding="utf-8") as f:
+            f.write(MERGE % "\n".join(
+                f"\\includepdf[pages=-]{{{os.path.basename(pdf)}}}" for pdf in pdfs
+            ))
+        pdfs = [xelatex("merge.tex", workdir)]
+    target = os.path.join(workdir, filename)
+    os.replace(pdfs[0], target)
+    return target
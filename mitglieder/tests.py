@@ -1,8 +1,25 @@
 """Tests of mitglieder administration"""
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from datetime import date, timedelta
+from io import StringIO
+from unittest import skipUnless
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import models
+from django.utils import timezone
 from django.test import Client, TestCase, override_settings
 
-from mitglieder import views
+from arbeitsplan.models import Mitglied
+from svpb import synthetic
+from svpb.models import Job
+
+from mitglieder import jobs, letters, views
 
 
 class MitgliederTest(TestCase):
@@ -193,3 +210,179 @@ class MitgliederTest(TestCase):
             self.superuser, self.strongpassword
         )
         self.assertNotIn("login", response.request["PATH_INFO"])
+
+
+class MitgliederExcelTest(TestCase):
+    fixtures = [
+        "mitglieder/fixtures/groups.json",
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vorstand = synthetic.generate_arbeitsplan(mitglieder=60, aufgaben=10)[
+            "vorstand"][0]
+        User.objects.filter(pk__in=User.objects.order_by("-pk")[:5]).update(
+            is_active=False)
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(SENDFILE_ROOT=self.tmpdir.name)
+        self.settings.enable()
+        self.path = os.path.join(self.tmpdir.name, settings.FILENAME_MEMBER_EXCEL)
+
+    def tearDown(self):
+        self.settings.disable()
+        self.tmpdir.cleanup()
+
+    def create_excel(self):
+        out = StringIO()
+        call_command("create_member_excel", stdout=out)
+        return out.getvalue()
+
+    def sheet_rows(self, sheet):
+        """Number of rows of sheet (counting from 1) including the header."""
+        with zipfile.ZipFile(self.path) as f:
+            xml = f.read(f"xl/worksheets/sheet{sheet}.xml").decode()
+        return len(re.findall("<row ", xml))
+
+    def test_sheets(self):
+        """Test that all sheets are filled from one query."""
+        with self.assertNumQueries(1):
+            self.assertIn("written", self.create_excel())
+
+        mitglieder = Mitglied.objects.with_balances()
+        self.assertEqual(self.sheet_rows(2),
+                         mitglieder.filter(user__is_active=True).count() + 1)
+        self.assertEqual(self.sheet_rows(3), 6)
+        self.assertEqual(
+            self.sheet_rows(6),
+            mitglieder.filter(
+                user__is_active=True,
+                arbeitslast__lt=settings.BEGIN_CODED_HOURS_PER_YEAR,
+                akzeptierte_stunden__lt=models.F("arbeitslast"),
+            ).count() + 1,
+        )
+
+    def test_cache(self):
+        """Test that the file is only written again if the data changed."""
+        self.create_excel()
+        mtime = os.stat(self.path).st_mtime_ns
+
+        self.assertIn("up to date", self.create_excel())
+        self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+
+        Mitglied.objects.filter(pk=self.vorstand.mitglied.pk).update(arbeitslast=3)
+        self.assertIn("written", self.create_excel())
+
+    def test_download(self):
+        """Test the download for the Vorstand."""
+        client = Client()
+        client.force_login(self.vorstand)
+        response = client.get("/accounts/mitgliederexcel.xlsx")
+        self.assertRedirects(response, "/jobs/")
+        self.assertFalse(os.path.exists(self.path))
+
+        call_command("run_jobs", once=True, stdout=StringIO())
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.Status.DONE)
+        self.assertEqual(job.result, os.path.join(
+            "jobs", str(job.pk), settings.FILENAME_MEMBER_EXCEL))
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir.name, job.result)))
+        # the job works in its own directory only
+        self.assertEqual(sorted(os.listdir(self.tmpdir.name)), ["jobs"])
+        response = client.get(f"/jobs/{job.pk}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir.name, job.result)))
+
+
+class LettersTest(TestCase):
+    fixtures = [
+        "arbeitsplan/fixtures/members.json",
+        "mitglieder/fixtures/groups.json",
+        "mitglieder/fixtures/po.json",
+        "mitglieder/fixtures/user.json",
+    ]
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(User.objects.get(username="Vorstand"))
+
+    def test_chunks(self):
+        self.assertEqual(letters.chunks(list(range(5)), 2), [[0, 1], [2, 3], [4]])
+        self.assertEqual(letters.chunks([], 2), [])
+
+    def test_batch(self):
+        """Test that a batch contains the new members who never logged in."""
+        response = self.client.post("/accounts/letters/", {"seit": "2020-01-01"})
+        self.assertRedirects(response, "/jobs/")
+        job = Job.objects.get()
+        self.assertEqual(job.function, "mitglieder.jobs.letters")
+        # Vorstand has logged in by now (force_login)
+        self.assertEqual(job.arguments["users"], [2])
+
+        response = self.client.post("/accounts/letters/", {"seit": "2030-01-01"})
+        self.assertRedirects(response, "/accounts/letters/")
+        self.assertEqual(Job.objects.count(), 1)
+
+        # members who already got a letter are skipped
+        Mitglied.objects.filter(user=2).update(anschreibenErstellt=timezone.now())
+        response = self.client.post("/accounts/letters/", {"seit": "2020-01-01"})
+        self.assertRedirects(response, "/accounts/letters/")
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_batch_initial(self):
+        """Test that the next batch starts at the day of the last one."""
+        response = self.client.get("/accounts/letters/")
+        self.assertEqual(
+            response.context["form"].initial["seit"],
+            date.today().replace(month=1, day=1),
+        )
+        job = Job.objects.create(
+            title="Anschreiben", function="mitglieder.jobs.letters",
+            status=Job.Status.DONE,
+        )
+        Job.objects.filter(pk=job.pk).update(
+            created=timezone.now() - timedelta(days=3))
+        response = self.client.get("/accounts/letters/")
+        self.assertEqual(
+            response.context["form"].initial["seit"],
+            timezone.localdate() - timedelta(days=3),
+        )
+
+    @skipUnless(shutil.which("xelatex"), "xelatex is not installed")
+    def test_compile(self):
+        """Test the letters job end to end: chunks, format, merge."""
+        users = list(User.objects.order_by("pk").values_list("pk", flat=True))
+        job = Job.objects.create(
+            title="Anschreiben", function="mitglieder.jobs.letters",
+            arguments={"users": users},
+        )
+        with tempfile.TemporaryDirectory() as cache, \
+                tempfile.TemporaryDirectory() as workdir, \
+                override_settings(LETTERS_CHUNK_SIZE=2, LETTERS_CACHE_DIR=cache):
+            pdf = jobs.letters(job, workdir)
+            self.assertTrue(os.path.exists(pdf))
+            # the format with the preamble was built and used
+            self.assertTrue(any(f.endswith(".fmt") for f in os.listdir(cache)))
+            with open(os.path.join(workdir, "merge.log"), errors="replace") as f:
+                log = f.read()
+        self.assertRegex(log, rf"Output written on merge\.pdf \({len(users)} pages")
+        self.assertEqual(job.message, f"Anschreiben für {len(users)} Mitglieder.")
+        self.assertFalse(
+            Mitglied.objects.filter(anschreibenErstellt__isnull=True).exists()
+        )
+
+    def test_list(self):
+        """Test that earlier batches are listed for download."""
+        job = Job.objects.create(
+            title="Anschreiben für 3 Mitglieder",
+            function="mitglieder.jobs.letters",
+            status=Job.Status.DONE,
+            result="jobs/1/Anschreiben-2026-03-01-1.pdf",
+        )
+        Job.objects.create(title="Fehlgeschlagen", function="mitglieder.jobs.letters",
+                           status=Job.Status.FAILED)
+        response = self.client.get("/accounts/letters/")
+        self.assertContains(response, f'href="/jobs/{job.pk}/"')
+        self.assertContains(response, "Anschreiben-2026-03-01-1.pdf")
+        self.assertNotContains(response, "Fehlgeschlagen")
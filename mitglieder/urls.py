@@ -45,6 +45,11 @@ urlpatterns = [
         name="accountFilteredList"
         ),
 
+    re_path(r'^letters/$',
+        active_and_login_required(mitglieder.views.AccountLettersList.as_view()),
+        name="accountLettersList"
+        ),
+
     re_path(r'^letters.pdf',
         active_and_login_required(mitglieder.views.AccountLetters.as_view()),
         name="accountLetters"
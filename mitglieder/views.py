@@ -2,29 +2,28 @@
 Login and logout stays in SVPB
 """
 
-import codecs
 import os
 import secrets
-import shutil
 import string
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import user_passes_test
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import Group, User
 from django.contrib.messages.views import SuccessMessageMixin
-from django.core.management import call_command
 from django.db.models import F
+from django.http import Http404
 from django.shortcuts import get_object_or_404, redirect
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
+from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from django.views.generic import CreateView, DeleteView, FormView, View
 from django_sendfile import sendfile
-from jinja2 import Template
 from post_office import mail
 from post_office.models import EmailTemplate
 
@@ -32,44 +31,63 @@ from arbeitsplan import forms
 from arbeitsplan.models import Mitglied
 from arbeitsplan.tables import ImpersonateTable
 from arbeitsplan.views import FilteredListView
+from mitglieder import letters
 from mitglieder.forms import (
     AccountEdit,
     AccountOtherEdit,
+    LettersBatchForm,
     MemberFilterForm,
     MitgliederAddForm,
     PersonMitgliedsnummer,
 )
 from mitglieder.tables import FilteredMemberTable, MitgliederTable
+from svpb import jobs
+from svpb.models import Job
 from svpb.views import isVorstand, isVorstandMixin
 
 
-def preparePassword(accountList=None):
+def preparePassword(accountList, workdir, filename="letters.pdf"):
     """Generate a random password and create a PDF letter for given user accounts.
 
     For each user in the account list, this function:
     - Generates a random 10-character password.
     - Sets and saves the password to the user.
     - Prepares data for rendering a LaTeX template.
-    - Compiles the LaTeX file into a PDF using `xelatex`.
-    - Moves the resulting PDF to a protected directory for Vorstand access.
+    - Compiles the LaTeX file into workdir/filename using `xelatex`.
+    - Records the time of the letter in Mitglied.anschreibenErstellt, so later
+      batches (AccountLettersList) skip the user.
+
+    Password hashing and LaTeX compilation are spread over LETTERS_WORKERS
+    threads, see mitglieder.letters. It runs in a background job (see
+    mitglieder.jobs.letters), which passes its own temporary directory as
+    workdir and moves the PDF to a protected directory for Vorstand access.
 
     Args:
         accountList (list[User]): A list of Django User objects to process.
+        workdir (str): Directory for the LaTeX files and the resulting PDF.
+        filename (str): Name of the resulting PDF.
 
     Returns:
         list[dict]: List of dictionaries with user and password data used for rendering.
 
     Raises:
         EmailTemplate.DoesNotExist: If the "newUserLaTeX" template is not found.
-        subprocess.CalledProcessError: If LaTeX compilation fails.
+        RuntimeError: If LaTeX compilation fails.
     """
+    accountList = list(accountList)
+    passwords = [
+        "".join(secrets.choice(string.ascii_letters + string.digits) for i in range(10))
+        for user in accountList
+    ]
+    # hashing takes a noticeable fraction of a second per password
+    with ThreadPoolExecutor(settings.LETTERS_WORKERS) as pool:
+        hashes = list(pool.map(make_password, passwords))
+    for user, hashed in zip(accountList, hashes):
+        user.password = hashed
+    User.objects.bulk_update(accountList, ["password"])
+
     r = []
-    for user in accountList:
-        pw = "".join(
-            secrets.choice(string.ascii_letters + string.digits) for i in range(10)
-        )
-        user.set_password(pw)
-        user.save()
+    for user, pw in zip(accountList, passwords):
         r.append(
             {
                 "user": user,
@@ -82,19 +100,10 @@ def preparePassword(accountList=None):
 
     # Generate the PDF. Assume the template is in templates and process this via latex.
     templateText = EmailTemplate.objects.get(name="newUserLaTeX")
-    rendered = Template(templateText.content).render(dicts=r)
-    f = codecs.open("letters.tex", "w", "utf-8")
-    f.write(rendered)
-    f.close()
-    # TODO: use better file names, protect against race conditions
-    subprocess.call(["xelatex", "-interaction=batchmode", "letters.tex"])
-    # Move this file into a directory where only Vorstand has access!
-    # remove an older letter first; ignore errors here
-    try:
-        os.remove(os.path.join(settings.SENDFILE_ROOT, "letters.pdf"))
-    except:
-        pass
-    shutil.move("letters.pdf", settings.SENDFILE_ROOT)
+    letters.compile_letters(templateText.content, r, workdir, filename)
+    Mitglied.objects.filter(user__in=accountList).update(
+        anschreibenErstellt=timezone.now()
+    )
     return r
 
 
@@ -171,26 +180,22 @@ class AccountAdd(SuccessMessageMixin, isVorstandMixin, CreateView):
                     Account: {user.username}) wurde erfolgreich angelegt",
             ),
         )
-        try:
-            preparePassword([user])
-            # copy the produced PDF to the SENDFILE_ROOT directory
-            messages.success(
-                self.request,
-                format_html(
-                    "Das Anschreiben mit dem Passwort kann "
-                    '<a href="{}">hier</a>'
-                    " heruntergeladen werden.",
-                    "letters.pdf",
-                ),
-            )
-        except Exception as e:
-            print("Fehler beim Passwort: ", e) #TODO: Log exception
-            messages.error(
-                self.request,
-                "Das Passwort für den Nutzer konnte nicht gesetzt werden "
-                "oder das Anschreiben nicht erzeugt werden. Bitte das neue Mitglied, "
-                "sich über die Webseite selbst ein Passwort zu generieren.",
-            )
+        # Password and letter are generated in the background, see mitglieder.jobs
+        jobs.enqueue(
+            "mitglieder.jobs.letters",
+            f"Anschreiben {user.first_name} {user.last_name}",
+            user=self.request.user,
+            users=[user.pk],
+        )
+        messages.success(
+            self.request,
+            format_html(
+                "Das Anschreiben mit dem Passwort wird erzeugt und kann unter "
+                '<a href="{}">Aufträge</a>'
+                " heruntergeladen werden.",
+                reverse("jobs"),
+            ),
+        )
         return redirect(self.success_url)
 
 
@@ -406,18 +411,85 @@ class AccountOtherEdit(isVorstandMixin, AccountEdit):
 
 
 class AccountLetters(isVorstandMixin, View):
-    """View that allows board members (Vorstand) to download the letters.pdf file."""
+    """View that allows board members (Vorstand) to download the latest letters.pdf file."""
 
     def get(self, request):
-        """Serve the letters.pdf file to the authorized user.
+        """Serve the letters.pdf file of the latest finished letters job.
 
         Args:
             request (HttpRequest): The HTTP GET request.
 
         Returns:
             HttpResponse: The file response for letters.pdf.
+
+        Raises:
+            Http404: If no letters have been generated yet.
         """
-        return sendfile(request, os.path.join(settings.SENDFILE_ROOT, "letters.pdf"))
+        job = (
+            Job.objects.filter(function="mitglieder.jobs.letters", status=Job.Status.DONE)
+            .exclude(result="")
+            .first()
+        )
+        if job is None:
+            raise Http404("Noch keine Anschreiben erzeugt.")
+        return sendfile(request, os.path.join(settings.SENDFILE_ROOT, job.result))
+
+
+class AccountLettersList(isVorstandMixin, FormView):
+    """View for board members to generate password letters for a batch of new
+    members and to download the letters of earlier batches."""
+
+    template_name = "letters.html"
+    form_class = LettersBatchForm
+
+    def get_initial(self):
+        """Default to the day of the last batch, or to January 1st."""
+        job = Job.objects.filter(
+            function="mitglieder.jobs.letters", status=Job.Status.DONE
+        ).first()
+        if job is not None:
+            return {"seit": timezone.localdate(job.created)}
+        return {"seit": date.today().replace(month=1, day=1)}
+
+    def get_context_data(self, **kwargs):
+        """Add the finished letter jobs to the template context.
+
+        Returns:
+            dict: Context data including the earlier batches.
+        """
+        context = super(AccountLettersList, self).get_context_data(**kwargs)
+        context["batches"] = (
+            Job.objects.filter(function="mitglieder.jobs.letters", status=Job.Status.DONE)
+            .exclude(result="")
+            .select_related("created_by")
+        )
+        return context
+
+    def form_valid(self, form):
+        """Enqueue the letters for all new members who never logged in and
+        did not get a letter yet.
+
+        Returns:
+            HttpResponseRedirect: Redirect to the job list.
+        """
+        users = list(
+            User.objects.filter(
+                is_active=True,
+                last_login__isnull=True,
+                date_joined__date__gte=form.cleaned_data["seit"],
+                mitglied__anschreibenErstellt__isnull=True,
+            ).values_list("pk", flat=True)
+        )
+        if not users:
+            messages.error(self.request, "Keine passenden Mitglieder gefunden.")
+            return redirect("accountLettersList")
+        jobs.enqueue(
+            "mitglieder.jobs.letters",
+            f"Anschreiben für {len(users)} Mitglieder",
+            user=self.request.user,
+            users=users,
+        )
+        return redirect("jobs")
 
 
 class AccountList(SuccessMessageMixin, isVorstandMixin, FilteredListView):
@@ -458,23 +530,22 @@ class AccountDelete(SuccessMessageMixin, isVorstandMixin, DeleteView):
 
 
 class MitgliederExcel(View):
-    """View to generate and return an Excel file listing all members."""
+    """View to request an Excel file listing all members."""
 
     @method_decorator(user_passes_test(isVorstand, login_url="/keinVorstand/"))
     def get(self, request):
-        """Handle GET request to generate and return the Excel file.
+        """Handle GET request to generate the Excel file in the background.
 
         Returns:
-            HttpResponse: Excel file download if authorized.
-            HttpResponseRedirect: Redirects to 'keinVorstand' if unauthorized.
+            HttpResponseRedirect: Redirects to the job list, where the file can be
+                downloaded when ready, or to 'keinVorstand' if unauthorized.
         """
         if isVorstand(request.user):
-            # Generate the Excel file using a management command.
-            call_command("create_member_excel")
-
-            filename = settings.FILENAME_MEMBER_EXCEL
-            basepath = settings.SENDFILE_ROOT
-            return sendfile(request, os.path.join(basepath, filename))
+            # Generate the Excel file using a management command in a background job.
+            jobs.enqueue(
+                "mitglieder.jobs.member_excel", "Mitgliederliste (Excel)", user=request.user
+            )
+            return redirect("jobs")
         else:
             return redirect("keinVorstand")
 
@@ -22,6 +22,16 @@ JAHRESENDE = False
 
 FILENAME_MEMBER_EXCEL = "mitglieder.xlsx"
 
+# Password letters for new members (mitglieder/letters.py)
+LETTERS_WORKERS = 4  # Parallel xelatex runs and password hashes
+LETTERS_CHUNK_SIZE = 10  # Letters per xelatex run
+
+# Background jobs (svpb/jobs.py)
+JOB_TIMEOUT = 2 * 60 * 60  # Seconds after which a running job counts as aborted
+JOB_RESULT_DAYS = 30  # Days to keep result files
+# Shorter retention for result files with passwords
+JOB_RESULT_DAYS_BY_FUNCTION = {"mitglieder.jobs.letters": 7}
+
 INSTALLED_APPS = [
     'django.contrib.admin',
     'django.contrib.auth',
@@ -62,6 +72,8 @@ AUTHENTICATION_BACKENDS = [
 ]
 
 MIDDLEWARE = [
+    # Only active if PROFILING_ENABLED is set, see below
+    'svpb.profiling.ProfilingMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -147,7 +159,10 @@ LOGGING = {
             'level': 'ERROR',
             'filters': ['require_debug_false'],
             'class': 'django.utils.log.AdminEmailHandler'
-        }
+        },
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
     },
     'loggers': {
         'django.request': {
@@ -155,9 +170,21 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        # Slow requests as JSON, one per line
+        'svpb.profiling': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     }
 }
 
+# Per-request profiling (svpb/profiling.py), shown at /profiling/
+PROFILING_ENABLED = False
+PROFILING_SLOW_REQUEST = 1.0  # Seconds, slower requests are logged
+PROFILING_WINDOW = 500  # Samples kept per view for percentiles
+PROFILING_FLUSH_EVERY = 20  # Requests buffered before samples are stored
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.2/topics/i18n/
 TIME_ZONE = 'Europe/Berlin'
@@ -189,6 +216,21 @@ STATIC_ROOT = BASE_DIR / 'www' / 'static'
 # Example: "/var/www/example.com/media/"
 MEDIA_ROOT = BASE_DIR / 'www' / 'media'
 SENDFILE_ROOT = BASE_DIR / 'www' / 'sendfile'
+# Precompiled LaTeX preambles of the password letters
+LETTERS_CACHE_DIR = BASE_DIR / 'www' / 'latexcache'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Booking display and club boats (boote.models.display_stamp and
+    # club_boat_choices), shared by all server processes, so that a change in
+    # one process invalidates it in all of them
+    'boote': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'www' / 'cache' / 'boote',
+    },
+}
 
 # Additional locations of static files
 STATICFILES_DIRS = [
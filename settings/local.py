@@ -45,6 +45,12 @@ EMAIL_NOTIFICATION_BOARD = ['vorstand@example.com', ]
 # See https://docs.djangoproject.com/en/4.2/ref/settings/#std-setting-ADMINS
 ADMINS = [("Admin", "admin@example.com")]
 
+# Single process, no need to share the booking display cache
+CACHES['boote'] = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'boote',
+}
+
 # XSendfile interface
 # Development backend should never be used in production!
 SENDFILE_BACKEND = 'django_sendfile.backends.development'
@@ -0,0 +1,126 @@
+"""Background jobs for heavy Vorstand actions.
+
+Views enqueue a Job instead of doing the work inside the request; the run_jobs
+management command picks up waiting jobs and runs them one after another. A
+job function is referenced by its dotted path and called as
+
+    function(job, workdir)
+
+where workdir is an empty temporary directory, removed after the job. It may
+set job.message and returns the path of a result file in workdir, or None.
+Result files are moved to SENDFILE_ROOT/jobs/<id>/ and served by JobResult
+via sendfile. They are deleted after JOB_RESULT_DAYS days, or earlier for the
+functions in JOB_RESULT_DAYS_BY_FUNCTION (password letters), see
+cleanup_results. Jobs still running after JOB_TIMEOUT seconds, e.g. because
+the worker was killed, are marked as failed by recover_stale.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from svpb.models import Job
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(function, title, user=None, **arguments):
+    """Create a waiting Job calling function (a dotted path) with arguments.
+
+    arguments must be JSON serializable; the function reads them from
+    job.arguments.
+    """
+    import_string(function)  # fail early on typos
+    return Job.objects.create(
+        function=function, title=title, created_by=user, arguments=arguments
+    )
+
+
+def claim(job):
+    """Mark a waiting job as running; False if another worker was faster."""
+    started = timezone.now()
+    claimed = Job.objects.filter(pk=job.pk, status=Job.Status.WAITING).update(
+        status=Job.Status.RUNNING, started=started
+    )
+    job.status, job.started = Job.Status.RUNNING, started
+    return bool(claimed)
+
+
+def run(job):
+    """Run a claimed job in its own temporary directory and store the outcome."""
+    try:
+        with tempfile.TemporaryDirectory(prefix=f"svpb-job-{job.pk}-") as workdir:
+            result = import_string(job.function)(job, workdir)
+            if result:
+                target = os.path.join(settings.SENDFILE_ROOT, "jobs", str(job.pk))
+                os.makedirs(target, exist_ok=True)
+                shutil.move(result, target)
+                job.result = os.path.join("jobs", str(job.pk), os.path.basename(result))
+        job.status = Job.Status.DONE
+    except Exception as e:
+        # the traceback goes to the log only, the message is shown on /jobs/
+        logger.exception("Job %s (%s) failed", job.pk, job.function)
+        job.status = Job.Status.FAILED
+        job.message = f"{type(e).__name__}: {e}"
+    job.finished = timezone.now()
+    job.save(update_fields=["status", "message", "result", "finished"])
+    return job
+
+
+def run_waiting():
+    """Run all waiting jobs, oldest first. Returns the jobs run."""
+    done = []
+    for job in Job.objects.filter(status=Job.Status.WAITING).order_by("created", "id"):
+        if claim(job):
+            done.append(run(job))
+    return done
+
+
+def recover_stale():
+    """Mark running jobs started more than JOB_TIMEOUT seconds ago as failed.
+
+    Such jobs were interrupted (worker killed, server restarted) and would
+    otherwise stay running forever. They are not restarted, as the interrupted
+    run may already have had side effects, like setting new passwords.
+    Returns the number of jobs marked.
+    """
+    now = timezone.now()
+    return Job.objects.filter(
+        status=Job.Status.RUNNING,
+        started__lt=now - timedelta(seconds=settings.JOB_TIMEOUT),
+    ).update(
+        status=Job.Status.FAILED,
+        finished=now,
+        message="Abgebrochen: der Auftrag lief länger als "
+        f"{settings.JOB_TIMEOUT // 60} Minuten.",
+    )
+
+
+def cleanup_results():
+    """Delete result files older than their retention time. Returns the jobs."""
+    now = timezone.now()
+    kuerzeste = min(
+        [settings.JOB_RESULT_DAYS, *settings.JOB_RESULT_DAYS_BY_FUNCTION.values()]
+    )
+    jobs = []
+    for job in Job.objects.exclude(result="").filter(
+        finished__lt=now - timedelta(days=kuerzeste)
+    ):
+        days = settings.JOB_RESULT_DAYS_BY_FUNCTION.get(
+            job.function, settings.JOB_RESULT_DAYS
+        )
+        if job.finished < now - timedelta(days=days):
+            shutil.rmtree(
+                os.path.join(settings.SENDFILE_ROOT, "jobs", str(job.pk)),
+                ignore_errors=True,
+            )
+            job.result = ""
+            job.save(update_fields=["result"])
+            jobs.append(job)
+    return jobs
@@ -0,0 +1,71 @@
+"""Fill the database with a synthetic season for benchmarks and load tests."""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from svpb import synthetic
+
+
+class Command(BaseCommand):
+    """Create Mitglieder, Aufgaben, Meldungen, Zuteilungen, Leistungen and boats.
+
+    All objects are created with bulk_create, so even a season with 10000
+    Mitglieder builds in seconds. The same --seed always yields the same data
+    (relative to the current date), so benchmark runs are reproducible. All
+    generated users have the password given by --passwort.
+    """
+
+    help = "Fill the database with a synthetic season for benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mitglieder", type=int, default=1000,
+                            help="Number of Users with Mitglied (default: 1000)")
+        parser.add_argument("--aufgaben", type=int, default=150,
+                            help="Number of Aufgaben (default: 150)")
+        parser.add_argument("--boote", type=int, default=10,
+                            help="Number of Boats (default: 10)")
+        parser.add_argument("--tage", type=int, default=120,
+                            help="Number of days with Bookings, two thirds of "
+                            "them in the past (default: 120)")
+        parser.add_argument("--jahr", type=int,
+                            help="Year of the season (default: current year)")
+        parser.add_argument("--seed", type=int, default=0,
+                            help="Seed of the random number generator (default: 0)")
+        parser.add_argument("--passwort", default="Test",
+                            help="Password of all generated users (default: Test)")
+        parser.add_argument("--force", action="store_true",
+                            help="Also run if DEBUG is off")
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options["force"]:
+            raise CommandError(
+                "DEBUG is off, this might be a production database. "
+                "Use --force to generate data anyway."
+            )
+        if min(options["mitglieder"], options["aufgaben"], options["tage"]) < 1:
+            raise CommandError("At least one Mitglied, Aufgabe and day required.")
+
+        start = time.perf_counter()
+        with transaction.atomic():
+            result = synthetic.generate_season(
+                mitglieder=options["mitglieder"],
+                aufgaben=options["aufgaben"],
+                boote=options["boote"],
+                tage=options["tage"],
+                jahr=options["jahr"],
+                seed=options["seed"],
+                passwort=options["passwort"],
+            )
+        dauer = time.perf_counter() - start
+
+        for model, anzahl in result.items():
+            if model not in ("users", "vorstand"):
+                self.stdout.write(f"{model:<20} {anzahl:>8}")
+        self.stdout.write(
+            "Vorstand: " + ", ".join(u.username for u in result["vorstand"][:5])
+            + (" ..." if len(result["vorstand"]) > 5 else "")
+        )
+        self.stdout.write(self.style.SUCCESS(f"Season generated in {dauer:.1f} s"))
@@ -0,0 +1,32 @@
+"""Print per-view percentiles recorded by the profiling middleware."""
+
+from django.core.management.base import BaseCommand
+
+from svpb import profiling
+from svpb.models import RequestSample
+
+
+class Command(BaseCommand):
+    """Print the statistics of svpb.profiling, slowest views first.
+
+    Samples still buffered in the web server processes (fewer than
+    PROFILING_FLUSH_EVERY per process) are not included.
+    """
+
+    help = "Print per-view percentiles recorded by the profiling middleware"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--view", action="append",
+                            help="Only show this view (may be repeated)")
+        parser.add_argument("--reset", action="store_true",
+                            help="Delete all samples after printing")
+
+    def handle(self, *args, **options):
+        stats = profiling.statistics()
+        if options["view"]:
+            stats = [s for s in stats if s["view"] in options["view"]]
+        self.stdout.write(profiling.format_table(stats))
+
+        if options["reset"]:
+            anzahl, _ = RequestSample.objects.all().delete()
+            self.stdout.write(f"Deleted {anzahl} samples.")
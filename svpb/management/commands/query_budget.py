@@ -0,0 +1,79 @@
+"""Print query counts and wall time of all table pages against their budgets."""
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+
+from svpb import querybudget, synthetic
+
+
+class Command(BaseCommand):
+    """Render every FilteredListView page and compare with the query budgets.
+
+    By default, the pages are measured against the data in the database, so a
+    copy of the production database can be profiled locally. With --generate,
+    synthetic data is added first (inside a transaction that is rolled back at
+    the end); without further options, this is the data the budgets in
+    svpb/query_budgets.json were established with.
+    """
+
+    help = "Print query counts and wall time of all table pages against their budgets"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            help="Username of the Vorstand member to render the pages as "
+            "(default: first member of group Vorstand)",
+        )
+        parser.add_argument(
+            "--generate",
+            action="store_true",
+            help="Add synthetic data before measuring, rolled back afterwards",
+        )
+        parser.add_argument("--mitglieder", type=int, help="Mitglieder to generate")
+        parser.add_argument("--aufgaben", type=int, help="Aufgaben to generate")
+        parser.add_argument("--seed", type=int, help="Seed for generated data")
+        parser.add_argument(
+            "--page",
+            action="append",
+            help="Only measure the page with this key (may be repeated)",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options["generate"]:
+                data = querybudget.load_budgets()["data"]
+                for key in ("mitglieder", "aufgaben", "seed"):
+                    if options[key] is not None:
+                        data[key] = options[key]
+                self.stdout.write(f"Generating synthetic data: {data}")
+                user = synthetic.generate_arbeitsplan(**data)["vorstand"][0]
+            else:
+                user = self.get_user(options["user"])
+
+            pages = querybudget.PAGES
+            if options["page"]:
+                pages = [p for p in pages if p.key in options["page"]]
+
+            # the test client always uses the host name testserver
+            with override_settings(ALLOWED_HOSTS=["testserver"]):
+                results = querybudget.measure(user, pages)
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(querybudget.format_table(results))
+        ueber = [r.key for r in results if r.budget is not None and r.queries > r.budget]
+        if ueber:
+            self.stdout.write(
+                self.style.WARNING(f"Over budget: {', '.join(ueber)}")
+            )
+
+    def get_user(self, username):
+        users = User.objects.filter(is_active=True, groups__name="Vorstand")
+        if username:
+            users = users.filter(username=username)
+        user = users.order_by("id").first()
+        if user is None:
+            raise CommandError("No active Vorstand member found.")
+        return user
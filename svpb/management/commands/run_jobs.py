@@ -0,0 +1,43 @@
+"""Run background jobs enqueued by Vorstand actions."""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from svpb import jobs
+
+
+class Command(BaseCommand):
+    """Worker for the job queue in svpb.jobs.
+
+    Without --once, the worker polls for waiting jobs until it is stopped, so
+    it should run as a service next to the web server. With --once, all
+    waiting jobs are run and the command exits, e.g. when run from cron.
+
+    Before each poll, stale running jobs are marked as failed and expired
+    result files are deleted, see svpb.jobs.
+    """
+
+    help = "Run background jobs enqueued by Vorstand actions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true",
+                            help="Run the waiting jobs, then exit")
+        parser.add_argument("--sleep", type=float, default=2,
+                            help="Seconds between polls (default: 2)")
+
+    def handle(self, *args, **options):
+        while True:
+            abgebrochen = jobs.recover_stale()
+            if abgebrochen:
+                self.stdout.write(f"{abgebrochen} stale jobs marked as failed")
+            for job in jobs.cleanup_results():
+                self.stdout.write(f"Job {job.pk} {job.title}: result file deleted")
+            for job in jobs.run_waiting():
+                self.stdout.write(
+                    f"Job {job.pk} {job.title}: {job.get_status_display()} "
+                    f"in {job.dauer:.1f} s"
+                )
+            if options["once"]:
+                return
+            time.sleep(options["sleep"])
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.14 on 2026-10-18 15:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestSample',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('view', models.CharField(db_index=True, max_length=200)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('status', models.IntegerField()),
+                ('seconds', models.FloatField(help_text='Total time of the request')),
+                ('queries', models.IntegerField()),
+                ('db_seconds', models.FloatField(help_text='Time spent in SQL queries')),
+                ('duplicates', models.IntegerField(help_text='Number of queries repeating an earlier SQL statement')),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.14 on 2026-10-18 15:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('svpb', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=200)),
+                ('function', models.CharField(max_length=200)),
+                ('arguments', models.JSONField(blank=True, default=dict)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('WA', 'Wartet'), ('LA', 'Läuft'), ('OK', 'Fertig'), ('FE', 'Fehlgeschlagen')], db_index=True, default='WA', max_length=2)),
+                ('message', models.TextField(blank=True)),
+                ('result', models.CharField(blank=True, help_text='Result file, relative to SENDFILE_ROOT', max_length=255)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created', '-id'],
+            },
+        ),
+    ]
@@ -0,0 +1,72 @@
+import os
+
+from django.contrib.auth.models import User
+from django.db import models
+
+
+class RequestSample(models.Model):
+    """Timing of one request, recorded by svpb.profiling.ProfilingMiddleware.
+
+    Only the most recent PROFILING_WINDOW samples per view are kept.
+    """
+
+    view = models.CharField(max_length=200, db_index=True)
+    timestamp = models.DateTimeField(auto_now_add=True)
+    status = models.IntegerField()
+    seconds = models.FloatField(help_text="Total time of the request")
+    queries = models.IntegerField()
+    db_seconds = models.FloatField(help_text="Time spent in SQL queries")
+    duplicates = models.IntegerField(
+        help_text="Number of queries repeating an earlier SQL statement"
+    )
+
+    def __str__(self):
+        return f"{self.view} ({self.timestamp}): {self.seconds:.3f} s"
+
+
+class Job(models.Model):
+    """A heavy Vorstand action, run in the background by svpb.jobs.
+
+    function is the dotted path of a function taking the job and a temporary
+    working directory, see svpb.jobs.run.
+    """
+
+    class Status(models.TextChoices):
+        WAITING = "WA", "Wartet"
+        RUNNING = "LA", "Läuft"
+        DONE = "OK", "Fertig"
+        FAILED = "FE", "Fehlgeschlagen"
+
+    title = models.CharField(max_length=200)
+    function = models.CharField(max_length=200)
+    arguments = models.JSONField(default=dict, blank=True)
+    created_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True
+    )
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(
+        max_length=2, choices=Status.choices, default=Status.WAITING, db_index=True
+    )
+    message = models.TextField(blank=True)
+    result = models.CharField(
+        max_length=255, blank=True, help_text="Result file, relative to SENDFILE_ROOT"
+    )
+
+    class Meta:
+        ordering = ["-created", "-id"]
+
+    def __str__(self):
+        return f"{self.title} ({self.get_status_display()})"
+
+    @property
+    def result_name(self):
+        return os.path.basename(self.result)
+
+    @property
+    def dauer(self):
+        """Run time in seconds, None unless finished."""
+        if self.started and self.finished:
+            return (self.finished - self.started).total_seconds()
+        return None
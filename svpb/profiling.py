@@ -0,0 +1,179 @@
+"""Optional per-request profiling.
+
+ProfilingMiddleware records for every request the view name, total time,
+number of SQL queries, time spent in the database and the number of duplicate
+SQL statements (the same statement executed more than once, typically a
+missing select_related or prefetch_related). Requests slower than
+PROFILING_SLOW_REQUEST seconds are logged as JSON to the logger
+"svpb.profiling". The samples are buffered in memory and written to
+RequestSample in batches, keeping the latest PROFILING_WINDOW samples per view
+for the percentiles shown on the profiling page and by the profiling_report
+management command.
+
+The middleware stays in MIDDLEWARE; unless PROFILING_ENABLED is set, it raises
+MiddlewareNotUsed and Django removes it from the request chain.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from itertools import groupby
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connection
+
+from svpb.models import RequestSample
+
+logger = logging.getLogger(__name__)
+
+
+class QueryRecorder:
+    """Execute wrapper counting queries, their time and repeated statements."""
+
+    def __init__(self):
+        self.statements = Counter()
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.statements[sql] += 1
+
+    @property
+    def queries(self):
+        return sum(self.statements.values())
+
+    @property
+    def duplicates(self):
+        return sum(n - 1 for n in self.statements.values())
+
+    def most_duplicated(self, anzahl=5):
+        return [(sql, n) for sql, n in self.statements.most_common(anzahl) if n > 1]
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, "PROFILING_ENABLED", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_request = settings.PROFILING_SLOW_REQUEST
+        self.window = settings.PROFILING_WINDOW
+        self.flush_every = settings.PROFILING_FLUSH_EVERY
+        self.samples = []
+        self.lock = threading.Lock()
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        seconds = time.perf_counter() - start
+
+        match = getattr(request, "resolver_match", None)
+        sample = RequestSample(
+            view=(match.view_name if match else "-")[:200],
+            status=response.status_code,
+            seconds=seconds,
+            queries=recorder.queries,
+            db_seconds=recorder.seconds,
+            duplicates=recorder.duplicates,
+        )
+        if seconds >= self.slow_request:
+            self.log_slow_request(request, sample, recorder)
+
+        with self.lock:
+            self.samples.append(sample)
+            if len(self.samples) < self.flush_every:
+                return response
+            samples, self.samples = self.samples, []
+        self.flush(samples)
+        return response
+
+    def log_slow_request(self, request, sample, recorder):
+        logger.warning(json.dumps({
+            "event": "slow_request",
+            "view": sample.view,
+            "method": request.method,
+            "path": request.path,
+            "status": sample.status,
+            "seconds": round(sample.seconds, 3),
+            "queries": sample.queries,
+            "db_seconds": round(sample.db_seconds, 3),
+            "duplicates": sample.duplicates,
+            "duplicated_sql": [
+                {"sql": sql[:500], "count": n}
+                for sql, n in recorder.most_duplicated()
+            ],
+        }, ensure_ascii=False))
+
+    def flush(self, samples):
+        """Write samples and drop samples beyond the window of their views."""
+        try:
+            RequestSample.objects.bulk_create(samples)
+            for view in set(s.view for s in samples):
+                aelteste = (
+                    RequestSample.objects.filter(view=view)
+                    .order_by("-id")
+                    .values_list("id", flat=True)[self.window:self.window + 1]
+                )
+                if aelteste:
+                    RequestSample.objects.filter(
+                        view=view, id__lte=aelteste[0]
+                    ).delete()
+        except DatabaseError:
+            # profiling must never break the site
+            logger.exception("Could not store request samples")
+
+
+def percentile(werte, p):
+    """p-th percentile (nearest rank) of a sorted, non-empty list."""
+    rang = max(1, -(-len(werte) * p // 100))
+    return werte[int(rang) - 1]
+
+
+def statistics():
+    """Per-view percentiles of all stored samples, slowest views first.
+
+    Returns a list of dicts with view, count, p50, p90, p99 and max of the
+    request time in seconds, median queries and DB time, and the maximum
+    number of duplicate queries.
+    """
+    result = []
+    samples = RequestSample.objects.order_by("view").values_list(
+        "view", "seconds", "queries", "db_seconds", "duplicates"
+    )
+    for view, gruppe in groupby(samples, key=lambda s: s[0]):
+        _, seconds, queries, db_seconds, duplicates = zip(*gruppe)
+        seconds = sorted(seconds)
+        result.append({
+            "view": view,
+            "count": len(seconds),
+            "p50": percentile(seconds, 50),
+            "p90": percentile(seconds, 90),
+            "p99": percentile(seconds, 99),
+            "max": seconds[-1],
+            "queries": percentile(sorted(queries), 50),
+            "db_seconds": percentile(sorted(db_seconds), 50),
+            "duplicates": max(duplicates),
+        })
+    result.sort(key=lambda s: s["p90"], reverse=True)
+    return result
+
+
+def format_table(stats):
+    """Format statistics() as a plain text table."""
+    lines = ["{:<45} {:>6} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8} {:>6}".format(
+        "View", "Anzahl", "p50 (s)", "p90 (s)", "p99 (s)", "max (s)",
+        "Queries", "DB (s)", "Dupl.")]
+    for s in stats:
+        lines.append(
+            "{view:<45} {count:>6} {p50:>8.3f} {p90:>8.3f} {p99:>8.3f} "
+            "{max:>8.3f} {queries:>8} {db_seconds:>8.3f} {duplicates:>6}".format(**s)
+        )
+    return "\n".join(lines)
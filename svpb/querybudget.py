@@ -0,0 +1,138 @@
+"""Query budgets for the table pages based on FilteredListView.
+
+Every page in PAGES is rendered with the test client, counting SQL queries and
+measuring wall time. The allowed number of queries per page is checked into
+BUDGET_FILE; svpb/test_querybudget.py fails if a page exceeds it, and the
+query_budget management command prints a comparison table.
+"""
+
+import json
+import os
+import time
+from collections import namedtuple
+
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from arbeitsplan import models as ap_models
+
+BUDGET_FILE = os.path.join(os.path.dirname(__file__), "query_budgets.json")
+
+Page = namedtuple("Page", ["key", "urlname", "kwargs", "query"])
+"""A page to measure. kwargs is a function of the Vorstand user measured."""
+
+Measurement = namedtuple(
+    "Measurement", ["key", "url", "status", "queries", "seconds", "budget"]
+)
+
+
+def _aufgabe_mit_stundenplan(user):
+    """The Aufgabe with Stundenplan having the most Zuteilungen."""
+    aufgabe = (
+        ap_models.Aufgabe.objects.filter(stundenplan__anzahl__gt=0)
+        .annotate(anzahl_zuteilungen=Count("zuteilung", distinct=True))
+        .order_by("-anzahl_zuteilungen", "id")
+        .first()
+    )
+    return {"aufgabeid": aufgabe.id}
+
+
+def _aufgabe(user):
+    """The Aufgabe having the most Meldungen."""
+    aufgabe = (
+        ap_models.Aufgabe.objects.annotate(anzahl_meldungen=Count("meldung"))
+        .order_by("-anzahl_meldungen", "id")
+        .first()
+    )
+    return {"aufgabe": aufgabe.id}
+
+
+PAGES = [
+    Page("aufgaben", "arbeitsplan-aufgaben", None, ""),
+    Page("aufgabenVorstand", "arbeitsplan-aufgabenVorstand", None, ""),
+    Page("aufgabengruppeList", "arbeitsplan-aufgabengruppeList", None, ""),
+    Page("meldung", "arbeitsplan-meldung", None, ""),
+    Page("meldungListe", "arbeitsplan-meldungListe", None, ""),
+    Page("meldungVorstand", "arbeitsplan-meldungVorstand", None, ""),
+    Page("zuteilunglist-me", "arbeitsplan-zuteilunglist",
+         lambda user: {"wer": "me"}, ""),
+    Page("zuteilunglist-all", "arbeitsplan-zuteilunglist",
+         lambda user: {"wer": "all"}, ""),
+    Page("manuellezuteilung", "arbeitsplan-manuellezuteilung", None, ""),
+    Page("manuellezuteilung-frei", "arbeitsplan-manuellezuteilung", None,
+         "?mitglied_ausgelastet=FR&filter=Filter+anwenden"),
+    Page("manuellezuteilungAufgabe", "arbeitsplan-manuellezuteilungAufgabe",
+         _aufgabe, "?mitglied_ausgelastet=AM&filter=Filter+anwenden"),
+    Page("zuteilungUebersicht", "arbeitsplan-zuteilungUebersicht", None,
+         "?stundenplan=on&filter=Filter+anwenden"),
+    Page("stundenplaeneEdit", "arbeitsplan-stundenplaeneEdit",
+         _aufgabe_mit_stundenplan, ""),
+    Page("leistungListe", "arbeitsplan-leistungListe", None, ""),
+    Page("leistungBearbeiten-me", "arbeitsplan-leistungBearbeiten",
+         lambda user: {"zustaendig": "me"}, ""),
+    Page("leistungBearbeiten-all", "arbeitsplan-leistungBearbeiten",
+         lambda user: {"zustaendig": "all"}, ""),
+    Page("salden", "arbeitsplan-salden", None, ""),
+    Page("benachrichtigen-zuteilung", "arbeitsplan-benachrichtigen-zuteilung",
+         None, ""),
+    Page("benachrichtigen-meldungsaufforderung",
+         "arbeitsplan-benachrichtigen-meldungsaufforderung", None, ""),
+    Page("accountList", "accountList", None, ""),
+    Page("accountFilteredList", "accountFilteredList", None,
+         "?filter=Filter+anwenden"),
+    Page("impersonateListe", "arbeitsplan-impersonateListe", None, ""),
+]
+
+
+def load_budgets():
+    """Return the budget file contents.
+
+    "data" holds the arguments of synthetic.generate_arbeitsplan used to
+    establish the budgets, "queries" maps page keys to the allowed number of
+    queries for that data.
+    """
+    with open(BUDGET_FILE) as f:
+        return json.load(f)
+
+
+def measure(user, pages=PAGES):
+    """Render all pages as user and return a list of Measurement.
+
+    Each page is requested twice and only the second request is measured, so
+    one-off work (e.g. default Meldungen, sessions) does not count.
+    """
+    budgets = load_budgets()["queries"]
+    client = Client()
+    client.force_login(user)
+
+    results = []
+    for page in pages:
+        url = reverse(page.urlname,
+                      kwargs=page.kwargs(user) if page.kwargs else None)
+        url += page.query
+        client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = client.get(url)
+            seconds = time.perf_counter() - start
+        results.append(Measurement(page.key, url, response.status_code,
+                                   len(queries), seconds,
+                                   budgets.get(page.key)))
+    return results
+
+
+def format_table(results):
+    """Format measurements as a plain text table."""
+    lines = ["{:<40} {:>6} {:>8} {:>8} {:>9}".format(
+        "Seite", "Status", "Queries", "Budget", "Zeit (s)")]
+    for r in results:
+        lines.append("{:<40} {:>6} {:>8} {:>8} {:>9.3f}{}".format(
+            r.key, r.status, r.queries,
+            "-" if r.budget is None else r.budget,
+            r.seconds,
+            "  ÜBER BUDGET" if r.budget is not None and r.queries > r.budget else "",
+        ))
+    return "\n".join(lines)
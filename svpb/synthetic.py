@@ -0,0 +1,329 @@
+"""Synthetic season data for benchmarks and load tests.
+
+All objects are created with bulk_create, and all random choices come from a
+single random.Random instance, so the same seed always produces the same data.
+"""
+
+import datetime
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.db.models import Max
+
+from arbeitsplan import models as ap_models
+from boote.models import Boat, BoatIssue, BoatType, Booking
+
+VORNAMEN = [
+    "Anna", "Ben", "Clara", "David", "Emma", "Felix", "Greta", "Hannes", "Ida",
+    "Jonas", "Karla", "Lukas", "Marie", "Niklas", "Olga", "Paul", "Rosa", "Simon",
+    "Thea", "Uwe", "Vera", "Wolfgang", "Xenia", "Yannik", "Zoe",
+]
+NACHNAMEN = [
+    "Bauer", "Becker", "Fischer", "Hoffmann", "Koch", "Krüger", "Lange", "Meyer",
+    "Müller", "Neumann", "Richter", "Schmidt", "Schneider", "Schulz", "Schwarz",
+    "Wagner", "Weber", "Wolf", "Zimmermann",
+]
+AUFGABENGRUPPEN = [
+    "Kranen", "Bewirtung", "Hafen", "Gelände", "Jugend", "Regatta", "Werkstatt",
+    "Clubhaus",
+]
+TAETIGKEITEN = [
+    "Aufbau", "Abbau", "Putzen", "Streichen", "Kuchenverkauf", "Grillen",
+    "Stegdienst", "Kranfahrer", "Rasenmähen", "Ausschank", "Aufsicht", "Reparatur",
+]
+
+# Status of Mitglieder, weighted roughly as in the club
+STATUS_GEWICHTE = [
+    (ap_models.Mitglied.Status.ADULT, 60),
+    (ap_models.Mitglied.Status.YOUTH, 10),
+    (ap_models.Mitglied.Status.PUPIL, 8),
+    (ap_models.Mitglied.Status.CHILD, 8),
+    (ap_models.Mitglied.Status.PASSIVE, 6),
+    (ap_models.Mitglied.Status.PARTNER_PASSIVE, 2),
+    (ap_models.Mitglied.Status.CHILD_NO_FEE, 6),
+]
+LEISTUNG_STATUS_GEWICHTE = [
+    (ap_models.Leistung.Status.OPEN, 30),
+    (ap_models.Leistung.Status.ACCEPTED, 55),
+    (ap_models.Leistung.Status.INQUIRY, 10),
+    (ap_models.Leistung.Status.REJECTED, 5),
+]
+
+BOOTSTYPEN = [
+    ("Laser", "4,23 m", "1,37 m", "0,79 m"),
+    ("420er", "4,20 m", "1,71 m", "0,97 m"),
+    ("Pirat", "5,00 m", "1,62 m", "1,05 m"),
+    ("Mariner 19", "5,80 m", "2,08 m", "1,20 m"),
+]
+BOOTSNAMEN = [
+    "Möwe", "Albatros", "Kormoran", "Seeschwalbe", "Pelikan", "Reiher", "Kranich",
+]
+SCHAEDEN = [
+    "Fock eingerissen", "Ruder locker", "Pinne gebrochen", "Leck im Rumpf",
+    "Großschot verschlissen", "Schwert klemmt",
+]
+BOOKING_TYP_GEWICHTE = [("PRV", 70), ("AUS", 15), ("REG", 10), ("REP", 5)]
+# Bookings are made in half-hour slots from 8:00 to 22:00
+BOOKING_START = 8
+BOOKING_SLOTS = 28
+
+
+def _gewichtet(rng, gewichte):
+    werte, gewicht = zip(*gewichte)
+    return rng.choices(werte, weights=gewicht)[0]
+
+
+def generate_arbeitsplan(mitglieder=200, aufgaben=40, jahr=None, seed=0,
+                         passwort="Test"):
+    """Create a season of Arbeitsplan data.
+
+    Args:
+        - mitglieder: number of Users, each with a Mitglied
+        - aufgaben: number of Aufgaben; about a third have a Stundenplan
+        - jahr: year of the season, defaults to the current year
+        - seed: seed of the random number generator
+        - passwort: password of all created users
+
+    Every 50th Mitglied joins the Vorstand group. Returns a dict with the number
+    of created objects per model name, plus the created users as "users" and
+    the created Vorstand users as "vorstand".
+    """
+    return _arbeitsplan(random.Random(seed), mitglieder, aufgaben, jahr, passwort)
+
+
+def generate_season(mitglieder=200, aufgaben=40, boote=10, tage=120, jahr=None,
+                    seed=0, passwort="Test"):
+    """Create a season of Arbeitsplan and boat booking data.
+
+    Args:
+        - mitglieder, aufgaben, jahr, passwort: see generate_arbeitsplan
+        - boote: number of Boats; most of them are club boats
+        - tage: number of days with Bookings, two thirds of them in the past
+        - seed: seed of the random number generator
+
+    Returns a dict as generate_arbeitsplan, with counts of the boote models
+    added.
+    """
+    rng = random.Random(seed)
+    result = _arbeitsplan(rng, mitglieder, aufgaben, jahr, passwort)
+    result.update(_boote(rng, result["users"], result["vorstand"], boote, tage))
+    return result
+
+
+def _arbeitsplan(rng, mitglieder, aufgaben, jahr, passwort):
+    jahr = jahr or datetime.date.today().year
+    saisonbeginn = datetime.date(jahr, 3, 1)
+
+    # continue numbering after existing users, to allow repeated runs
+    start = (User.objects.aggregate(Max("id"))["id__max"] or 0) + 1
+    passwort = make_password(passwort)
+
+    users = User.objects.bulk_create([
+        User(
+            username=f"m{nummer:06d}",
+            first_name=rng.choice(VORNAMEN),
+            last_name=f"{rng.choice(NACHNAMEN)}-{nummer}",
+            email=f"m{nummer:06d}@example.com",
+            password=passwort,
+        )
+        for nummer in range(start, start + mitglieder)
+    ])
+    # bulk_create does not send post_save, so create the Mitglieder here
+    ap_models.Mitglied.objects.bulk_create([
+        ap_models.Mitglied(
+            user=user,
+            mitgliedsnummer=f"{start + i:05d}",
+            status=_gewichtet(rng, STATUS_GEWICHTE),
+            gender=rng.choice(ap_models.Mitglied.Gender.values),
+            geburtsdatum=datetime.date(rng.randint(1940, 2015), rng.randint(1, 12),
+                                       rng.randint(1, 28)),
+            arbeitslast=rng.choices([12, 0, 6, 99], weights=[80, 10, 5, 5])[0],
+            strasse=f"Hafenweg {rng.randint(1, 200)}",
+            plz=rng.randint(10000, 99999),
+            ort="Paderborn",
+        )
+        for i, user in enumerate(users)
+    ])
+
+    vorstand = users[::50]
+    gruppe, _ = Group.objects.get_or_create(name="Vorstand")
+    gruppe.user_set.add(*vorstand)
+
+    gruppen = ap_models.Aufgabengruppe.objects.bulk_create([
+        ap_models.Aufgabengruppe(
+            gruppe=f"{name} {start}",
+            verantwortlich=rng.choice(vorstand),
+        )
+        for name in AUFGABENGRUPPEN[:max(1, min(len(AUFGABENGRUPPEN), aufgaben // 5))]
+    ])
+
+    aufgabenListe = []
+    for i in range(aufgaben):
+        mitStundenplan = rng.random() < 0.3
+        aufgabenListe.append(ap_models.Aufgabe(
+            aufgabe=f"{rng.choice(TAETIGKEITEN)} {start}-{i}",
+            verantwortlich=rng.choice(vorstand),
+            gruppe=rng.choice(gruppen),
+            anzahl=rng.randint(1, 12),
+            stunden=rng.randint(2, 6) if mitStundenplan else rng.randint(1, 12),
+            datum=(saisonbeginn + datetime.timedelta(days=rng.randint(0, 280))
+                   if mitStundenplan or rng.random() < 0.7
+                   else None),
+        ))
+        aufgabenListe[-1].mitStundenplan = mitStundenplan
+    ap_models.Aufgabe.objects.bulk_create(aufgabenListe)
+
+    stundenplaene = {}
+    for aufgabe in aufgabenListe:
+        if aufgabe.mitStundenplan:
+            beginn = rng.randint(ap_models.Stundenplan.startZeit, 16)
+            stundenplaene[aufgabe.id] = list(range(beginn, beginn + aufgabe.stunden))
+    ap_models.Stundenplan.objects.bulk_create([
+        ap_models.Stundenplan(aufgabe_id=aufgabeId, uhrzeit=uhrzeit,
+                              anzahl=rng.randint(1, 4))
+        for aufgabeId, uhrzeiten in stundenplaene.items()
+        for uhrzeit in uhrzeiten
+    ])
+
+    meldungen = []
+    zuteilungen = []
+    besetzung = dict((a.id, 0) for a in aufgabenListe)
+    for user in users:
+        for aufgabe in rng.sample(aufgabenListe, min(len(aufgabenListe),
+                                                     rng.randint(0, 6))):
+            ja = rng.random() < 0.85
+            meldungen.append(ap_models.Meldung(
+                melder=user,
+                aufgabe=aufgabe,
+                prefMitglied=(ap_models.Meldung.Preferences.YES if ja
+                              else ap_models.Meldung.Preferences.NO),
+                bemerkung=rng.choice(["", "", "", "Gerne mit Partner",
+                                      "Nur vormittags"]),
+            ))
+            if ja and besetzung[aufgabe.id] < aufgabe.anzahl and rng.random() < 0.6:
+                besetzung[aufgabe.id] += 1
+                zuteilungen.append(ap_models.Zuteilung(
+                    aufgabe=aufgabe,
+                    ausfuehrer=user,
+                    zusatzhelfer=rng.choices([0, 1], weights=[90, 10])[0],
+                ))
+    ap_models.Meldung.objects.bulk_create(meldungen)
+    ap_models.Zuteilung.objects.bulk_create(zuteilungen)
+
+    stundenZuteilungen = []
+    leistungen = []
+    heute = datetime.date.today()
+    for zuteilung in zuteilungen:
+        aufgabe = zuteilung.aufgabe
+        stunden = aufgabe.stunden
+        if aufgabe.id in stundenplaene:
+            uhrzeiten = stundenplaene[aufgabe.id]
+            laenge = rng.randint(1, min(3, len(uhrzeiten)))
+            beginn = rng.randint(0, len(uhrzeiten) - laenge)
+            stunden = laenge
+            stundenZuteilungen.extend(
+                ap_models.StundenZuteilung(zuteilung=zuteilung, uhrzeit=uhrzeit)
+                for uhrzeit in uhrzeiten[beginn:beginn + laenge]
+            )
+        if rng.random() < 0.5:
+            leistungen.append(ap_models.Leistung(
+                melder=zuteilung.ausfuehrer,
+                aufgabe=aufgabe,
+                wann=min(aufgabe.datum or heute, heute),
+                zeit=stunden + rng.choice([0, 0, 0.5, -0.5]) if stunden > 1 else stunden,
+                status=_gewichtet(rng, LEISTUNG_STATUS_GEWICHTE),
+                bemerkung=rng.choice(["", "", "Hat Spaß gemacht"]),
+            ))
+    ap_models.StundenZuteilung.objects.bulk_create(stundenZuteilungen)
+    ap_models.Leistung.objects.bulk_create(leistungen)
+
+    return {
+        "User": len(users),
+        "Aufgabengruppe": len(gruppen),
+        "Aufgabe": len(aufgabenListe),
+        "Stundenplan": sum(len(u) for u in stundenplaene.values()),
+        "Meldung": len(meldungen),
+        "Zuteilung": len(zuteilungen),
+        "StundenZuteilung": len(stundenZuteilungen),
+        "Leistung": len(leistungen),
+        "users": users,
+        "vorstand": vorstand,
+    }
+
+
+def _boote(rng, users, vorstand, boote, tage):
+    typen = BoatType.objects.bulk_create([
+        BoatType(name=name, url="https://example.com", length=laenge,
+                 beam=breite, draught=tiefgang)
+        for name, laenge, breite, tiefgang in BOOTSTYPEN
+    ])
+    boats = Boat.objects.bulk_create([
+        Boat(
+            owner=rng.choice(vorstand),
+            type=rng.choice(typen),
+            name=f"{rng.choice(BOOTSNAMEN)} {i + 1}",
+            active=rng.random() < 0.9,
+            club_boat=rng.random() < 0.8,
+            remarks="",
+        )
+        for i in range(boote)
+    ])
+
+    # per boat and day, bookings are consecutive and do not overlap
+    heute = datetime.date.today()
+    erster = heute - datetime.timedelta(days=tage * 2 // 3)
+    bookings = []
+    for boat in boats:
+        for tag in range(tage):
+            datum = erster + datetime.timedelta(days=tag)
+            slot = rng.randint(0, 8)
+            for _ in range(rng.choices([0, 1, 2, 3], weights=[50, 30, 15, 5])[0]):
+                laenge = rng.randint(2, 8)
+                if slot + laenge > BOOKING_SLOTS:
+                    break
+                bookings.append(Booking(
+                    user=rng.choice(users),
+                    created_date=datum - datetime.timedelta(days=rng.randint(0, 30)),
+                    boat=boat,
+                    status=rng.choices([1, 0], weights=[85, 15])[0],
+                    type=_gewichtet(rng, BOOKING_TYP_GEWICHTE),
+                    date=datum,
+                    time_from=_slot(slot),
+                    time_to=_slot(slot + laenge),
+                    notified=datum < heute,
+                ))
+                slot += laenge + rng.randint(0, 4)
+    Booking.objects.bulk_create(bookings)
+
+    issues = []
+    for boat in boats:
+        for _ in range(rng.choices([0, 1, 2, 3], weights=[50, 25, 15, 10])[0]):
+            gemeldet = erster + datetime.timedelta(days=rng.randint(0, tage - 1))
+            behoben = rng.random() < 0.6
+            issues.append(BoatIssue(
+                boat=boat,
+                status=2 if behoben else 1,
+                reported_by=rng.choice(users),
+                reported_date=gemeldet,
+                reported_descr=rng.choice(SCHAEDEN),
+                fixed_by=rng.choice(vorstand) if behoben else None,
+                fixed_date=(gemeldet + datetime.timedelta(days=rng.randint(0, 14))
+                            if behoben else None),
+                fixed_descr="Repariert" if behoben else None,
+                notified=True,
+            ))
+    BoatIssue.objects.bulk_create(issues)
+
+    return {
+        "BoatType": len(typen),
+        "Boat": len(boats),
+        "Booking": len(bookings),
+        "BoatIssue": len(issues),
+    }
+
+
+def _slot(slot):
+    """Start time of the half-hour booking slot with index slot."""
+    minuten = BOOKING_START * 60 + slot * 30
+    return datetime.time(minuten // 60, minuten % 60)
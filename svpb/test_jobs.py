@@ -0,0 +1,156 @@
+"""Tests of the background job queue."""
+
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.utils import timezone
+
+from svpb import jobs
+from svpb.models import Job
+
+WORKDIRS = []
+
+
+def ergebnis(job, workdir):
+    WORKDIRS.append(workdir)
+    path = os.path.join(workdir, "ergebnis.txt")
+    with open(path, "w") as f:
+        f.write(job.arguments["text"])
+    job.message = "geschrieben"
+    return path
+
+
+def fehler(job, workdir):
+    raise ValueError("kaputt")
+
+
+class JobTests(TestCase):
+    fixtures = [
+        "arbeitsplan/fixtures/members.json",
+        "mitglieder/fixtures/groups.json",
+        "mitglieder/fixtures/user.json",
+    ]
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(SENDFILE_ROOT=self.tmpdir.name)
+        self.settings.enable()
+        self.vorstand = User.objects.get(username="Vorstand")
+        self.client = Client()
+        self.client.force_login(self.vorstand)
+
+    def tearDown(self):
+        self.settings.disable()
+        self.tmpdir.cleanup()
+
+    def test_run(self):
+        """Test that a job runs in a temporary directory and keeps its result."""
+        job = jobs.enqueue("svpb.test_jobs.ergebnis", "Test", user=self.vorstand,
+                           text="Hallo")
+        self.assertEqual(job.status, Job.Status.WAITING)
+        response = self.client.get("/jobs/")
+        self.assertContains(response, 'http-equiv="refresh"')
+
+        out = StringIO()
+        call_command("run_jobs", once=True, stdout=out)
+        self.assertIn("Test: Fertig", out.getvalue())
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.message, job.result_name),
+                         (Job.Status.DONE, "geschrieben", "ergebnis.txt"))
+        self.assertGreaterEqual(job.dauer, 0)
+        self.assertFalse(os.path.exists(WORKDIRS[-1]))
+        with open(os.path.join(self.tmpdir.name, job.result)) as f:
+            self.assertEqual(f.read(), "Hallo")
+
+        response = self.client.get("/jobs/")
+        self.assertNotContains(response, 'http-equiv="refresh"')
+        self.assertContains(response, f'href="/jobs/{job.pk}/"')
+        response = self.client.get(f"/jobs/{job.pk}/")
+        self.assertEqual(response.status_code, 200)
+
+        # nothing left to do
+        self.assertEqual(jobs.run_waiting(), [])
+
+    def test_failure(self):
+        """Test that a failing job is marked and does not stop the others."""
+        with self.assertRaises(ImportError):
+            jobs.enqueue("svpb.test_jobs.gibtsnicht", "Test")
+
+        kaputt = jobs.enqueue("svpb.test_jobs.fehler", "Kaputt")
+        gut = jobs.enqueue("svpb.test_jobs.ergebnis", "Gut", text="")
+        with self.assertLogs("svpb.jobs", "ERROR"):
+            self.assertEqual(len(jobs.run_waiting()), 2)
+
+        kaputt.refresh_from_db()
+        self.assertEqual(kaputt.status, Job.Status.FAILED)
+        self.assertEqual(kaputt.message, "ValueError: kaputt")
+        self.assertEqual(Job.objects.get(pk=gut.pk).status, Job.Status.DONE)
+        self.assertEqual(self.client.get(f"/jobs/{kaputt.pk}/").status_code, 404)
+
+    def test_claim(self):
+        """Test that a job can be claimed by one worker only."""
+        job = jobs.enqueue("svpb.test_jobs.ergebnis", "Test", text="")
+        self.assertTrue(jobs.claim(job))
+        self.assertFalse(jobs.claim(Job.objects.get(pk=job.pk)))
+        self.assertEqual(jobs.run_waiting(), [])
+
+    @override_settings(JOB_TIMEOUT=3600)
+    def test_recover_stale(self):
+        """Test that jobs running longer than JOB_TIMEOUT are marked as failed."""
+        alt = jobs.enqueue("svpb.test_jobs.ergebnis", "Alt", text="")
+        neu = jobs.enqueue("svpb.test_jobs.ergebnis", "Neu", text="")
+        jobs.claim(alt)
+        jobs.claim(neu)
+        Job.objects.filter(pk=alt.pk).update(
+            started=timezone.now() - timedelta(seconds=3601)
+        )
+
+        out = StringIO()
+        call_command("run_jobs", once=True, stdout=out)
+        self.assertIn("1 stale jobs marked as failed", out.getvalue())
+        alt.refresh_from_db()
+        self.assertEqual(alt.status, Job.Status.FAILED)
+        self.assertIn("60 Minuten", alt.message)
+        self.assertEqual(Job.objects.get(pk=neu.pk).status, Job.Status.RUNNING)
+
+    @override_settings(JOB_RESULT_DAYS=30,
+                       JOB_RESULT_DAYS_BY_FUNCTION={"svpb.test_jobs.passwort": 7})
+    def test_cleanup_results(self):
+        """Test that result files are deleted after their retention time."""
+        behalten = jobs.enqueue("svpb.test_jobs.ergebnis", "Behalten", text="")
+        loeschen = jobs.enqueue("svpb.test_jobs.ergebnis", "Löschen", text="")
+        passwort = jobs.enqueue("svpb.test_jobs.ergebnis", "Passwort", text="")
+        jobs.run_waiting()
+        Job.objects.filter(pk=passwort.pk).update(function="svpb.test_jobs.passwort")
+        Job.objects.filter(pk__in=[behalten.pk, passwort.pk]).update(
+            finished=timezone.now() - timedelta(days=8)
+        )
+        Job.objects.filter(pk=loeschen.pk).update(
+            finished=timezone.now() - timedelta(days=31)
+        )
+
+        out = StringIO()
+        call_command("run_jobs", once=True, stdout=out)
+        self.assertIn(f"Job {loeschen.pk} Löschen: result file deleted", out.getvalue())
+        for job, vorhanden in ((behalten, True), (loeschen, False), (passwort, False)):
+            with self.subTest(job=job.title):
+                job.refresh_from_db()
+                self.assertEqual(bool(job.result), vorhanden)
+                self.assertEqual(
+                    os.path.exists(os.path.join(self.tmpdir.name, "jobs", str(job.pk))),
+                    vorhanden,
+                )
+        self.assertEqual(jobs.cleanup_results(), [])
+
+    def test_permission(self):
+        """Test that only the Vorstand sees the jobs."""
+        self.client.force_login(User.objects.get(username="Mitglied"))
+        response = self.client.get("/jobs/")
+        self.assertRedirects(response, "/keinVorstand/?next=/jobs/",
+                             fetch_redirect_response=False)
@@ -0,0 +1,107 @@
+"""Tests of the request profiling middleware."""
+
+import json
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, override_settings
+
+from svpb import profiling
+from svpb.models import RequestSample
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_FLUSH_EVERY=1,
+                   PROFILING_SLOW_REQUEST=0, PROFILING_WINDOW=3)
+class ProfilingTests(TestCase):
+    fixtures = [
+        "arbeitsplan/fixtures/members.json",
+        "mitglieder/fixtures/groups.json",
+        "mitglieder/fixtures/user.json",
+    ]
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(User.objects.get(username="Vorstand"))
+
+    @override_settings(PROFILING_ENABLED=False)
+    def test_disabled(self):
+        """Test that Django drops the middleware if profiling is off."""
+        with self.assertRaises(MiddlewareNotUsed):
+            profiling.ProfilingMiddleware(lambda request: HttpResponse())
+
+        self.client.get("/arbeitsplan/aufgaben/")
+        self.assertFalse(RequestSample.objects.exists())
+
+    def test_samples(self):
+        """Test that requests are stored per view and logged when slow."""
+        with self.assertLogs("svpb.profiling", "WARNING") as logs:
+            response = self.client.get("/arbeitsplan/aufgaben/")
+        self.assertEqual(response.status_code, 200)
+
+        sample = RequestSample.objects.get()
+        self.assertEqual(sample.view, "arbeitsplan-aufgaben")
+        self.assertGreater(sample.queries, 0)
+        self.assertLessEqual(sample.db_seconds, sample.seconds)
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["event"], "slow_request")
+        self.assertEqual(record["path"], "/arbeitsplan/aufgaben/")
+        self.assertEqual(record["queries"], sample.queries)
+
+        # only the latest PROFILING_WINDOW samples are kept
+        with self.assertLogs("svpb.profiling", "WARNING"):
+            for _ in range(4):
+                self.client.get("/arbeitsplan/aufgaben/")
+        self.assertEqual(
+            RequestSample.objects.filter(view="arbeitsplan-aufgaben").count(), 3
+        )
+
+    def test_duplicates(self):
+        """Test that repeated SQL statements are counted and logged."""
+        def view(request):
+            for username in ("Vorstand", "Mitglied", "Vorstand"):
+                User.objects.get(username=username)
+            return HttpResponse()
+
+        middleware = profiling.ProfilingMiddleware(view)
+        with self.assertLogs("svpb.profiling", "WARNING") as logs:
+            middleware(RequestFactory().get("/"))
+
+        sample = RequestSample.objects.get()
+        self.assertEqual((sample.view, sample.queries, sample.duplicates),
+                         ("-", 3, 2))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["duplicated_sql"][0]["count"], 3)
+
+    @override_settings(PROFILING_SLOW_REQUEST=60)
+    def test_statistics(self):
+        """Test percentiles, the Vorstand page and the command."""
+        RequestSample.objects.bulk_create(
+            RequestSample(view="langsam", status=200, seconds=s, queries=10,
+                          db_seconds=0.01, duplicates=s)
+            for s in range(1, 11)
+        )
+        RequestSample.objects.create(view="schnell", status=200, seconds=0.1,
+                                     queries=2, db_seconds=0.0, duplicates=0)
+
+        stats = profiling.statistics()
+        self.assertEqual([s["view"] for s in stats], ["langsam", "schnell"])
+        self.assertEqual((stats[0]["count"], stats[0]["p50"], stats[0]["p90"],
+                          stats[0]["p99"], stats[0]["duplicates"]),
+                         (10, 5, 9, 10, 10))
+
+        response = self.client.get("/profiling/")
+        self.assertContains(response, "langsam")
+        self.client.force_login(User.objects.get(username="Mitglied"))
+        response = self.client.get("/profiling/")
+        self.assertRedirects(response, "/keinVorstand/?next=/profiling/",
+                             fetch_redirect_response=False)
+
+        out = StringIO()
+        call_command("profiling_report", view=["schnell"], reset=True, stdout=out)
+        self.assertIn("schnell", out.getvalue())
+        self.assertNotIn("langsam", out.getvalue())
+        self.assertFalse(RequestSample.objects.exists())
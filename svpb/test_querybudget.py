@@ -0,0 +1,50 @@
+"""Query budget regression tests for all table pages."""
+
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from svpb import querybudget, synthetic
+
+
+class QueryBudgetTests(TestCase):
+    """Render all FilteredListView pages on synthetic data and check budgets."""
+
+    fixtures = [
+        "mitglieder/fixtures/groups.json",
+        "mitglieder/fixtures/po.json",
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.generated = synthetic.generate_arbeitsplan(
+            **querybudget.load_budgets()["data"]
+        )
+
+    def test_generated_data(self):
+        """Test that the synthetic data covers all models."""
+        for model, anzahl in self.generated.items():
+            with self.subTest(model=model):
+                self.assertTrue(anzahl)
+
+    def test_budgets(self):
+        """Test that no page exceeds its query budget."""
+        results = querybudget.measure(self.generated["vorstand"][0])
+
+        self.assertEqual(
+            sorted(r.key for r in results),
+            sorted(querybudget.load_budgets()["queries"]),
+        )
+        for r in results:
+            with self.subTest(page=r.key):
+                self.assertEqual(r.status, 200)
+                self.assertLessEqual(r.queries, r.budget, r.url)
+
+    def test_command(self):
+        """Test the comparison table of the management command."""
+        out = StringIO()
+        call_command("query_budget", page=["salden", "meldung"], stdout=out)
+        self.assertIn("salden", out.getvalue())
+        self.assertIn("meldung", out.getvalue())
+        self.assertNotIn("aufgaben", out.getvalue())
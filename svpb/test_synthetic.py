@@ -0,0 +1,80 @@
+"""Tests for the synthetic season data and the generate_season command."""
+
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.test import TestCase
+
+from arbeitsplan import models as ap_models
+from boote.models import Booking
+from svpb import synthetic
+
+
+class GenerateSeasonTests(TestCase):
+    """Test the generated data and the management command."""
+
+    fixtures = [
+        "mitglieder/fixtures/groups.json",
+    ]
+
+    def fingerprint(self):
+        """Data of the generated season without ids and names."""
+        return (
+            list(ap_models.Aufgabe.objects.order_by("id")
+                 .values_list("anzahl", "stunden", "datum")),
+            list(ap_models.Meldung.objects.order_by("id")
+                 .values_list("prefMitglied", "bemerkung")),
+            list(ap_models.Leistung.objects.order_by("id")
+                 .values_list("zeit", "status")),
+            list(Booking.objects.order_by("id")
+                 .values_list("date", "time_from", "time_to", "type", "status")),
+        )
+
+    def test_seed(self):
+        """Test that the same seed yields the same data."""
+        fingerprints = []
+        for seed in (1, 1, 2):
+            with transaction.atomic():
+                synthetic.generate_season(mitglieder=50, aufgaben=10, boote=3,
+                                          seed=seed)
+                fingerprints.append(self.fingerprint())
+                transaction.set_rollback(True)
+
+        self.assertEqual(fingerprints[0], fingerprints[1])
+        self.assertNotEqual(fingerprints[0], fingerprints[2])
+
+    def test_season(self):
+        """Test that the season covers all models and is consistent."""
+        result = synthetic.generate_season(mitglieder=300, aufgaben=30, boote=5)
+
+        for model in ("User", "Aufgabengruppe", "Aufgabe", "Stundenplan", "Meldung",
+                      "Zuteilung", "StundenZuteilung", "Leistung", "BoatType",
+                      "Boat", "Booking", "BoatIssue"):
+            with self.subTest(model=model):
+                self.assertTrue(result[model])
+        self.assertEqual(ap_models.Mitglied.objects.count(), 300)
+        self.assertEqual(
+            set(ap_models.Leistung.objects.values_list("status", flat=True)),
+            set(ap_models.Leistung.Status.values),
+        )
+        self.assertTrue(ap_models.Aufgabe.objects.filter(stundenplan=None).exists())
+
+        # active bookings of a boat never overlap
+        bookings = Booking.objects.order_by("boat", "date", "time_from")
+        for vorher, nachher in zip(bookings, bookings[1:]):
+            if (vorher.boat_id, vorher.date) == (nachher.boat_id, nachher.date):
+                self.assertLessEqual(vorher.time_to, nachher.time_from)
+
+    def test_command(self):
+        """Test that the command prints the counts and refuses without DEBUG."""
+        with self.assertRaises(CommandError):
+            call_command("generate_season", mitglieder=10, aufgaben=5,
+                         stdout=StringIO())
+
+        out = StringIO()
+        call_command("generate_season", mitglieder=10, aufgaben=5, boote=2,
+                     force=True, stdout=out)
+        self.assertIn("Booking", out.getvalue())
+        self.assertEqual(ap_models.Mitglied.objects.count(), 10)
@@ -79,6 +79,20 @@ urlpatterns = [
         name="MediaCheck",
         ),
 
+    re_path(r'^profiling/$',
+        active_and_login_required(svpb.views.ProfilingView.as_view()),
+        name="profiling",
+        ),
+
+    path('jobs/',
+        active_and_login_required(svpb.views.JobListView.as_view()),
+        name="jobs",
+        ),
+    path('jobs/<int:pk>/',
+        active_and_login_required(svpb.views.JobResult.as_view()),
+        name="jobResult",
+        ),
+
     # Impersonation of other users:
     re_path(r'^impersonate/liste/$',
         active_and_login_required(mitglieder.views.ImpersonateListe.as_view()),
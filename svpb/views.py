@@ -3,16 +3,26 @@
 - Signal receiver to correctly create users
 - Permission checks
 - Logout
+- Request profiling statistics
+- Background jobs
 """
+import os
+
+from django.conf import settings
 from django.contrib.auth import logout
 from django.contrib.auth.decorators import user_passes_test
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from django.shortcuts import render
+from django.http import Http404
+from django.shortcuts import get_object_or_404, render
 from django.utils.decorators import method_decorator
+from django.views.generic import ListView, TemplateView, View
+from django_sendfile import sendfile
 
 from arbeitsplan.models import Mitglied
+from svpb import profiling
+from svpb.models import Job
 
 
 @receiver(post_save, sender=User)
@@ -43,3 +53,45 @@ class isVorstandMixin(object):
 def logout_view(request):
     logout(request)
     return render(request, "registration/logged_out.html", {})
+
+
+class ProfilingView(isVorstandMixin, TemplateView):
+    """Per-view percentiles recorded by svpb.profiling.ProfilingMiddleware."""
+
+    template_name = "profiling.html"
+
+    def get_context_data(self, **kwargs):
+        context = super(ProfilingView, self).get_context_data(**kwargs)
+        context["enabled"] = settings.PROFILING_ENABLED
+        context["window"] = settings.PROFILING_WINDOW
+        context["statistik"] = profiling.statistics()
+        return context
+
+
+class JobListView(isVorstandMixin, ListView):
+    """Latest background jobs (see svpb.jobs) with their results.
+
+    The page reloads itself while jobs are waiting or running.
+    """
+
+    template_name = "jobs.html"
+    queryset = Job.objects.select_related("created_by")[:50]
+
+    def get_context_data(self, **kwargs):
+        context = super(JobListView, self).get_context_data(**kwargs)
+        context["laufend"] = any(
+            job.status in (Job.Status.WAITING, Job.Status.RUNNING)
+            for job in context["object_list"]
+        )
+        return context
+
+
+class JobResult(isVorstandMixin, View):
+    """Download the result file of a finished job."""
+
+    def get(self, request, pk):
+        job = get_object_or_404(Job, pk=pk, status=Job.Status.DONE)
+        if not job.result:
+            raise Http404("Dieser Auftrag hat keine Ergebnisdatei.")
+        return sendfile(request, os.path.join(settings.SENDFILE_ROOT, job.result),
+                        attachment=True, attachment_filename=job.result_name)